@@ -0,0 +1,727 @@
+"""
+Checks for the Planner's features beyond find_plan's basic search. Each
+check_... function below checks one feature, usually by comparing what the
+feature does with an answer gotten in a simpler way, e.g., a repaired plan
+with the plan that find_plan finds from scratch. main() runs them all.
+
+Most of the checks use a copy of the blocks_htn domain that has commands
+that misbehave when told to.
+"""
+
+# kludge to make gtpyhop available regardless of whether the current directory
+# is the Examples directory or its parent (where gtpyhop.py is located)
+#
+import sys
+sys.path.append('../')
+import gtpyhop
+
+import asyncio, collections, json, os, signal, socket, subprocess, tempfile, threading, time
+import test_harness as th   # code for use in paging and debugging
+
+import blocks_htn, simple_htn
+
+
+# A copy of blocks_htn's domain, so that adding commands to it doesn't
+# change blocks_htn. Domain.copy doesn't put the copy into gtpyhop's list of
+# domains, so we don't print it with print_domain.
+the_domain = blocks_htn.the_domain.copy(__name__)
+
+
+################################################################################
+# commands that misbehave when told to
+
+# mishaps['misplace'] is the number of times c_stack should stack the block
+# on the wrong block, mishaps['crash'] is the number of times it should
+# crash (as if the process running it died), and mishaps['fail'] is the
+# number of times c_pickup should fail.
+mishaps = {'misplace': 0, 'crash': 0, 'fail': 0}
+
+
+class Crash(Exception):
+    pass
+
+
+def c_pickup(s, x):
+    if mishaps['fail'] > 0:
+        mishaps['fail'] -= 1
+        return False
+    return the_domain._action_dict['pickup'](s, x)
+
+
+def c_stack(s, b1, b2):
+    if mishaps['crash'] > 0:
+        mishaps['crash'] -= 1
+        raise Crash(f'crashed while stacking {b1} on {b2}')
+    stack = the_domain._action_dict['stack']
+    others = sorted(b for b in s.clear if s.clear[b] and b not in (b1, b2))
+    if mishaps['misplace'] > 0 and others:
+        mishaps['misplace'] -= 1
+        return stack(s, b1, others[0])
+    return stack(s, b1, b2)
+
+
+gtpyhop.current_domain = the_domain
+gtpyhop.declare_commands(c_pickup, c_stack)
+
+
+################################################################################
+# helper functions
+
+def state_vars(state):
+    """Return a dictionary of the state variables in 'state'."""
+    return {var: vars(state)[var] for var in state.state_vars()}
+
+
+def sussman_anomaly():
+    """Return the initial state and goal of the Sussman anomaly."""
+    state = gtpyhop.State('sussman')
+    state.pos = {'a':'table', 'b':'table', 'c':'a'}
+    state.clear = {'a':False, 'b':True, 'c':True}
+    state.holding = {'hand':False}
+    goal = gtpyhop.Multigoal('goal')
+    goal.pos = {'a':'b', 'b':'c'}
+    return (state, goal)
+
+
+def tower(n):
+    """
+    Return a state with n blocks stacked on each other in one tower, and a
+    goal of putting them in the reverse order.
+    """
+    blocks = [f'b{i}' for i in range(n)]
+    state = gtpyhop.State('tower')
+    state.pos = {b: (blocks[i-1] if i > 0 else 'table') for (i,b) in enumerate(blocks)}
+    state.clear = {b: (i == n-1) for (i,b) in enumerate(blocks)}
+    state.holding = {'hand':False}
+    goal = gtpyhop.Multigoal('reversed')
+    goal.pos = {b: (blocks[i+1] if i < n-1 else 'table') for (i,b) in enumerate(blocks)}
+    return (state, goal)
+
+
+################################################################################
+# the checks
+
+def check_repair():
+    print("\nIf ('stack', 'b', 'c') puts b on a instead of c, repairing the")
+    print("plan should give the same plan as find_plan, and run_lazy_lookahead")
+    print("should repair the plan once and achieve the goal.\n")
+    planner = gtpyhop.Planner(the_domain, verbose=0)
+    (state1, goal1) = sussman_anomaly()
+    todo_list = [('achieve', goal1)]
+    (plan, tree) = planner.find_plan(state1, todo_list, tree=True)
+    states = planner._simulate(state1, plan)
+    i = plan.index(('stack', 'b', 'c'))
+    misplaced = the_domain._action_dict['stack'](states[i].copy(), 'b', 'a')
+    (repaired, new_tree) = planner._repair_plan(misplaced, tree, i)
+    th.check_result(repaired, planner.find_plan(misplaced, todo_list))
+    th.check_result(new_tree.plan, repaired)
+
+    mishaps['misplace'] = 1
+    final = planner.run_lazy_lookahead(state1, todo_list)
+    th.check_result(planner.repairs, 1)
+    th.check_result(state_vars(final), state_vars(states[-1]))
+
+
+def check_trees():
+    print("\nfind_plan(..., tree=True) should return the same plan as find_plan,")
+    print("and a tree whose root is the todo_list's only item and covers the plan.\n")
+    planner = gtpyhop.Planner(the_domain, verbose=0)
+    (state1, goal1) = sussman_anomaly()
+    todo_list = [('achieve', goal1)]
+    plan = planner.find_plan(state1, todo_list)
+    (tree_plan, tree) = planner.find_plan(state1, todo_list, tree=True)
+    th.check_result(tree_plan, plan)
+    th.check_result(tree.plan, plan)
+    [root] = tree.roots()
+    th.check_result((tree.items[root], tree.methods[root]), (todo_list[0], 'm_moveblocks'))
+    th.check_result((tree.start[root], tree.end[root]), (0, len(plan)))
+    actions = [k for k in range(len(tree)) if tree.items[k] in plan]
+    th.check_result([plan[tree.start[k]:tree.end[k]] for k in actions],
+                    [[tree.items[k]] for k in actions])
+    th.check_result(state_vars(tree.states[-1]),
+                    state_vars(planner._simulate(state1, plan)[-1]))
+
+
+def check_rest_of_plan():
+    print("\nAfter a command that has the expected effects, the rest of the plan")
+    print("should still work, but not after ('stack', 'b', 'c') puts b on a.")
+    print("If c_pickup fails, run_lazy_lookahead shouldn't retry it because the")
+    print("action model says it still works; it should repair the plan.\n")
+    planner = gtpyhop.Planner(the_domain, verbose=0)
+    (state1, goal1) = sussman_anomaly()
+    todo_list = [('achieve', goal1)]
+    (plan, tree) = planner.find_plan(state1, todo_list, tree=True)
+    states = planner._simulate(state1, plan)
+    i = plan.index(('stack', 'b', 'c'))
+    th.check_result(planner._rest_of_plan_works(states[i+1], plan, i+1, tree, todo_list),
+                    True)
+    misplaced = the_domain._action_dict['stack'](states[i].copy(), 'b', 'a')
+    th.check_result(planner._rest_of_plan_works(misplaced, plan, i+1, tree, todo_list),
+                    False)
+
+    mishaps['misplace'] = 1
+    planner.run_lazy_lookahead(state1, todo_list)
+    th.check_result((planner.surprises, planner.replans_avoided), (1, 0))
+
+    mishaps['fail'] = 1
+    final = planner.run_lazy_lookahead(state1, todo_list)
+    th.check_result((planner.replans_avoided, planner.repairs), (0, 1))
+    th.check_result([kind for (tries, kind, seconds) in planner.planning_rounds],
+                    ['find_plan', 'repair', 'find_plan'])
+    th.check_result(state_vars(final), state_vars(states[-1]))
+
+
+def check_server():
+    print("\nA gtpyhop_serve server for blocks_htn should answer a request with")
+    print("the same plan and search statistics as find_plan, and answer a")
+    print("request whose budget isn't a positive number with an error.\n")
+    if not hasattr(socket, 'AF_UNIX'):
+        print("Skipped, since this system doesn't have Unix-domain sockets.")
+        return
+    (state1, goal1) = sussman_anomaly()
+    (plan, stats) = gtpyhop.Planner(blocks_htn.the_domain, verbose=0).find_plan(
+        state1, [('achieve', goal1)], stats=True)
+    state_json = dict(state_vars(state1), __state__='sussman')
+    goal_json = dict(pos=goal1.pos, __multigoal__='goal')
+    requests = [{'id': 1, 'state': state_json, 'todo_list': [['achieve', goal_json]],
+                 'budget': 10},
+                {'id': 2, 'state': state_json, 'todo_list': [['achieve', goal_json]],
+                 'budget': 0}]
+    top = os.path.dirname(os.path.abspath(gtpyhop.__file__))
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'gtpyhop.sock')
+        server = subprocess.Popen([sys.executable, '-m', 'gtpyhop_serve',
+                                   '--path', 'Examples', '--socket', path,
+                                   '--workers', '1', 'blocks_htn'],
+                                  cwd=top, stdout=subprocess.DEVNULL,
+                                  stderr=subprocess.PIPE, text=True)
+        try:
+            # the server says when it's ready
+            line = server.stderr.readline()
+            if not line.startswith('gtpyhop_serve> serving'):
+                raise Exception(f"gtpyhop_serve didn't start: {line}{server.stderr.read()}")
+            with socket.socket(socket.AF_UNIX) as connection:
+                connection.connect(path)
+                connection.sendall(''.join(json.dumps(r) + '\n' for r in requests).encode())
+                with connection.makefile() as f:
+                    responses = {r['id']: r for r in (json.loads(f.readline())
+                                                      for _ in requests)}
+        finally:
+            # SIGINT (unlike SIGTERM) lets the server shut down its workers
+            server.send_signal(signal.SIGINT)
+            server.wait()
+    th.check_result(responses[1]['plan'], [list(action) for action in plan])
+    th.check_result(responses[1]['stats']['search']['nodes'], stats.nodes)
+    th.check_result(responses[2], {'id': 2,
+                    'error': 'Exception: budget must be a positive number, not 0'})
+
+
+def check_find_plan_async():
+    print("\nfind_plan_async should give the same plan as find_plan. While it's")
+    print("searching, other coroutines should keep running, and cancelling it")
+    print("should stop the search.\n")
+    planner = gtpyhop.Planner(the_domain, verbose=0)
+    (state2, goal2) = tower(10)
+    todo_list = [('achieve', goal2)]
+    plan = planner.find_plan(state2, todo_list)
+
+    async def search_and_cancel():
+        search = asyncio.ensure_future(
+            planner.find_plan_async(state2, todo_list, yield_every=1))
+        ticks = 0
+        while ticks < 5:
+            await asyncio.sleep(0)
+            ticks += 1
+        search.cancel()
+        try:
+            await search
+        except asyncio.CancelledError:
+            return ticks
+        raise Exception("the search finished before it was cancelled")
+
+    th.check_result(asyncio.run(search_and_cancel()), 5)
+    th.check_result(asyncio.run(planner.find_plan_async(state2, todo_list)), plan)
+
+
+def check_cancellation():
+    print("\nCancelling a CancellationToken during find_plan or run_lazy_lookahead")
+    print("should stop it, and the Planner should still work afterward.\n")
+    planner = gtpyhop.Planner(the_domain, verbose=0)
+    (state1, goal1) = sussman_anomaly()
+    (state2, goal2) = tower(30)
+    problems = [(planner.find_plan, state2, [('achieve', goal2)], 'node_enter', 100),
+                (planner.run_lazy_lookahead, state1, [('achieve', goal1)],
+                 'command_executed', 3)]
+    for (function, state, todo_list, event, count) in problems:
+        token = gtpyhop.CancellationToken()
+        events = []
+        def cancel(event, info):
+            events.append(event)
+            if len(events) == count:
+                token.cancel()
+        planner.add_hook(cancel, [event])
+        try:
+            function(state, todo_list, token=token)
+            raise Exception(f"{function.__name__} wasn't cancelled")
+        except gtpyhop.PlanningCancelled:
+            pass
+        finally:
+            planner.remove_hook(cancel)
+        th.check_result(len(events) < 2*count, True)
+
+    plan = planner.find_plan(state2, [('achieve', goal2)], token=gtpyhop.CancellationToken())
+    th.check_result(plan, planner.find_plan(state2, [('achieve', goal2)]))
+    final = planner.run_lazy_lookahead(state1, [('achieve', goal1)],
+                                       token=gtpyhop.CancellationToken())
+    th.check_result((final.pos['a'], final.pos['b']), ('b', 'c'))
+
+
+def check_find_plans():
+    print("\nfind_plans should give the same plans as find_plan. While a batch is")
+    print("running, the domain should reject declarations, even if another batch")
+    print("has finished, and afterward it should accept them again.\n")
+    (state1, goal1) = sussman_anomaly()
+    problems = [(tower(n)[0], [('achieve', tower(n)[1])]) for n in range(1, 8)]
+    problems.append((state1, [('achieve', goal1)]))
+    planner = gtpyhop.Planner(the_domain, verbose=0)
+    th.check_result(gtpyhop.find_plans(problems, the_domain, max_workers=4),
+                    [planner.find_plan(state, todo_list) for (state, todo_list) in problems])
+
+    # A domain in which the task ('wait', k) waits until finish[k] is set
+    domain = the_domain.copy(f'{__name__}_batch')
+    started = [threading.Event(), threading.Event()]
+    finish = [threading.Event(), threading.Event()]
+    def m_wait(state, k):
+        started[k].set()
+        finish[k].wait()
+        return []
+    gtpyhop.current_domain = domain
+    gtpyhop.declare_task_methods('wait', m_wait)
+    def declare():
+        try:
+            gtpyhop.declare_task_methods('wait', m_wait)
+            return 'accepted'
+        except Exception:
+            return 'rejected'
+
+    # Two batches that wait, and finish in the order they started
+    batches = [threading.Thread(target=gtpyhop.find_plans,
+                                args=([(state1, [('wait', k)])], domain))
+               for k in (0, 1)]
+    try:
+        for k in (0, 1):
+            batches[k].start()
+            started[k].wait()
+        finish[0].set()
+        batches[0].join()
+        th.check_result(declare(), 'rejected')
+    finally:
+        for k in (0, 1):
+            finish[k].set()
+            batches[k].join()
+    th.check_result(declare(), 'accepted')
+    domain.freeze()
+    th.check_result(gtpyhop.find_plans(problems[:1], domain),
+                    [planner.find_plan(*problems[0])])
+    th.check_result(declare(), 'rejected')
+    gtpyhop.current_domain = the_domain
+
+
+def check_plan_cache():
+    print("\nA PlanCache should return copies of the plans it has, even for states")
+    print("with other names, forget them when they're older than its ttl, and")
+    print("share them with other caches that use the same file.\n")
+    (state1, goal1) = sussman_anomaly()
+    todo_list = [('achieve', goal1)]
+    plan = gtpyhop.Planner(the_domain, verbose=0).find_plan(state1, todo_list)
+    cache = gtpyhop.PlanCache(maxsize=10)
+    planner = gtpyhop.Planner(the_domain, verbose=0, cache=cache)
+    result = planner.find_plan(state1, todo_list)
+    result.append(('pickup', 'c'))
+    th.check_result(planner.find_plan(state1.copy('renamed'), todo_list), plan)
+    th.check_result((cache.hits, cache.misses), (1, 1))
+
+    cache = gtpyhop.PlanCache(maxsize=10, ttl=0.05)
+    planner = gtpyhop.Planner(the_domain, verbose=0, cache=cache)
+    planner.find_plan(state1, todo_list)
+    time.sleep(0.1)
+    th.check_result(planner.find_plan(state1, todo_list), plan)
+    th.check_result((cache.hits, cache.misses), (0, 2))
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'plans.sqlite')
+        caches = [gtpyhop.PlanCache(maxsize=10, path=path) for _ in range(2)]
+        planners = [gtpyhop.Planner(the_domain, verbose=0, cache=c) for c in caches]
+        planners[0].find_plan(state1, todo_list)
+        th.check_result(planners[1].find_plan(state1, todo_list), plan)
+        th.check_result((caches[1].hits, caches[1].misses), (1, 0))
+        for c in caches:
+            c.close()
+
+
+def check_concurrent_lookahead():
+    print("\nrun_concurrent_lookahead should end in the same state as")
+    print("run_lazy_lookahead, and use the plan it made while acting when the")
+    print("commands did what their actions predicted, even after a repair.\n")
+    planner = gtpyhop.Planner(the_domain, verbose=0)
+    (state1, goal1) = sussman_anomaly()
+    todo_list = [('achieve', goal1)]
+    for misplace in (0, 1):
+        mishaps['misplace'] = misplace
+        expected = planner.run_lazy_lookahead(state1, todo_list)
+        mishaps['misplace'] = misplace
+        final = planner.run_concurrent_lookahead(state1, todo_list)
+        th.check_result(state_vars(final), state_vars(expected))
+        th.check_result(planner.hot_swaps, 1)
+        th.check_result([kind for (tries, kind, seconds) in planner.planning_rounds],
+                        ['find_plan', 'repair', 'hot swap'] if misplace
+                        else ['find_plan', 'hot swap'])
+
+
+def check_async_commands():
+    print("\nWith async commands, run_lazy_lookahead and run_lazy_lookahead_async")
+    print("should end in the state that the plan predicts. For Alice and Bob's")
+    print("trips to the park, run_lazy_lookahead_async should run some commands")
+    print("at the same time, unless max_concurrent is 1.\n")
+    domain = simple_htn.the_domain.copy(f'{__name__}_travel')
+    running = {'now': 0, 'most': 0}
+    def async_command(action):
+        async def command(state, *args):
+            running['now'] += 1
+            running['most'] = max(running['most'], running['now'])
+            await asyncio.sleep(0.01)
+            running['now'] -= 1
+            return action(state, *args)
+        command.__name__ = 'c_' + action.__name__
+        return command
+    gtpyhop.current_domain = domain
+    gtpyhop.declare_commands(*[async_command(action)
+                               for action in domain._action_dict.values()])
+    gtpyhop.current_domain = the_domain
+
+    planner = gtpyhop.Planner(domain, verbose=0)
+    state3 = simple_htn.state0.copy()
+    todo_list = [('travel', 'alice', 'park'), ('travel', 'bob', 'park')]
+    expected = planner._simulate(state3, planner.find_plan(state3, todo_list))[-1]
+    final = planner.run_lazy_lookahead(state3, todo_list)
+    th.check_result((state_vars(final), running['most']), (state_vars(expected), 1))
+    for (max_concurrent, most) in [(None, 2), (1, 1)]:
+        running['most'] = 0
+        final = asyncio.run(planner.run_lazy_lookahead_async(
+            state3, todo_list, max_concurrent=max_concurrent))
+        th.check_result((state_vars(final), running['most']), (state_vars(expected), most))
+
+
+def check_deorder():
+    print("\nIn a plan for Alice and Bob to go to the park, neither one's")
+    print("actions need to wait for the other one's actions, and doing the")
+    print("plan's layers of actions in any order should give the same result.\n")
+    planner = gtpyhop.Planner(simple_htn.the_domain, verbose=0)
+    state3 = simple_htn.state0.copy()
+    plan = planner.find_plan(state3, [('travel', 'alice', 'park'),
+                                      ('travel', 'bob', 'park')])
+    po_plan = planner.deorder_plan(state3, plan)
+    th.check_result(po_plan.width >= 2, True)
+    th.check_result(po_plan.critical_path_length < len(plan), True)
+    th.check_result(len(po_plan.critical_path()), po_plan.critical_path_length)
+    reordered = [plan[i] for layer in po_plan.layers() for i in reversed(layer)]
+    th.check_result(state_vars(planner._simulate(state3, reordered)[-1]),
+                    state_vars(planner._simulate(state3, plan)[-1]))
+
+
+def check_checkpoints():
+    print("\nIf run_lazy_lookahead crashes, resume_lazy_lookahead should")
+    print("finish the mission from the checkpoint.\n")
+    planner = gtpyhop.Planner(the_domain, verbose=0)
+    (state1, goal1) = sussman_anomaly()
+    todo_list = [('achieve', goal1)]
+    expected = planner.run_lazy_lookahead(state1, todo_list)
+    with tempfile.TemporaryDirectory() as directory:
+        checkpoint = os.path.join(directory, 'mission.ckpt')
+        mishaps['crash'] = 1
+        try:
+            planner.run_lazy_lookahead(state1, todo_list, checkpoint=checkpoint)
+            raise Exception("c_stack didn't crash")
+        except Crash:
+            pass
+        th.check_result(os.path.exists(checkpoint), True)
+        final = planner.resume_lazy_lookahead(checkpoint)
+        th.check_result(state_vars(final), state_vars(expected))
+        th.check_result(os.path.exists(checkpoint), False)
+
+
+def check_observations():
+    print("\nAn observation that the rest of the plan doesn't read shouldn't")
+    print("matter, and one that it reads should make run_lazy_lookahead check")
+    print("the plan.\n")
+    planner = gtpyhop.Planner(the_domain, verbose=0)
+    (state1, goal1) = sussman_anomaly()
+    # Someone puts a on c after c has been put on the table
+    observations = iter([None, ('weather', 'rain'), None, None, ('pos', 'a', 'c'),
+                         ('clear', 'c', False), None])
+    final = planner.run_lazy_lookahead(state1, [('achieve', goal1)],
+                                       observations=observations)
+    th.check_result((planner.observations, planner.relevant_observations), (3, 1))
+    th.check_result((final.pos['a'], final.pos['b']), ('b', 'c'))
+
+
+def check_fallbacks():
+    print("\nIf find_plan runs out of time, run_lazy_lookahead should do a")
+    print("fallback plan, and then plan for the original todo_list again.\n")
+    planner = gtpyhop.Planner(the_domain, verbose=0)
+    (state2, goal2) = tower(30)
+    fallback = [('take', 'b29'), ('put', 'b29', 'table')]
+    final = planner.run_lazy_lookahead(state2, [('achieve', goal2)], max_tries=3,
+                                       plan_time_limit=1e-6, fallback=fallback)
+    th.check_result(planner.planning_rounds[0][1], 'fallback')
+    th.check_result(final.pos['b29'], 'table')
+
+
+def check_trace_events():
+    print("\nA hook should see find_plan's trace events in the order in which the")
+    print("search does things, and run_lazy_lookahead's events for commands.\n")
+    planner = gtpyhop.Planner(the_domain, verbose=0)
+    state = gtpyhop.State('a_on_b')
+    state.pos = {'a':'b', 'b':'table'}
+    state.clear = {'a':True, 'b':False}
+    state.holding = {'hand':False}
+    events = []
+    planner.add_hook(lambda event, info: events.append((event, info.get('depth'))))
+    th.check_result(planner.find_plan(state, [('take', 'a')]), [('unstack', 'a', 'b')])
+    th.check_result(events, [('plan_start', None), ('node_enter', 0), ('refine', 0),
+        ('method_try', 0), ('method_applicable', 0), ('node_enter', 1),
+        ('action_try', 1), ('action_applied', 1), ('node_enter', 2),
+        ('solution', 2), ('plan_end', None)])
+    events.clear()
+    th.check_result(planner.find_plan(state, [('take', 'b')]), False)
+    th.check_result(events, [('plan_start', None), ('node_enter', 0), ('refine', 0),
+        ('method_try', 0), ('method_fail', 0), ('backtrack', 0), ('plan_end', None)])
+    events.clear()
+    planner.run_lazy_lookahead(state, [('take', 'a')], max_tries=1)
+    th.check_result(events[-2:], [('command_try', None), ('command_executed', None)])
+
+
+def check_search_stats():
+    print("\nThe SearchStats for the Sussman anomaly should count one applicable")
+    print("action for each action in the plan and no backtracking, and the ones")
+    print("for a search that fails should count the failures.\n")
+    planner = gtpyhop.Planner(the_domain, verbose=0)
+    (state1, goal1) = sussman_anomaly()
+    (plan, stats) = planner.find_plan(state1, [('achieve', goal1)], stats=True)
+    th.check_result(plan, planner.find_plan(state1, [('achieve', goal1)]))
+    th.check_result((stats.actions_tried, stats.actions_applied, stats.backtracks),
+                    (len(plan), len(plan), 0))
+    th.check_result(stats.action_tries, collections.Counter(a[0] for a in plan))
+    # one node per action and method, plus the one with the empty todo_list
+    th.check_result(stats.nodes, len(plan) + stats.methods_applicable + 1)
+    th.check_result(stats.max_depth, stats.nodes - 1)
+    (plan, stats) = planner.find_plan(state1, [('take', 'a')], stats=True)
+    th.check_result((plan, stats.nodes, stats.methods_tried, stats.methods_applicable),
+                    (False, 1, 1, 0))
+    th.check_result((stats.backtracks, stats.backtracks_by_item), (1, {'take': 1}))
+
+
+def check_profiler():
+    print("\nA Profiler should count the same calls of actions and methods as")
+    print("SearchStats, count each command once, and put them all in its")
+    print("collapsed stacks.\n")
+    planner = gtpyhop.Planner(the_domain, verbose=0)
+    (state1, goal1) = sussman_anomaly()
+    todo_list = [('achieve', goal1)]
+    (plan, stats) = planner.find_plan(state1, todo_list, stats=True)
+    profiler = gtpyhop.Profiler()
+    planner.add_hook(profiler)
+    planner.find_plan(state1, todo_list)
+    calls = {key: calls for (key, (calls, seconds)) in profiler.functions.items()}
+    th.check_result(calls, {**{('action', a): n for (a, n) in stats.action_tries.items()},
+                            **{('method', m): n for (m, n) in stats.method_tries.items()}})
+    stacks = [line.rsplit(' ', 1)[0].split(';') for line in profiler.collapsed()]
+    th.check_result({stack[-1] for stack in stacks}, {name for (kind, name) in calls})
+    th.check_result(all(stack[:2] == ['achieve', 'm_moveblocks'] for stack in stacks), True)
+
+    planner.remove_hook(profiler)
+    profiler = gtpyhop.Profiler()
+    planner.add_hook(profiler, ['command_try', 'command_executed'])
+    planner.run_lazy_lookahead(state1, todo_list)
+    planner.remove_hook(profiler)
+    th.check_result({name: calls for ((kind, name), (calls, seconds))
+                     in profiler.functions.items()},
+                    {'unstack': 1, 'putdown': 1, 'c_pickup': 2, 'c_stack': 2})
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'acting.folded')
+        profiler.write_collapsed(path)
+        with open(path) as f:
+            lines = f.read().splitlines()
+    th.check_result(lines, profiler.collapsed())
+    th.check_result(all(line.startswith('[acting];') for line in lines), True)
+
+
+def check_chrome_trace():
+    print("\nA ChromeTrace of a mission should be a JSON list of trace events,")
+    print("with one span per command and per call to find_plan, and the search's")
+    print("spans inside the find_plan spans.\n")
+    planner = gtpyhop.Planner(the_domain, verbose=0)
+    (state1, goal1) = sussman_anomaly()
+    todo_list = [('achieve', goal1)]
+    plan = planner.find_plan(state1, todo_list)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'mission.json')
+        with gtpyhop.ChromeTrace(path) as trace:
+            planner.add_hook(trace)
+            planner.run_lazy_lookahead(state1, todo_list)
+        planner.remove_hook(trace)
+        with open(path) as f:
+            events = json.load(f)
+    th.check_result(events[0]['ph'], 'M')
+    spans = events[1:]
+    th.check_result(all(e['ph'] == 'X' and e['dur'] >= 0 and
+                        {'name', 'cat', 'ts', 'pid', 'tid', 'args'} <= set(e)
+                        for e in spans), True)
+    commands = [e for e in spans if e['cat'] == 'command']
+    th.check_result([(e['args']['action'], e['args']['outcome']) for e in commands],
+                    [(str(action), 'ok') for action in plan])
+    searches = [e for e in spans if e['cat'] == 'find_plan']
+    th.check_result(len(searches), 2)
+    # the times are rounded to nanoseconds
+    inside = lambda e, s: s['ts'] - 0.001 <= e['ts'] and \
+                          e['ts'] + e['dur'] <= s['ts'] + s['dur'] + 0.002
+    th.check_result(all(any(inside(e, s) for s in searches)
+                        for e in spans if e['cat'] in ('task', 'method', 'action')),
+                    True)
+
+
+def check_search_log():
+    print("\nReplaying a search log should give the same plan and tree as the")
+    print("search that it recorded.\n")
+    planner = gtpyhop.Planner(the_domain, verbose=0)
+    (state1, goal1) = sussman_anomaly()
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'search.log')
+        with gtpyhop.SearchLog(path) as log:
+            planner.add_hook(log)
+            (plan, tree) = planner.find_plan(state1, [('achieve', goal1)], tree=True)
+        planner.remove_hook(log)
+        [search] = gtpyhop.replay_search_log(path)
+    th.check_result(search.result, plan)
+    th.check_result(search.tree.plan, plan)
+    # the replayed multigoals are copies, so compare their printed forms
+    th.check_result([repr(item) for item in search.tree.items],
+                    [repr(item) for item in tree.items])
+    th.check_result((search.tree.methods, search.tree.start, search.tree.end),
+                    (tree.methods, tree.start, tree.end))
+    th.check_result(state_vars(search.state), state_vars(state1))
+
+
+def check_progress_reporter():
+    print("\nA ProgressReporter should report during a long search, make a last")
+    print("report that agrees with SearchStats, write it to its file, and stop")
+    print("its writer thread when the search ends.\n")
+    planner = gtpyhop.Planner(the_domain, verbose=0)
+    (state1, goal1) = tower(30)
+    threads = threading.active_count()
+    during = []
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'status.json')
+        reporter = gtpyhop.ProgressReporter(
+            callback=lambda report: during.append((report['status'],
+                                                   threading.active_count())),
+            path=path, interval=0)
+        planner.add_hook(reporter)
+        (plan, stats) = planner.find_plan(state1, [('achieve', goal1)], stats=True)
+        planner.remove_hook(reporter)
+        with open(path) as f:
+            written = json.load(f)
+    th.check_result(threading.active_count(), threads)
+    th.check_result(during[0], ('searching', threads + 1))
+    th.check_result(during[-1][0], 'solved')
+    latest = reporter.latest
+    th.check_result((latest['nodes'], latest['backtracks'], latest['best_plan_length']),
+                    (stats.nodes, stats.backtracks, len(plan)))
+    th.check_result(written, latest)
+
+
+def check_sampling_profiler():
+    print("\nA SamplingProfiler should sample the item that the search is working")
+    print("on, and stop its thread at the end of the 'with' block or at stop().\n")
+    domain = the_domain.copy(f'{__name__}_nap')
+    def m_nap(state):
+        time.sleep(0.05)
+        return []
+    gtpyhop.current_domain = domain
+    gtpyhop.declare_task_methods('nap', m_nap)
+    gtpyhop.current_domain = the_domain
+    planner = gtpyhop.Planner(domain, verbose=0)
+    (state1, goal1) = sussman_anomaly()
+    threads = threading.active_count()
+    with gtpyhop.SamplingProfiler(interval=0.005) as sampler:
+        th.check_result(threading.active_count(), threads + 1)
+        th.check_result(planner.find_plan(state1, [('nap',)]), [])
+    th.check_result(threading.active_count(), threads)
+    th.check_result(sampler.samples > 0, True)
+    th.check_result(sampler.collapsed(), [f'nap {sampler.samples}'])
+
+    sampler = gtpyhop.SamplingProfiler(interval=0.005)
+    sampler.start()
+    planner.find_plan(state1, [('nap',)])
+    sampler.stop()
+    th.check_result(threading.active_count(), threads)
+    samples = sampler.samples
+    planner.find_plan(state1, [('nap',)])
+    th.check_result(sampler.samples, samples)
+
+
+#############     beginning of tests     ################
+
+def main(do_pauses=True):
+    """
+    Run the checks.
+    main() will pause occasionally to let you examine the output.
+    main(False) will run straight through to the end, without stopping.
+    """
+    gtpyhop.current_domain = the_domain
+    check_repair()
+    th.pause(do_pauses)
+    check_trees()
+    th.pause(do_pauses)
+    check_rest_of_plan()
+    th.pause(do_pauses)
+    check_server()
+    th.pause(do_pauses)
+    check_find_plan_async()
+    th.pause(do_pauses)
+    check_cancellation()
+    th.pause(do_pauses)
+    check_find_plans()
+    th.pause(do_pauses)
+    check_plan_cache()
+    th.pause(do_pauses)
+    check_concurrent_lookahead()
+    th.pause(do_pauses)
+    check_async_commands()
+    th.pause(do_pauses)
+    check_deorder()
+    th.pause(do_pauses)
+    check_checkpoints()
+    th.pause(do_pauses)
+    check_observations()
+    th.pause(do_pauses)
+    check_fallbacks()
+    th.pause(do_pauses)
+    check_trace_events()
+    th.pause(do_pauses)
+    check_search_stats()
+    th.pause(do_pauses)
+    check_profiler()
+    th.pause(do_pauses)
+    check_chrome_trace()
+    th.pause(do_pauses)
+    check_search_log()
+    th.pause(do_pauses)
+    check_progress_reporter()
+    th.pause(do_pauses)
+    check_sampling_profiler()
+    th.pause(do_pauses)
+
+
+###############################################################################
+# As in the other example domains, main() isn't called automatically.
@@ -230,9 +230,10 @@ def main(do_pauses=True):
 # Next is a demonstration of what can happen if the HTN methods are too
 # brittle and a problem occurs at acting time. We'll try to use
 # run_lazy_lookahead to get Alice to the park, but the taxi will break
-# down while Alice is in it.  run_lazy_lookahead will call find_plan
-# again, but an execution error will occur during planning because the
-# HTN methods don't handle this case.
+# down while Alice is in it.  run_lazy_lookahead will try to repair the
+# plan by calling find_plan on the task that the failed command was for,
+# ('travel', 'alice', 'park'), but an execution error will occur during
+# planning because the HTN methods don't handle this case.
     """)
 
 
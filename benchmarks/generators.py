@@ -0,0 +1,200 @@
+"""
+Seeded generators of planning problems for GTPyhop's benchmarks. Each
+generator takes a random.Random object, so the same seed always gives the
+same problems.
+
+The domains themselves are the ones in the Examples directory; use
+load_domain to import one of them without printing its banner.
+"""
+
+import contextlib, io, os, random, sys
+
+_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for _dir in (_root, os.path.join(_root, 'Examples')):
+    if _dir not in sys.path:
+        sys.path.insert(0, _dir)
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import gtpyhop
+
+
+def load_domain(module_name):
+    """
+    Import the example domain 'module_name' (e.g., 'blocks_htn') without
+    printing anything, and return its Domain object.
+    """
+    old_domains = list(gtpyhop._domains)
+    with contextlib.redirect_stdout(io.StringIO()):
+        module = __import__(module_name)
+    new_domains = [d for d in gtpyhop._domains if d not in old_domains]
+    if new_domains:
+        return new_domains[-1]
+    return module.the_domain
+
+
+################################################################################
+# Blocks world
+
+
+def random_towers(blocks, rng):
+    """
+    Return a dictionary pos that puts 'blocks' into randomly chosen towers:
+    pos[b] is the block that b is on, or 'table'.
+    """
+    order = list(blocks)
+    rng.shuffle(order)
+    pos = {}
+    tops = []
+    for b in order:
+        # start a new tower with probability 1/(number of towers + 1)
+        i = rng.randrange(len(tops) + 1)
+        if i == len(tops):
+            pos[b] = 'table'
+            tops.append(b)
+        else:
+            pos[b] = tops[i]
+            tops[i] = b
+    return pos
+
+
+def blocks_problem(n, rng, name='bw'):
+    """
+    Return (state, goal) for a random n-block problem, where goal is a
+    Multigoal that gives a position for every block.
+    """
+    blocks = list(range(1, n+1))
+    pos = random_towers(blocks, rng)
+    state = gtpyhop.State(f'{name}_state')
+    state.pos = pos
+    state.clear = {b:True for b in blocks}
+    for b in blocks:
+        if pos[b] != 'table':
+            state.clear[pos[b]] = False
+    state.holding = {'hand':False}
+    goal = gtpyhop.Multigoal(f'{name}_goal')
+    goal.pos = random_towers(blocks, rng)
+    return (state, goal)
+
+
+# How each version of the blocks world wants its to-do list
+_blocks_todo = {
+    'blocks_htn': lambda goal: [('achieve', goal)],
+    'blocks_gtn': lambda goal: [goal],
+    'blocks_hgn': lambda goal: [goal],
+    'blocks_goal_splitting': lambda goal: [goal],
+    }
+
+
+def blocks_problems(domain_name, n, count, seed=0):
+    """
+    Return a list of 'count' (state, todo_list) pairs for random n-block
+    problems in the blocks-world domain 'domain_name'.
+    """
+    rng = random.Random(seed)
+    todo = _blocks_todo[domain_name]
+    problems = []
+    for i in range(count):
+        (state, goal) = blocks_problem(n, rng, name=f'bw{n}_{seed}_{i}')
+        problems.append((state, todo(goal)))
+    return problems
+
+
+################################################################################
+# Logistics
+
+
+def logistics_problem(packages, cities, trucks, planes, rng, name='log',
+                      locations_per_city=3):
+    """
+    Return (state, goals) for a random logistics problem for logistics_hgn,
+    where goals is a list of unigoals ('at', package, location). Each city
+    has locations_per_city locations and one airport, and has at least one
+    truck if trucks >= cities.
+    """
+    state = gtpyhop.State(f'{name}_state')
+    state.cities = {f'city{c}' for c in range(cities)}
+    state.in_city = {}
+    state.airports = set()
+    state.locations = set()
+    for c in range(cities):
+        airport = f'airport{c}'
+        state.airports.add(airport)
+        state.locations.add(airport)
+        state.in_city[airport] = f'city{c}'
+        for l in range(locations_per_city):
+            loc = f'location{c}_{l}'
+            state.locations.add(loc)
+            state.in_city[loc] = f'city{c}'
+    locations = sorted(state.locations)
+    airports = sorted(state.airports)
+    state.trucks = {f'truck{t}' for t in range(trucks)}
+    state.truck_at = {}
+    for t in range(trucks):
+        # spread the trucks over the cities, one city at a time
+        c = t % cities
+        state.truck_at[f'truck{t}'] = \
+            rng.choice([l for l in locations if state.in_city[l] == f'city{c}'])
+    state.airplanes = {f'plane{p}' for p in range(planes)}
+    state.plane_at = {f'plane{p}':rng.choice(airports) for p in range(planes)}
+    state.packages = {f'package{p}' for p in range(packages)}
+    state.at = {f'package{p}':rng.choice(locations) for p in range(packages)}
+    goals = [('at', f'package{p}', rng.choice(locations)) for p in range(packages)]
+    return (state, goals)
+
+
+def logistics_problems(packages, cities, trucks, planes, count, seed=0):
+    """
+    Return a list of 'count' (state, todo_list) pairs for random logistics
+    problems.
+    """
+    rng = random.Random(seed)
+    return [logistics_problem(packages, cities, trucks, planes, rng,
+                              name=f'log{packages}_{seed}_{i}')
+            for i in range(count)]
+
+
+
+################################################################################
+# Simple travel
+
+
+@contextlib.contextmanager
+def travel_problems(people, locations, count, seed=0):
+    """
+    Make 'count' random problems in the simple_htn travel domain, each of
+    which asks every one of 'people' people to travel to a randomly chosen
+    location. The domain keeps its map (the people, locations, and
+    distances) in the rigid relations of the simple_htn module, so this is
+    a context manager: inside the 'with' statement, the rigid relations
+    are a random map with 'locations' locations, shared by all of the
+    problems, and afterward they are what they were before. For example:
+        with travel_problems(16, 8, 3) as problems:
+            for (state, todo_list) in problems:
+                planner.find_plan(state, todo_list)
+    'problems' is a list of (state, todo_list) pairs.
+    """
+    load_domain('simple_htn')
+    rigid = sys.modules['simple_htn'].rigid
+    rng = random.Random(seed)
+    persons = [f'person{p}' for p in range(people)]
+    places = [f'place{l}' for l in range(locations)]
+    dist = {(x, y):rng.randint(1, 12)
+            for (i, x) in enumerate(places) for y in places[i+1:]}
+    problems = []
+    for i in range(count):
+        state = gtpyhop.State(f'travel{people}_{seed}_{i}')
+        state.loc = {p:rng.choice(places) for p in persons}
+        state.loc['taxi1'] = rng.choice(places)
+        state.loc['taxi2'] = rng.choice(places)
+        # enough cash for a taxi ride of any length
+        state.cash = {p:rng.randint(8, 40) for p in persons}
+        state.owe = {p:0 for p in persons}
+        todo_list = [('travel', p, rng.choice(places)) for p in persons]
+        problems.append((state, todo_list))
+    old = (rigid.types, rigid.dist)
+    rigid.types = {'person': persons, 'location': places, 'taxi': ['taxi1', 'taxi2']}
+    rigid.dist = dist
+    try:
+        yield problems
+    finally:
+        (rigid.types, rigid.dist) = old
@@ -0,0 +1,108 @@
+"""
+Measure how much memory find_plan uses for states on random blocks-world
+and logistics problems, and optionally check the results against a baseline
+from an earlier run, e.g., to decide how much memory a planning worker
+needs or to catch changes that make states bigger.
+
+Usage, from the top-level directory:
+
+    python benchmarks/memory_check.py --json baseline.json
+    python benchmarks/memory_check.py --baseline baseline.json --tolerance 0.1
+
+With --baseline, the script exits with status 1 if any workload's peak
+memory or bytes per state is more than 'tolerance' (a fraction) above the
+baseline's.
+"""
+
+import argparse, json, sys
+
+import generators
+import gtpyhop
+
+
+def workloads(count, seed):
+    """Return a list of (name, domain, problems) triples to measure."""
+    return [
+        ('blocks_htn-100', generators.load_domain('blocks_htn'),
+         generators.blocks_problems('blocks_htn', 100, count, seed)),
+        ('blocks_gtn-100', generators.load_domain('blocks_gtn'),
+         generators.blocks_problems('blocks_gtn', 100, count, seed)),
+        ('logistics-8x4', generators.load_domain('logistics_hgn'),
+         generators.logistics_problems(8, 4, 4, 2, count, seed)),
+        ]
+
+
+def measure(domain, problems):
+    """
+    Solve each of 'problems' with find_plan(..., memory=True), and return a
+    dictionary of the largest measurements over all of them.
+    """
+    planner = gtpyhop.Planner(domain, verbose=0)
+    result = {'peak_bytes': 0, 'max_live_states': 0, 'bytes_per_state': 0.0,
+              'state_bytes': 0}
+    for (state, todo_list) in problems:
+        (plan, memory) = planner.find_plan(state, todo_list, memory=True)
+        if plan is False:
+            raise Exception(f"find_plan failed on {state.__name__}")
+        for key in result:
+            result[key] = max(result[key], getattr(memory, key))
+    return result
+
+
+# The measurements that --baseline checks
+_checked = ('peak_bytes', 'bytes_per_state')
+
+
+def check(results, baseline, tolerance):
+    """
+    Print how 'results' compare to 'baseline', and return a list of the
+    (workload, measurement) pairs that exceed it by more than 'tolerance'.
+    """
+    failures = []
+    print('\nworkload             measurement       baseline        now   change')
+    for (name, values) in results['workloads'].items():
+        old = baseline['workloads'].get(name)
+        if old is None:
+            print(f'{name:20} (not in the baseline)')
+            continue
+        for key in _checked:
+            change = values[key] / old[key] - 1 if old[key] else 0.0
+            flag = ''
+            if change > tolerance:
+                failures.append((name, key))
+                flag = '  FAIL'
+            print(f'{name:20} {key:15} {old[key]:>10.0f} {values[key]:>10.0f}',
+                  f'{change:>+7.1%}{flag}')
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--count', type=int, default=5,
+        help='number of problems in each workload (default 5)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='also write the results to this file')
+    parser.add_argument('--baseline', help='a file written by an earlier --json')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+        help='allowed increase over the baseline, as a fraction (default 0.1)')
+    args = parser.parse_args(argv)
+
+    results = {'python': sys.version, 'workloads': {}}
+    print('workload             peak bytes   live states   bytes/state')
+    for (name, domain, problems) in workloads(args.count, args.seed):
+        values = measure(domain, problems)
+        results['workloads'][name] = values
+        print(f"{name:20} {values['peak_bytes']:>10}   {values['max_live_states']:>11}",
+              f"  {values['bytes_per_state']:>11.0f}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if check(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
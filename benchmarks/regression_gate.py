@@ -0,0 +1,171 @@
+"""
+Check for performance regressions by comparing benchmark results with a
+baseline saved from an earlier version of GTPyhop. Each workload (a family
+and size from run_benchmarks.py) is run several times, and the median time
+and a confidence interval for it are compared with the baseline's.
+
+Usage, from the top-level directory:
+
+    python benchmarks/regression_gate.py --save baseline.json
+    python benchmarks/regression_gate.py --baseline baseline.json
+
+With --baseline, the script exits with status 1 if any workload:
+  - takes more than --threshold (a fraction, default 0.1) longer than in
+    the baseline, and the difference is larger than the noise, i.e., the
+    confidence intervals of the two medians don't overlap;
+  - needs more than --threshold more operations (search nodes plus tries
+    of actions and methods). These are counted rather than timed, so they
+    aren't affected by noise, although they can vary a little in domains
+    whose methods iterate over sets of strings; or
+  - has a peak memory more than --memory-threshold above the baseline's.
+Since times depend on the machine, the baseline should come from the same
+machine. The operation counts can be compared anywhere.
+
+The times are for find_plan calls without any trace hooks (see
+run_benchmarks.measure_problem), so that a change in the cost of tracing
+can't hide or exaggerate a change in the speed of the search itself.
+Baselines saved by earlier versions of this script, which timed searches
+that had a hook for counting nodes, are rejected.
+"""
+
+import argparse, json, math, statistics, sys
+
+import run_benchmarks
+
+
+# How the times are measured, saved with the results so that baselines with
+# times measured differently can be rejected
+TIMING = 'find_plan without hooks'
+
+# The (family, size) pairs to run. They're small enough that the whole gate
+# takes less than a minute with the default settings.
+WORKLOADS = [('blocks_htn', 50), ('blocks_gtn', 50), ('blocks_hgn', 50),
+             ('blocks_goal_splitting', 50), ('logistics', 8), ('travel', 32)]
+
+
+def median_interval(samples, confidence=0.95):
+    """
+    Return (low, high), a confidence interval for the median of the
+    distribution that 'samples' came from. It is made from order statistics
+    and doesn't assume anything about the distribution. With fewer than six
+    samples the interval is (min, max), and its confidence is less than
+    0.95.
+    """
+    xs = sorted(samples)
+    n = len(xs)
+
+    def coverage(j):
+        # The probability that the median is between xs[j-1] and xs[n-j],
+        # i.e., that between j and n-j of the samples are below it
+        return sum(math.comb(n, i) for i in range(j, n - j + 1)) / 2**n
+
+    j = 1
+    while j + 1 <= n // 2 and coverage(j + 1) >= confidence:
+        j += 1
+    return (xs[j-1], xs[n-j])
+
+
+def measure(repeat, count, seed, memory=True, out=sys.stdout):
+    """
+    Run each workload 'repeat' times, and return a dictionary that maps the
+    workload's name to its measurements.
+    """
+    results = {}
+    print('workload                   median s    95% interval        operations' +
+          ('   peak KiB' if memory else ''), file=out)
+    for (family, size) in WORKLOADS:
+        point = run_benchmarks.run_point(family, size, count, seed, memory, repeat)
+        samples = point['samples']
+        (low, high) = median_interval(samples)
+        name = f'{family}-{size}'
+        results[name] = {'median': statistics.median(samples), 'interval': [low, high],
+                         'samples': samples, 'operations': point['operations'],
+                         'nodes': point['nodes'], 'nodes_per_sec': point['nodes_per_sec'],
+                         'peak_bytes': point.get('peak_bytes')}
+        peak = f"   {point['peak_bytes'] / 1024:>8.0f}" if memory else ''
+        print(f"{name:24} {results[name]['median']:>10.4f}   [{low:.4f}, {high:.4f}]",
+              f"  {point['operations']:>10}{peak}", file=out)
+    return results
+
+
+def compare(results, baseline, threshold, memory_threshold, out=sys.stdout):
+    """
+    Print how 'results' compare with 'baseline', and return a list of
+    (workload, reason) pairs for the regressions.
+    """
+    regressions = []
+    memory = any(r.get('peak_bytes') for r in results.values())
+    print('\nworkload                     time   operations' +
+          ('       memory' if memory else ''), file=out)
+    for (name, now) in results.items():
+        old = baseline.get(name)
+        if old is None:
+            print(f'{name:24} (not in the baseline)', file=out)
+            continue
+        changes = []
+        time_change = now['median'] / old['median'] - 1
+        flag = ''
+        if time_change > threshold and now['interval'][0] > old['interval'][1]:
+            regressions.append((name, f'time {time_change:+.1%}'))
+            flag = '!'
+        changes.append(f'{time_change:>+7.1%}{flag:1}')
+        op_change = now['operations'] / old['operations'] - 1
+        flag = ''
+        if op_change > threshold:
+            regressions.append((name, f'operations {op_change:+.1%}'))
+            flag = '!'
+        changes.append(f'{op_change:>+11.1%}{flag:1}')
+        if now.get('peak_bytes') and old.get('peak_bytes'):
+            memory_change = now['peak_bytes'] / old['peak_bytes'] - 1
+            flag = ''
+            if memory_change > memory_threshold:
+                regressions.append((name, f'memory {memory_change:+.1%}'))
+                flag = '!'
+            changes.append(f'{memory_change:>+11.1%}{flag:1}')
+        print(f'{name:24}' + ' '.join(changes), file=out)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--baseline', help='compare with this file from --save')
+    parser.add_argument('--save', help='write the results to this file')
+    parser.add_argument('--repeat', type=int, default=7,
+        help='number of times to run each workload (default 7)')
+    parser.add_argument('--count', type=int, default=3,
+        help='number of problems in each workload (default 3)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--threshold', type=float, default=0.1,
+        help='allowed increase in time or operations, as a fraction (default 0.1)')
+    parser.add_argument('--memory-threshold', type=float, default=0.1,
+        help='allowed increase in peak memory, as a fraction (default 0.1)')
+    parser.add_argument('--no-memory', action='store_true',
+        help="don't measure peak memory")
+    args = parser.parse_args(argv)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('timing') != TIMING:
+            raise Exception(f"{args.baseline} has times measured with a trace hook; " +
+                            "save a new baseline")
+        if (baseline['count'], baseline['seed']) != (args.count, args.seed):
+            raise Exception(f"{args.baseline} was made with different --count or --seed")
+    results = measure(args.repeat, args.count, args.seed, not args.no_memory)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'python': sys.version, 'timing': TIMING, 'repeat': args.repeat,
+                       'count': args.count, 'seed': args.seed,
+                       'workloads': results}, f, indent=2)
+    if args.baseline:
+        regressions = compare(results, baseline['workloads'], args.threshold,
+                              args.memory_threshold)
+        if regressions:
+            print('\nRegressions:', ', '.join(f'{name} ({reason})'
+                                             for (name, reason) in regressions))
+            sys.exit(1)
+        print('\nNo regressions.')
+
+
+if __name__ == '__main__':
+    main()
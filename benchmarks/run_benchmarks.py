@@ -0,0 +1,197 @@
+"""
+Run GTPyhop's benchmark suite: seeded random problems of increasing size in
+the blocks-world domains (blocks_htn, blocks_gtn, blocks_hgn, and
+blocks_goal_splitting), the logistics domain, and the simple travel domain.
+For each domain and size, report the plan length, the number of search
+nodes, the planning time, the nodes per second, and the peak memory, and
+estimate how the time grows with the size.
+
+Usage, from the top-level directory:
+
+    python benchmarks/run_benchmarks.py
+    python benchmarks/run_benchmarks.py --scale large --json results.json
+    python benchmarks/run_benchmarks.py --families blocks_htn travel --sizes 10 100
+
+--scale chooses the sizes: 'small' (the default) takes a few seconds,
+'medium' goes up to 1,000 blocks, and 'large' goes up to 5,000 blocks and
+can take hours.
+"""
+
+import argparse, json, math, statistics, sys, time
+from contextlib import nullcontext
+
+import generators
+import gtpyhop
+
+
+# The sizes to run for each --scale. A size is the number of blocks, the
+# number of packages, or the number of people.
+SIZES = {
+    'blocks': {'small': [10, 20, 50, 100],
+               'medium': [10, 20, 50, 100, 200, 500, 1000],
+               'large': [10, 20, 50, 100, 200, 500, 1000, 2000, 5000]},
+    'packages': {'small': [2, 4, 8],
+                 'medium': [2, 4, 8, 16, 32],
+                 'large': [2, 4, 8, 16, 32, 64, 128]},
+    'people': {'small': [1, 4, 16, 64],
+              'medium': [1, 4, 16, 64, 256],
+              'large': [1, 4, 16, 64, 256, 1024]},
+    }
+
+# Each family's domain, what its sizes count, and its generator, which returns
+# a context manager that gives 'count' problems of the given size (see
+# generators.travel_problems for why)
+FAMILIES = {
+    'blocks_htn': ('blocks_htn', 'blocks', lambda size, count, seed: nullcontext(
+                   generators.blocks_problems('blocks_htn', size, count, seed))),
+    'blocks_gtn': ('blocks_gtn', 'blocks', lambda size, count, seed: nullcontext(
+                   generators.blocks_problems('blocks_gtn', size, count, seed))),
+    'blocks_hgn': ('blocks_hgn', 'blocks', lambda size, count, seed: nullcontext(
+                   generators.blocks_problems('blocks_hgn', size, count, seed))),
+    'blocks_goal_splitting': ('blocks_goal_splitting', 'blocks',
+                   lambda size, count, seed: nullcontext(generators.blocks_problems(
+                       'blocks_goal_splitting', size, count, seed))),
+    # packages x cities x trucks x planes, with two packages per city, a
+    # truck in each city, and a plane for every four packages
+    'logistics': ('logistics_hgn', 'packages', lambda size, count, seed: nullcontext(
+                  generators.logistics_problems(size, max(2, size // 2),
+                      max(2, size // 2), max(1, size // 4), count, seed))),
+    'travel': ('simple_htn', 'people', lambda size, count, seed:
+               generators.travel_problems(size, 8, count, seed)),
+    }
+
+
+def measure_problem(planner, state, todo_list, memory=True):
+    """
+    Solve one problem, and return a dictionary of measurements: the plan
+    length, the number of search nodes, the number of operations (nodes
+    plus tries of actions and methods, which unlike the time doesn't vary
+    from run to run), the time in seconds, and (if 'memory' is True) the
+    peak memory in bytes. The counts, the time, and the memory are measured
+    in separate runs. The time comes from a plain find_plan call, since
+    counting nodes (which uses a trace hook) and measuring memory both slow
+    the search down.
+    """
+    (plan, stats) = planner.find_plan(state, todo_list, stats=True)
+    if plan is False:
+        raise Exception(f"find_plan failed on {state.__name__}")
+    start = time.perf_counter()
+    planner.find_plan(state, todo_list)
+    seconds = time.perf_counter() - start
+    result = {'plan_length': len(plan), 'nodes': stats.nodes,
+              'operations': stats.nodes + stats.actions_tried + stats.methods_tried,
+              'seconds': seconds}
+    if memory:
+        (_, usage) = planner.find_plan(state, todo_list, memory=True)
+        result['peak_bytes'] = usage.peak_bytes
+    return result
+
+
+def run_point(family, size, count, seed, memory=True, repeat=1):
+    """
+    Measure 'count' problems of the given family and size, 'repeat' times
+    each, and return a dictionary that summarizes the measurements. The
+    'seconds' entry is the median time per problem, and the 'samples' entry
+    lists the total time for all of the problems in each repetition.
+    """
+    (domain_name, _, generate) = FAMILIES[family]
+    planner = gtpyhop.Planner(generators.load_domain(domain_name), verbose=0)
+    times = []
+    samples = []
+    peak = None
+    with generate(size, count, seed) as problems:
+        for _ in range(repeat):
+            results = [measure_problem(planner, state, todo_list, memory)
+                       for (state, todo_list) in problems]
+            times.extend(r['seconds'] for r in results)
+            samples.append(sum(r['seconds'] for r in results))
+            if memory:
+                peak = max(r['peak_bytes'] for r in results)
+                # Memory use doesn't change from one repetition to the next
+                memory = False
+    # Nor do the plans and the numbers of nodes and operations
+    nodes = sum(r['nodes'] for r in results)
+    point = {'size': size, 'problems': count,
+             'plan_length': statistics.mean(r['plan_length'] for r in results),
+             'nodes': nodes // count,
+             'operations': sum(r['operations'] for r in results) // count,
+             'seconds': statistics.median(times),
+             'nodes_per_sec': nodes * repeat / sum(samples), 'samples': samples}
+    if peak is not None:
+        point['peak_bytes'] = peak
+    return point
+
+
+def growth(points):
+    """
+    For each pair of successive points on a scaling curve, estimate the
+    exponent k such that time grows like size**k between them. Return a
+    list with one entry per point (None for the first one).
+    """
+    result = [None]
+    for (a, b) in zip(points, points[1:]):
+        if a['seconds'] > 0 and b['seconds'] > 0 and b['size'] != a['size']:
+            result.append(math.log(b['seconds'] / a['seconds']) /
+                          math.log(b['size'] / a['size']))
+        else:
+            result.append(None)
+    return result
+
+
+def run_suite(families, scale='small', sizes=None, count=3, seed=0, memory=True,
+              repeat=1, out=sys.stdout):
+    """
+    Run the benchmarks for 'families', print a table for each one on 'out',
+    and return the results as a dictionary that can be written as JSON.
+    """
+    results = {'python': sys.version, 'gtpyhop': gtpyhop.__file__, 'scale': scale,
+               'count': count, 'seed': seed, 'repeat': repeat, 'families': {}}
+    for family in families:
+        (domain_name, kind, _) = FAMILIES[family]
+        print(f'\n{family} ({domain_name}), size = number of {kind}', file=out)
+        print('    size   plan len      nodes    seconds   nodes/sec' +
+              ('   peak KiB' if memory else '') + '   growth', file=out)
+        points = []
+        for size in (sizes or SIZES[kind][scale]):
+            point = run_point(family, size, count, seed, memory, repeat)
+            points.append(point)
+            slope = growth(points)[-1]
+            peak = f"   {point['peak_bytes'] / 1024:>8.0f}" if memory else ''
+            print(f"{size:>8}   {point['plan_length']:>8.1f}   {point['nodes']:>8}",
+                  f"  {point['seconds']:>8.4f}   {point['nodes_per_sec']:>9.0f}{peak}",
+                  f"  {'' if slope is None else f'n^{slope:.2f}':>6}", file=out)
+        for (point, slope) in zip(points, growth(points)):
+            point['growth'] = slope
+        results['families'][family] = points
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--families', nargs='+', choices=list(FAMILIES),
+        default=list(FAMILIES), help='which problem families to run (default: all)')
+    parser.add_argument('--scale', choices=['small', 'medium', 'large'],
+        default='small', help='which set of sizes to run (default: small)')
+    parser.add_argument('--sizes', type=int, nargs='+',
+        help='run these sizes instead of the ones for --scale')
+    parser.add_argument('--count', type=int, default=3,
+        help='number of problems of each size (default 3)')
+    parser.add_argument('--repeat', type=int, default=1,
+        help='number of times to solve each problem (default 1)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-memory', action='store_true',
+        help="don't measure peak memory, which takes a second run per problem")
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    results = run_suite(args.families, args.scale, args.sizes, args.count,
+                        args.seed, not args.no_memory, args.repeat)
+    print(f'\n{time.perf_counter() - start:.1f} seconds')
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
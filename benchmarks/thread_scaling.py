@@ -0,0 +1,85 @@
+"""
+Measure how the throughput of gtpyhop.find_plans scales with the number of
+threads, on random blocks-world and logistics problems. On a CPython build
+with a global interpreter lock the throughput should stay roughly flat; on a
+free-threaded ("no-GIL") build it should grow with the number of threads,
+up to the number of CPU cores.
+
+Usage, from the top-level directory:
+
+    python benchmarks/thread_scaling.py
+    python benchmarks/thread_scaling.py --threads 1 2 4 8 --count 64 --json out.json
+"""
+
+import argparse, json, os, sys, time
+
+import generators
+import gtpyhop
+
+
+def workloads(count, seed):
+    """Return a list of (name, domain, problems) triples to measure."""
+    return [
+        ('blocks_htn-30', generators.load_domain('blocks_htn'),
+         generators.blocks_problems('blocks_htn', 30, count, seed)),
+        ('blocks_gtn-30', generators.load_domain('blocks_gtn'),
+         generators.blocks_problems('blocks_gtn', 30, count, seed)),
+        ('logistics-8x4', generators.load_domain('logistics_hgn'),
+         generators.logistics_problems(8, 4, 4, 2, count, seed)),
+        ]
+
+
+def measure(domain, problems, threads, repeat):
+    """
+    Solve 'problems' with find_plans using 'threads' threads, 'repeat' times,
+    and return the best throughput in problems per second.
+    """
+    best = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        plans = gtpyhop.find_plans(problems, domain, max_workers=threads)
+        elapsed = time.perf_counter() - start
+        if not all(plans):
+            raise Exception(f"find_plans failed on some of the problems")
+        best = max(best, len(problems) / elapsed)
+    return best
+
+
+def main(argv=None):
+    cpus = os.cpu_count() or 1
+    default_threads = sorted({1, 2, 4, 8, cpus} & set(range(1, cpus+1)))
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--threads', type=int, nargs='+', default=default_threads,
+        help='thread counts to try (default: powers of 2 up to the CPU count)')
+    parser.add_argument('--count', type=int, default=32,
+        help='number of problems in each workload (default 32)')
+    parser.add_argument('--repeat', type=int, default=3,
+        help='number of times to run each measurement (default 3)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args(argv)
+
+    gil = getattr(sys, '_is_gil_enabled', lambda: True)()
+    print(f'Python {sys.version.split()[0]}, GIL {"enabled" if gil else "disabled"},',
+          f'{cpus} CPUs')
+    results = {'python': sys.version, 'gil_enabled': gil, 'cpus': cpus,
+               'workloads': {}}
+    for (name, domain, problems) in workloads(args.count, args.seed):
+        rows = []
+        base = None
+        print(f'\n{name}: {len(problems)} problems')
+        print('threads   problems/sec   speedup')
+        for threads in args.threads:
+            throughput = measure(domain, problems, threads, args.repeat)
+            base = base or throughput
+            rows.append({'threads': threads, 'problems_per_sec': throughput,
+                         'speedup': throughput / base})
+            print(f'{threads:>7}   {throughput:>12.1f}   {throughput/base:>7.2f}')
+        results['workloads'][name] = rows
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
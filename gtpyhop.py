@@ -17,7 +17,9 @@ of the modules in the Examples directory.
 # from IPython import embed
 # from IPython.terminal.debugger import set_trace
 
-import copy, sys, pprint, re
+import copy, sys, os, pprint, re, time, asyncio, threading, itertools, contextvars
+import concurrent.futures, collections, sqlite3, pickle, hashlib, types, array, queue
+import inspect, json, tracemalloc
 
 ################################################################################
 # How much information to print while the program is running
@@ -35,8 +37,10 @@ much debugging information GTPyhop will print:
 ################################################################################
 # States and goals
 
-# Sequence number to use when making copies of states.
-_next_state_number = 0
+# Sequence numbers to use when making copies of states. Taking the next number
+# from an itertools.count is atomic, so copies made by different threads
+# won't get the same number.
+_state_numbers = itertools.count()
 
 class State():
     """
@@ -81,13 +85,11 @@ class State():
         Make a copy of the state. For its name, use new_name if it is given.
         Otherwise use the old name, with a suffix '_copy#' where # is an integer.
         """
-        global _next_state_number
         the_copy = copy.deepcopy(self)
         if new_name:
             the_copy.__name__ = new_name
         else:
-            the_copy.__name__ = _name_for_copy(the_copy.__name__, _next_state_number)
-            _next_state_number += 1
+            the_copy.__name__ = _name_for_copy(the_copy.__name__, next(_state_numbers))
         return the_copy
 
     def display(self, heading=None):
@@ -102,8 +104,8 @@ class State():
         return [v for v in vars(self) if v != '__name__']
 
 
-# Sequence number to use when making copies of multigoals.
-_next_multigoal_number = 0
+# Sequence numbers to use when making copies of multigoals.
+_multigoal_numbers = itertools.count()
 
 class Multigoal():
     """
@@ -147,13 +149,11 @@ class Multigoal():
         Make a copy of the multigoal. For its name, use new_name if it is given.
         Otherwise use the old name, with a suffix '_copy#' where # is an integer.
         """
-        global _next_multigoal_number
         the_copy = copy.deepcopy(self)
         if new_name:
             the_copy.__name__ = new_name
         else:
-            the_copy.__name__ = _name_for_copy(the_copy.__name__, _next_multigoal_number)
-            _next_multigoal_number += 1
+            the_copy.__name__ = _name_for_copy(the_copy.__name__, next(_multigoal_numbers))
         return the_copy
 
     def display(self, heading=None):
@@ -263,6 +263,17 @@ class Domain():
         # list of all methods for multigoals
         self._multigoal_method_list = []
 
+        # if True, the declare_... functions won't change the domain. It's
+        # True if freeze has been called (_freeze_called), or while one or
+        # more find_plans calls are using the domain (_batches of them).
+        self._frozen = False
+        self._freeze_called = False
+        self._batches = 0
+
+        # incremented by the declare_... functions whenever they change the
+        # domain, so that PlanCache can tell when its plans are out of date
+        self._version = 0
+
     def __str__(self):
         return f"<Domain {self.__name__}>"
         
@@ -274,22 +285,54 @@ class Domain():
         Make a copy of the domain. For its name, use new_name if it is given.
         Otherwise use the old name, with a suffix '_copy#' where # is an integer.
         """
-        global _next_domain_number
         the_copy = copy.deepcopy(self)
         if new_name:
             the_copy.__name__ = new_name
         else:
-            the_copy.__name__ = _name_for_copy(the_copy.__name__, _next_domain_number)
-            _next_domain_number += 1
+            the_copy.__name__ = _name_for_copy(the_copy.__name__, next(_domain_numbers))
+        the_copy._frozen = False
+        the_copy._freeze_called = False
+        the_copy._batches = 0
         return the_copy
 
     def display(self):
         """Print the domain's actions, commands, and methods."""
         print_domain(self)
+
+    def freeze(self):
+        """
+        Make the domain read-only: if it is the current domain, then
+        declare_actions, declare_commands, and the declare_..._methods
+        functions will raise an exception rather than changing it. A frozen
+        domain can safely be shared by Planners running in several threads.
+        The domain's copy method returns a copy that isn't frozen.
+        """
+        with _freeze_lock:
+            self._freeze_called = True
+            self._frozen = True
+        return self
+
+    def _start_batch(self):
+        """Keep the domain frozen until the matching call to _end_batch."""
+        with _freeze_lock:
+            self._batches += 1
+            self._frozen = True
+
+    def _end_batch(self):
+        """
+        Undo a call to _start_batch. The domain stays frozen if there are
+        other batches still using it, or if freeze has been called.
+        """
+        with _freeze_lock:
+            self._batches -= 1
+            self._frozen = self._freeze_called or self._batches > 0
         
 
-# Sequence number to use when making copies of domains.
-_next_domain_number = 0
+# Sequence numbers to use when making copies of domains.
+_domain_numbers = itertools.count()
+
+# Held while freezing or unfreezing a domain
+_freeze_lock = threading.Lock()
 
 # A list of all domains that have been created
 _domains = []
@@ -297,7 +340,9 @@ _domains = []
 
 current_domain = None
 """
-The Domain object that find_plan, run_lazy_lookahead, etc., will use.
+The Domain object that find_plan, run_lazy_lookahead, etc., will use. The
+declare_... functions also add things to it. To plan in a domain without
+making it the current domain, use a Planner object.
 """
 
 ################################################################################
@@ -400,7 +445,10 @@ def declare_actions(*actions):
     """
     if current_domain == None:
         raise Exception(f"cannot declare actions until a domain has been created.")
+    if current_domain._frozen:
+        raise Exception(f"cannot declare actions in frozen domain {current_domain.__name__}.")
     current_domain._action_dict.update({act.__name__:act for act in actions})
+    current_domain._version += 1
     return current_domain._action_dict
 
 
@@ -429,7 +477,10 @@ def declare_commands(*commands):
     """
     if current_domain == None:
         raise Exception(f"cannot declare commands until a domain has been created.")
+    if current_domain._frozen:
+        raise Exception(f"cannot declare commands in frozen domain {current_domain.__name__}.")
     current_domain._command_dict.update({cmd.__name__:cmd for cmd in commands})
+    current_domain._version += 1
     return current_domain._command_dict
 
 
@@ -454,6 +505,8 @@ def declare_task_methods(task_name, *methods):
     """
     if current_domain == None:
         raise Exception(f"cannot declare methods until a domain has been created.")
+    if current_domain._frozen:
+        raise Exception(f"cannot declare methods in frozen domain {current_domain.__name__}.")
     if task_name in current_domain._task_method_dict:
         old_methods = current_domain._task_method_dict[task_name]
         # even though current_domain._task_method_dict[task_name] is a list,
@@ -462,6 +515,7 @@ def declare_task_methods(task_name, *methods):
         current_domain._task_method_dict[task_name].extend(new_methods)
     else:
         current_domain._task_method_dict.update({task_name:list(methods)})
+    current_domain._version += 1
     return current_domain._task_method_dict
 
 
@@ -496,13 +550,16 @@ def declare_unigoal_methods(state_var_name, *methods):
     """
     if current_domain == None:
         raise Exception(f"cannot declare methods until a domain has been created.")
+    if current_domain._frozen:
+        raise Exception(f"cannot declare methods in frozen domain {current_domain.__name__}.")
     if state_var_name not in current_domain._unigoal_method_dict:
         current_domain._unigoal_method_dict.update({state_var_name:list(methods)})
     else:
         old_methods = current_domain._unigoal_method_dict[state_var_name]
         new_methods = [m for m in methods if m not in old_methods]
         current_domain._unigoal_method_dict[state_var_name].extend(new_methods)
-    return current_domain._unigoal_method_dict    
+    current_domain._version += 1
+    return current_domain._unigoal_method_dict
 
 
 def declare_multigoal_methods(*methods):
@@ -525,10 +582,13 @@ def declare_multigoal_methods(*methods):
     if current_domain == None:
         raise Exception(    \
                 f"cannot declare methods until a domain has been created.")
+    if current_domain._frozen:
+        raise Exception(f"cannot declare methods in frozen domain {current_domain.__name__}.")
     new_mg_methods = [m for m in methods if m not in \
                       current_domain._multigoal_method_list]
     current_domain._multigoal_method_list.extend(new_mg_methods)
-    return current_domain._multigoal_method_list    
+    current_domain._version += 1
+    return current_domain._multigoal_method_list
 
     
 ################################################################################
@@ -576,6 +636,14 @@ def m_split_multigoal(state,multigoal):
 
 # helper function for m_split_multigoal above:
 
+def _same_state_vars(state1, state2):
+    """Return True if state1 and state2 have the same state-variable values."""
+    vars1 = vars(state1)
+    vars2 = vars(state2)
+    return vars1.keys() == vars2.keys() and \
+        all(vars1[v] == vars2[v] for v in vars1 if v != '__name__')
+
+
 def _goals_not_achieved(state,multigoal):
     """
     _goals_not_achieved takes two arguments: a state s and a multigoal g.
@@ -627,9 +695,10 @@ def _m_verify_g(state, method, state_var, arg, desired_val, depth):
     if vars(state)[state_var][arg] != desired_val:
         raise Exception(f"depth {depth}: method {method} didn't achieve",
                 f"goal {state_var}[{arg}] = {desired_val}")
-    if verbose >= 3:
-        print(f"depth {depth}: method {method} achieved",
-                f"goal {state_var}[{arg}] = {desired_val}")
+    trace = _active_trace()
+    if trace is not None:
+        trace('goal_verified', depth=depth, method=method,
+              goal=(state_var, arg, desired_val))
     return []       # i.e., don't create any subtasks or subgoals
 
 
@@ -642,174 +711,3765 @@ def _m_verify_mg(state, method, multigoal, depth):
     if goal_dict:
         raise Exception(f"depth {depth}: method {method} " + \
                         f"didn't achieve {multigoal}]")
-    if verbose >= 3:
-        print(f"depth {depth}: method {method} achieved {multigoal}")
+    trace = _active_trace()
+    if trace is not None:
+        trace('goal_verified', depth=depth, method=method, goal=multigoal)
     return []
 
 
 ################################################################################
-# Applying actions, commands, and methods
+# Stopping find_plan and run_lazy_lookahead from outside
 
 
-def _apply_action_and_continue(state, task1, todo_list, plan, depth):
+class PlanningCancelled(Exception):
     """
-    _apply_action_and_continue is called only when task1's name matches an
-    action name. It applies the action by retrieving the action's function
-    definition and calling it on the arguments, then calls seek_plan
-    recursively on todo_list.
+    find_plan, find_plan_async, and run_lazy_lookahead raise this exception
+    if their CancellationToken is cancelled while they're running.
     """
-    if verbose >= 3:
-        print(f'depth {depth} action {task1}: ', end='')
-    action = current_domain._action_dict[task1[0]]
-    newstate = action(state.copy(),*task1[1:])
-    if newstate:
-        if verbose >= 3:
+
+
+class PlanningTimeout(PlanningCancelled):
+    """
+    find_plan raises this exception if it runs out of time (see its
+    time_limit argument). e.partial_plan is the longest partial plan that
+    the search had gotten to when it looked at the clock. Its actions can
+    be executed in the initial state, but it may not lead to a solution.
+    """
+
+    def __init__(self, message, partial_plan):
+        super().__init__(message)
+        self.partial_plan = partial_plan
+
+
+class CancellationToken():
+    """
+    t = CancellationToken() creates an object that can be used to stop a call
+    to find_plan, find_plan_async, or run_lazy_lookahead that is running in
+    another thread. Pass t as the 'token' argument, and call t.cancel() to
+    stop the call. The call will raise PlanningCancelled shortly afterward.
+    Nothing else is affected, so the domain can be used for more planning.
+
+    By default the token uses a threading.Event. To cancel planning that is
+    running in another process, give the token an event that both processes
+    can see, e.g.
+        t = CancellationToken(multiprocessing.Manager().Event())
+    The token can then be sent to a worker in a process pool.
+    """
+
+    def __init__(self, event=None):
+        """event (optional) is the Event object to use for the token."""
+        self._event = event if event is not None else threading.Event()
+
+    def __str__(self):
+        return f"<CancellationToken {'cancelled' if self.cancelled() else 'active'}>"
+
+    def cancel(self):
+        """Tell whatever is using the token to stop."""
+        self._event.set()
+
+    def cancelled(self):
+        """Return True if the token has been cancelled."""
+        return self._event.is_set()
+
+    def check(self):
+        """Raise PlanningCancelled if the token has been cancelled."""
+        if self._event.is_set():
+            raise PlanningCancelled("cancelled by a CancellationToken")
+
+
+################################################################################
+# Trace events
+
+
+# The names of the trace events that Planner.add_hook can subscribe to. Each
+# event's info dictionary has the following keys:
+#   node_enter:        depth, todo_list, plan, state - the search has
+#                      reached a node
+#   solution:          depth, plan - the node's todo_list is empty
+#   backtrack:         depth, item - there are no more ways to try to do
+#                      'item', the first item in the todo_list of the node
+#                      at 'depth'
+#   action_try:        depth, action - about to apply an action
+#   action_applied:    depth, action, state - the action was applicable,
+#                      and produced 'state'
+#   action_fail:       depth, action - the action wasn't applicable
+#   refine:            depth, item, kind, methods - about to try the
+#                      relevant methods for a task, unigoal, or multigoal
+#                      ('kind' tells which)
+#   goal_achieved:     depth, goal - a unigoal is already true
+#   method_try:        depth, item, kind, method - about to call a method
+#   method_applicable: depth, item, kind, method, todo_list - the method
+#                      returned 'todo_list'
+#   method_fail:       depth, item, kind, method - the method wasn't
+#                      applicable
+#   goal_verified:     depth, method, goal - a method (given by name) has
+#                      been verified to achieve 'goal', which is a unigoal
+#                      or a multigoal (see verify_goals)
+#   plan_start:        state, todo_list - find_plan or find_plan_async has
+#                      been called
+#   plan_end:          result - find_plan or find_plan_async is about to
+#                      return 'result' (a plan or False), or None if it's
+#                      raising an exception such as PlanningTimeout
+#   command_try:       action, command - run_lazy_lookahead or one of its
+#                      relatives is about to call the command function for
+#                      an action
+#   command_executed:  action, command, state, outcome - the command
+#                      function has returned; 'state' is the new state (or
+#                      False), and 'outcome' is 'ok', 'failed', or 'surprise'
+TRACE_EVENTS = ('node_enter', 'solution', 'backtrack', 'action_try', 'action_applied',
+                'action_fail', 'refine', 'goal_achieved', 'method_try',
+                'method_applicable', 'method_fail', 'goal_verified',
+                'plan_start', 'plan_end', 'command_try', 'command_executed')
+
+
+class _TracePrinter():
+    """
+    The hook that prints find_plan's messages for verbose levels 2 and 3.
+    """
+
+    # The events it needs to hear about
+    events = ('node_enter', 'solution', 'backtrack', 'action_try', 'action_applied',
+              'action_fail', 'refine', 'goal_achieved', 'method_try',
+              'method_applicable', 'method_fail', 'goal_verified')
+
+    # What to call each kind of item in messages
+    _nouns = {'task': 'task', 'unigoal': 'goal', 'multigoal': 'multigoal'}
+
+    def __init__(self, planner):
+        self.planner = planner
+        # The depths of unigoals that were already achieved, for which there's
+        # no "could not achieve" message when the search backtracks
+        self.achieved = set()
+
+    def __call__(self, event, info):
+        verbose = self.planner.verbose
+        if event == 'node_enter':
+            todo_string = '[' + ', '.join([_item_to_string(x)
+                                           for x in info['todo_list']]) + ']'
+            print(f"depth {info['depth']} todo_list " + todo_string)
+            return
+        if verbose < 3:
+            return
+        depth = info['depth']
+        if event == 'solution':
+            print(f'depth {depth} no more tasks or goals, return plan')
+        elif event == 'action_try':
+            print(f"depth {depth} action {info['action']}: ", end='')
+        elif event == 'action_applied':
             print('applied')
-            newstate.display()
-        return seek_plan(newstate, todo_list, plan+[task1], depth+1)
-    if verbose >= 3:
-        print('not applicable')
-    return False
-
-
-def _refine_task_and_continue(state, task1, todo_list, plan, depth):
-    """
-    If task1 is in the task-method dictionary, then iterate through the list
-    of relevant methods to find one that's applicable, apply it to get
-    additional todo_list items, and call seek_plan recursively on
-            [the additional items] + todo_list.
-
-    If the call to seek_plan fails, go on to the next method in the list.
-    """
-    relevant = current_domain._task_method_dict[task1[0]]
-    if verbose >= 3:
-        print(f'depth {depth} task {task1} methods {[m.__name__ for m in relevant]}')
-    for method in relevant:
-        if verbose >= 3: 
-            print(f'depth {depth} trying {method.__name__}: ', end='')
-        subtasks = method(state, *task1[1:])
-        # Can't just say "if subtasks:", because that's wrong if subtasks == []
-        if subtasks != False and subtasks != None:
-            if verbose >= 3:
-                print('applicable')
-                print(f'depth {depth} subtasks: {subtasks}')
-            result = seek_plan(state, subtasks+todo_list, plan, depth+1)
-            if result != False and result != None:
-                return result
-        else:
-            if verbose >= 3:
-                print(f'not applicable')
-    if verbose >= 3:
-        print(f'depth {depth} could not accomplish task {task1}')        
-    return False
+            info['state'].display()
+        elif event in {'action_fail', 'method_fail'}:
+            print('not applicable')
+        elif event == 'goal_achieved':
+            self.achieved.add(depth)
+            print(f"depth {depth} goal {info['goal']}: already achieved")
+        elif event == 'refine':
+            names = [m.__name__ for m in info['methods']]
+            if info['kind'] == 'task':
+                print(f"depth {depth} task {info['item']} methods {names}")
+            else:
+                self.achieved.discard(depth)
+                print(f"depth {depth} {self._nouns[info['kind']]} {info['item']}: " +
+                      f"methods {names}")
+        elif event == 'method_try':
+            word = '' if info['kind'] == 'task' else 'method '
+            print(f"depth {depth} trying {word}{info['method'].__name__}: ", end='')
+        elif event == 'method_applicable':
+            print('applicable')
+            word = 'subtasks' if info['kind'] == 'task' else 'subgoals'
+            print(f"depth {depth} {word}: {info['todo_list']}")
+        elif event == 'backtrack':
+            kind = self.planner._item_kind(info['item'])
+            if kind == 'task':
+                print(f"depth {depth} could not accomplish task {info['item']}")
+            elif kind == 'multigoal':
+                print(f"depth {depth} could not achieve multigoal {info['item']}")
+            elif kind == 'unigoal':
+                if depth in self.achieved:
+                    self.achieved.discard(depth)
+                else:
+                    print(f"depth {depth} could not achieve goal {info['item']}")
+        elif event == 'goal_verified':
+            goal = info['goal']
+            if get_type(goal) == 'Multigoal':
+                print(f"depth {depth}: method {info['method']} achieved {goal}")
+            else:
+                (state_var, arg, desired_val) = goal
+                print(f"depth {depth}: method {info['method']} achieved",
+                      f"goal {state_var}[{arg}] = {desired_val}")
+
 
+class SearchStats():
+    """
+    Statistics about the search done by one call to find_plan. To get them,
+    call find_plan(state, todo_list, stats=True). The attributes are:
+      - nodes: how many nodes the search visited;
+      - max_depth: the depth of the deepest node;
+      - actions_tried and actions_applied: how many times the search tried
+        to apply an action, and how many times the action was applicable.
+        Each try makes a copy of the state, so actions_tried is also the
+        number of states copied;
+      - methods_tried and methods_applicable: likewise for methods;
+      - backtracks: how many times the search ran out of ways to do a node's
+        first todo_list item and went back to an earlier node;
+      - verifications: how many times verify_goals checked a goal method;
+      - wall_time and cpu_time: elapsed and CPU time in seconds (cpu_time
+        is for the thread that did the search);
+      - action_tries, method_tries, and method_successes: Counters keyed by
+        action or method name;
+      - backtracks_by_item: a Counter keyed by the name of the task,
+        unigoal state variable, or action that the search failed to do (or
+        'multigoal').
+    """
 
-def _refine_unigoal_and_continue(state, goal1, todo_list, plan, depth):
+    def __init__(self):
+        self.nodes = 0
+        self.max_depth = 0
+        self.actions_tried = 0
+        self.actions_applied = 0
+        self.methods_tried = 0
+        self.methods_applicable = 0
+        self.backtracks = 0
+        self.verifications = 0
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        self.action_tries = collections.Counter()
+        self.method_tries = collections.Counter()
+        self.method_successes = collections.Counter()
+        self.backtracks_by_item = collections.Counter()
+
+    def __str__(self):
+        return f"<SearchStats {self.nodes} nodes, max depth {self.max_depth}, " + \
+               f"{self.actions_applied}/{self.actions_tried} actions, " + \
+               f"{self.methods_applicable}/{self.methods_tried} methods, " + \
+               f"{self.backtracks} backtracks, {self.wall_time:.3f} seconds>"
+
+    def as_dict(self):
+        """Return the statistics as a dictionary, e.g., for writing as JSON."""
+        return {name: dict(value) if type(value) is collections.Counter else value
+                for (name, value) in vars(self).items() if not name.startswith('_')}
+
+    def start(self):
+        """Start the clocks."""
+        self._wall = time.perf_counter()
+        self._cpu = time.thread_time()
+
+    def stop(self):
+        """Stop the clocks, adding the elapsed time to wall_time and cpu_time."""
+        self.wall_time += time.perf_counter() - self._wall
+        self.cpu_time += time.thread_time() - self._cpu
+
+    def __call__(self, event, info):
+        """Count a trace event (see Planner.add_hook)."""
+        if event == 'node_enter':
+            self.nodes += 1
+            if info['depth'] > self.max_depth:
+                self.max_depth = info['depth']
+        elif event == 'action_try':
+            self.actions_tried += 1
+            self.action_tries[info['action'][0]] += 1
+        elif event == 'action_applied':
+            self.actions_applied += 1
+        elif event == 'method_try':
+            self.methods_tried += 1
+            self.method_tries[info['method'].__name__] += 1
+        elif event == 'method_applicable':
+            self.methods_applicable += 1
+            self.method_successes[info['method'].__name__] += 1
+        elif event == 'backtrack':
+            self.backtracks += 1
+            item = info['item']
+            self.backtracks_by_item['multigoal' if get_type(item) == 'Multigoal'
+                                    else item[0]] += 1
+        elif event == 'goal_verified':
+            self.verifications += 1
+
+
+class MemoryStats():
     """
-    If goal1 is in the unigoal-method dictionary, then iterate through the
-    list of relevant methods to find one that's applicable, apply it to get
-    additional todo_list items, and call seek_plan recursively on
-          [the additional items] + [verify_g] + todo_list,
+    How much memory one call to find_plan used for states. To get it, call
+    find_plan(state, todo_list, memory=True). Most of find_plan's memory is
+    the states on the current search path, since each action makes a new
+    state and the search keeps them all until it backtracks. The attributes
+    are:
+      - states_copied: how many states the search made (one for each try
+        to apply an action);
+      - max_live_states: the largest number of different states on the
+        search path at any one time;
+      - state_bytes: the size of the initial state, including the objects
+        it refers to;
+      - path_bytes and measured_states: the size of the states on the
+        search path the last time they were measured, and the number of
+        them. Objects that several states share (e.g., strings, or values
+        that an action didn't change) are counted once. The path is
+        measured whenever its number of states doubles, and at the end of
+        the search, so measured_states is at least half of max_live_states;
+      - bytes_per_state: path_bytes / measured_states;
+      - peak_bytes: the largest amount of memory that was allocated during
+        the call, beyond what was already allocated at its start. This
+        comes from tracemalloc, which slows the search down; and since
+        tracemalloc sees all threads, it's only meaningful if nothing else
+        is running at the same time. It is None if 'allocations' was False.
+        If tracemalloc was already running, MemoryStats doesn't reset the
+        peak it has recorded, since the caller may be measuring it. Then
+        if the call never got above that peak, the call's own peak can't be
+        known, and peak_bytes is None.
+    """
+
+    def __init__(self, allocations=True):
+        self.allocations = allocations
+        self.states_copied = 0
+        self.max_live_states = 0
+        self.state_bytes = 0
+        self.path_bytes = 0
+        self.measured_states = 0
+        self.bytes_per_state = 0.0
+        self.peak_bytes = None
+        # self._path[j] is the state at depth base+j on the search path, and
+        # self._live[j] is the number of different states in self._path[:j+1]
+        self._path = []
+        self._live = []
+        self._base = None
+        self._tracing = False
 
-    where [verify_g] verifies whether the method actually achieved goal1.
-    If the call to seek_plan fails, go on to the next method in the list.
+    def __str__(self):
+        peak = '' if self.peak_bytes == None else f', peak {self.peak_bytes} bytes'
+        return f"<MemoryStats {self.max_live_states} live states, " + \
+               f"{self.bytes_per_state:.0f} bytes/state{peak}>"
+
+    def as_dict(self):
+        """Return the measurements as a dictionary, e.g., for writing as JSON."""
+        return {name: value for (name, value) in vars(self).items()
+                if not name.startswith('_')}
+
+    def start(self):
+        """Start measuring memory allocations, if self.allocations is True."""
+        if self.allocations:
+            self._tracing = not tracemalloc.is_tracing()
+            if self._tracing:
+                tracemalloc.start()
+            # Whoever started tracemalloc may be measuring its peak, so
+            # rather than resetting it, measure from the current amount
+            (self._baseline, self._earlier_peak) = tracemalloc.get_traced_memory()
+
+    def stop(self):
+        """Stop measuring, and let go of the states on the search path."""
+        if self._live and self._live[-1] > self.measured_states:
+            # E.g., the path to a solution
+            self._measure()
+        if self.allocations:
+            peak = tracemalloc.get_traced_memory()[1]
+            if self._tracing or peak > self._earlier_peak:
+                self.peak_bytes = max(self.peak_bytes or 0, peak - self._baseline)
+            if self._tracing:
+                tracemalloc.stop()
+        self._path = []
+        self._live = []
+        self._base = None
+
+    def __call__(self, event, info):
+        """Handle a trace event (see Planner.add_hook)."""
+        if event == 'node_enter':
+            state = info['state']
+            if self._base is None:
+                self._base = info['depth']
+                self.state_bytes = _deep_size(state, set())
+            j = info['depth'] - self._base
+            path = self._path
+            del path[j:]
+            del self._live[j:]
+            live = 1 if j == 0 else self._live[-1] + (state is not path[-1])
+            path.append(state)
+            self._live.append(live)
+            if live > self.max_live_states:
+                self.max_live_states = live
+                if live >= 2 * self.measured_states:
+                    self._measure()
+        elif event == 'action_try':
+            self.states_copied += 1
+
+    def _measure(self):
+        """Measure the states on the search path."""
+        seen = set()
+        states = []
+        for state in self._path:
+            if not states or state is not states[-1]:
+                states.append(state)
+        self.path_bytes = sum(_deep_size(state, seen) for state in states)
+        self.measured_states = len(states)
+        self.bytes_per_state = self.path_bytes / len(states)
+
+
+def _deep_size(x, seen):
     """
-    if verbose >= 3:
-        print(f'depth {depth} goal {goal1}: ', end='')
-    (state_var_name, arg, val) = goal1
-    if vars(state).get(state_var_name).get(arg) == val:
-        if verbose >= 3:
-            print(f'already achieved')
-        return seek_plan(state, todo_list, plan, depth+1)
-    relevant = current_domain._unigoal_method_dict[state_var_name]
-    if verbose >= 3:
-        print(f'methods {[m.__name__ for m in relevant]}')
-    for method in relevant:
-        if verbose >= 3: 
-            print(f'depth {depth} trying method {method.__name__}: ', end='')
-        subgoals = method(state,arg,val)
-        # Can't just say "if subgoals:", because that's wrong if subgoals == []
-        if subgoals != False and subgoals != None:
-            if verbose >= 3:
-                print('applicable')
-                print(f'depth {depth} subgoals: {subgoals}')
-            if verify_goals:
-                verification = [('_verify_g', method.__name__, \
-                                 state_var_name, arg, val, depth)]
+    Return the number of bytes used by x and the objects it refers to,
+    leaving out the objects whose ids are in the set 'seen' and adding the
+    others' ids to it. Thus objects shared with earlier calls are counted
+    only once.
+    """
+    size = 0
+    stack = [x]
+    while stack:
+        x = stack.pop()
+        if id(x) in seen or isinstance(x, (type, types.ModuleType,
+                                           types.FunctionType)):
+            continue
+        seen.add(id(x))
+        size += sys.getsizeof(x)
+        if isinstance(x, dict):
+            stack.extend(x.keys())
+            stack.extend(x.values())
+        elif isinstance(x, (list, tuple, set, frozenset)):
+            stack.extend(x)
+        elif hasattr(x, '__dict__'):
+            stack.append(vars(x))
+    return size
+
+
+class Profiler():
+    """
+    A hook (see Planner.add_hook) that measures how much time is spent in
+    each of the domain's actions, commands, and methods. For example:
+        prof = Profiler()
+        p = Planner(domain, verbose=0)
+        p.add_hook(prof)
+        p.find_plan(state, todo_list)
+        print(prof.table())
+        prof.write_collapsed('plan.folded')
+
+    prof.functions maps (kind, name) to [calls, seconds], where kind is
+    'action', 'command', or 'method'. The time is the wall-clock time spent
+    in the function itself, including the copy of the state that is made
+    for an action. The rest of the planner's time isn't counted.
+
+    The profiler also attributes each function's time to its place in the
+    decomposition: the chain of tasks and goals (and the methods used for
+    them) above the function. collapsed() returns this in the "collapsed
+    stack" format that flame graph tools (e.g., flamegraph.pl, speedscope,
+    or inferno) read: one line per chain, such as
+        move_blocks;m_moveblocks;move_one;m_move1;unstack 1234
+    where the number is the time in microseconds. Unigoals appear as
+    'goal:state_var_name', and commands executed by run_lazy_lookahead
+    appear under '[acting]'.
+
+    A Profiler keeps one small record for each node on the search's
+    current path, so it works for plans of any length, but recursive
+    methods produce deep chains.
+    """
+
+    def __init__(self):
+        self.functions = {}
+        self._chains = _ChainTree()
+        # chain id -> seconds spent in functions at the end of the chain
+        self._seconds = collections.defaultdict(float)
+        # self._path[d] = (item, length of todo_list, chain, open) for the
+        # node at depth d on the current search path, where 'chain' is the
+        # id of the chain of items above the node's first item, and 'open' is
+        # a linked list (chain id, todo_list length, rest) of those items.
+        self._path = []
+        # The method that produced the node below each depth on the path
+        self._methods = []
+        # (kind, name, chain id, start time) for the function being timed
+        self._running = None
+        # The same for each command being executed, keyed by id(action),
+        # since run_lazy_lookahead_async may execute several at once
+        self._commands = {}
+        self._acting = self._chains.id(-1, '[acting]')
+
+    def __str__(self):
+        calls = sum(c for (c, _) in self.functions.values())
+        seconds = sum(t for (_, t) in self.functions.values())
+        return f"<Profiler {len(self.functions)} functions, {calls} calls, " + \
+               f"{seconds:.3f} seconds>"
+
+    def __call__(self, event, info):
+        """Handle a trace event."""
+        if event == 'node_enter':
+            self._enter(info['depth'], info['todo_list'])
+        elif event == 'action_try':
+            action = info['action']
+            self._start('action', action[0], info['depth'], action[0])
+        elif event == 'method_try':
+            method = info['method'].__name__
+            self._start('method', method, info['depth'], method)
+        elif event == 'method_applicable':
+            self._stop()
+            depth = info['depth']
+            if depth < len(self._methods):
+                self._methods[depth] = info['method'].__name__
+        elif event in {'action_applied', 'action_fail', 'method_fail'}:
+            self._stop()
+        elif event == 'command_try':
+            name = info['command'].__name__
+            chain = self._chains.id(self._acting, name)
+            self._commands[id(info['action'])] = ('command', name, chain,
+                                                  time.perf_counter())
+        elif event == 'command_executed':
+            self._running = self._commands.pop(id(info['action']), None)
+            self._stop()
+
+    def _enter(self, depth, todo_list):
+        """Record the node at 'depth' on the search path."""
+        del self._path[depth:]
+        del self._methods[depth:]
+        (chain, open) = (-1, None)
+        if depth > 0 and depth == len(self._path):
+            # The items above this node's first item are the ones above the
+            # parent's first item, plus the parent's first item, minus the
+            # ones that have been finished (see _Search.tree).
+            (item, length, chain, open) = self._path[-1]
+            chain = self._chains.id(chain, self._frame_name(item))
+            method = self._methods[-1]
+            if method is not None:
+                chain = self._chains.id(chain, method)
+            open = (chain, length, open)
+            while open is not None and len(todo_list) < open[1]:
+                open = open[2]
+            chain = open[0] if open is not None else -1
+        self._path.append((todo_list[0] if todo_list else None, len(todo_list),
+                           chain, open))
+        self._methods.append(None)
+
+    def _start(self, kind, name, depth, frame):
+        """Start timing a function called for the node at 'depth'."""
+        chain = -1
+        if depth < len(self._path):
+            (item, _, chain, _) = self._path[depth]
+            if kind == 'method':
+                chain = self._chains.id(chain, self._frame_name(item))
+        self._running = (kind, name, self._chains.id(chain, frame), time.perf_counter())
+
+    def _stop(self):
+        """Stop timing the current function, and record its time."""
+        if self._running is None:
+            return
+        (kind, name, chain, started) = self._running
+        seconds = time.perf_counter() - started
+        self._running = None
+        entry = self.functions.setdefault((kind, name), [0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+        self._seconds[chain] += seconds
+
+    def _frame_name(self, item):
+        """Return the name to use for a task, goal, or action in a chain."""
+        planner = _active_planner.get()
+        kind = planner._item_kind(item) if planner is not None else None
+        return _item_name(item, kind)
+
+    def collapsed(self):
+        """
+        Return a list of lines in collapsed-stack format, one for each
+        chain in which some time was spent.
+        """
+        lines = []
+        for (i, seconds) in sorted(self._seconds.items()):
+            microseconds = round(seconds * 1e6)
+            if microseconds > 0:
+                lines.append(';'.join(self._chains.frames(i)) + f' {microseconds}')
+        return lines
+
+    def write_collapsed(self, path):
+        """Write collapsed() to the file 'path'."""
+        with open(path, 'w') as f:
+            for line in self.collapsed():
+                f.write(line + '\n')
+
+    def table(self, sort='time', limit=None):
+        """
+        Return a table of the functions, as a string. 'sort' tells how to
+        order the rows: 'time' (the default), 'calls', 'mean', or 'name'.
+        limit (optional) is the largest number of rows to include.
+        """
+        keys = {'time': lambda r: -r[3], 'calls': lambda r: -r[2],
+                'mean': lambda r: -r[4], 'name': lambda r: (r[1], r[0])}
+        if sort not in keys:
+            raise Exception(f"can't sort a profile by {sort}; use one of {list(keys)}")
+        rows = [(kind, name, calls, seconds, seconds / calls)
+                for ((kind, name), (calls, seconds)) in self.functions.items()]
+        total = sum(r[3] for r in rows) or 1.0
+        rows.sort(key=keys[sort])
+        if limit is not None:
+            rows = rows[:limit]
+        width = max([len(r[1]) for r in rows] + [8])
+        lines = [f"{'kind':8} {'function':{width}} {'calls':>9} {'seconds':>10} " +
+                 f"{'usec/call':>10} {'%':>6}"]
+        for (kind, name, calls, seconds, mean) in rows:
+            lines.append(f"{kind:8} {name:{width}} {calls:9} {seconds:10.4f} " +
+                         f"{mean * 1e6:10.1f} {100 * seconds / total:6.1f}")
+        return '\n'.join(lines)
+
+
+
+class SamplingProfiler():
+    """
+    A profiler that is cheap enough to leave running all the time. Rather
+    than timing every call, as Profiler does, it looks at each running
+    search every 'interval' seconds and records its decomposition stack:
+    the chain of tasks and goals (and the methods used for them) above the
+    item that the search is working on, ending with that item. For example:
+        sampler = SamplingProfiler(interval=0.01)
+        sampler.start()
+        ...     # plan as usual, in any number of threads
+        sampler.stop()
+        print(sampler.table())
+        sampler.write_collapsed('plan.folded')
+    or
+        with SamplingProfiler() as sampler:
+            p.find_plan(state, todo_list)
+
+    The stacks are made of the domain's names, not Python's, and they are
+    named the same way as Profiler's. sampler.samples is the number of
+    stacks recorded, and collapsed() returns them in collapsed-stack format,
+    where the number on each line is the number of samples of that stack.
+    table() tells, for each task, goal, action, and method, how many
+    samples it was at the end of (the planner was working on it) and how
+    many it appeared in at all.
+
+    The sampling is done by a background thread, and it doesn't use trace
+    hooks, so planning runs at full speed between samples. The thread keeps
+    a copy of each search's path and only looks at the part that has
+    changed since the previous sample, so a sample costs little even when
+    the search is very deep; with the default interval, the overhead is
+    usually around 1%. Only searches that start (or, for find_plan_async,
+    resume) after start() are sampled, and since a sample is only taken
+    when the sampling thread gets Python's global interpreter lock, the
+    samples are spaced a little further apart than 'interval'.
+    """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.samples = 0
+        self._chains = _ChainTree()
+        # chain id -> number of samples of that stack
+        self._counts = collections.Counter()
+        # id(search) -> (search, path, cells), where 'path' is a copy of the
+        # search's nodes as of the previous sample, and cells[j] is
+        # (chain, open) for path[j], as in Profiler._path
+        self._paths = {}
+        self._thread = None
+        self._stopping = threading.Event()
+
+    def __str__(self):
+        return f"<SamplingProfiler {self.samples} samples, {len(self._counts)} stacks>"
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        """Start sampling. Return the SamplingProfiler."""
+        global _samplers
+        if self._thread is not None:
+            raise Exception("the SamplingProfiler has already been started")
+        with _sampling_lock:
+            _samplers += 1
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='SamplingProfiler',
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop sampling. The samples are kept, and start() adds more."""
+        global _samplers
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join()
+        self._thread = None
+        self._paths.clear()
+        with _sampling_lock:
+            _samplers -= 1
+
+    def _run(self):
+        """The sampling thread's loop."""
+        while not self._stopping.wait(self.interval):
+            searches = list(_sampled_searches.values())
+            for search in searches:
+                chain = self._sample(search)
+                if chain is not None:
+                    self._counts[chain] += 1
+                    self.samples += 1
+            if len(self._paths) > len(searches):
+                running = {id(search) for search in searches}
+                for key in [key for key in self._paths if key not in running]:
+                    del self._paths[key]
+
+    def _sample(self, search):
+        """
+        Return the id of the chain for the item 'search' is working on, or
+        None if it isn't working on one.
+        """
+        nodes = list(search.nodes)
+        if not nodes or not nodes[-1][1]:
+            return None
+        entry = self._paths.get(id(search))
+        if entry is None:
+            entry = (search, [], [])
+            self._paths[id(search)] = entry
+        (_, path, cells) = entry
+        # The search only adds and removes nodes at the end of its path, so
+        # the nodes that haven't changed are a prefix of it.
+        (low, high) = (0, min(len(path), len(nodes)))
+        while low < high:
+            middle = (low + high) // 2
+            if path[middle] is nodes[middle]:
+                low = middle + 1
             else:
-                verification = []
-            todo_list = subgoals + verification + todo_list
-            result = seek_plan(state, todo_list, plan, depth+1)
-            if result != False and result != None:
-                return result
+                high = middle
+        del path[low:]
+        del cells[low:]
+        planner = search.planner
+        for j in range(low, len(nodes)):
+            node = nodes[j]
+            (chain, open) = (-1, None)
+            if j > 0:
+                # See Profiler._enter
+                (chain, open) = cells[j-1]
+                above = path[j-1][1]
+                chain = self._chains.id(chain, _item_name(above[0],
+                                                          planner._item_kind(above[0])))
+                if node[3] is not None:
+                    chain = self._chains.id(chain, node[3])
+                open = (chain, len(above), open)
+                while open is not None and len(node[1]) < open[1]:
+                    open = open[2]
+                chain = open[0] if open is not None else -1
+            path.append(node)
+            cells.append((chain, open))
+        item = nodes[-1][1][0]
+        return self._chains.id(cells[-1][0], _item_name(item, planner._item_kind(item)))
+
+    def collapsed(self):
+        """
+        Return a list of lines in collapsed-stack format, one for each
+        stack that was sampled.
+        """
+        return [';'.join(self._chains.frames(i)) + f' {count}'
+                for (i, count) in sorted(self._counts.items())]
+
+    def write_collapsed(self, path):
+        """Write collapsed() to the file 'path'."""
+        with open(path, 'w') as f:
+            for line in self.collapsed():
+                f.write(line + '\n')
+
+    def table(self, sort='total', limit=None):
+        """
+        Return a table of the frames, as a string. 'self' is the number of
+        samples that ended with the frame, and 'total' is the number that
+        included it. 'sort' tells how to order the rows: 'total' (the
+        default), 'self', or 'name'. limit (optional) is the largest number
+        of rows to include.
+        """
+        keys = {'total': lambda r: (-r[2], r[0]), 'self': lambda r: (-r[1], r[0]),
+                'name': lambda r: r[0]}
+        if sort not in keys:
+            raise Exception(f"can't sort a profile by {sort}; use one of {list(keys)}")
+        own = collections.Counter()
+        total = collections.Counter()
+        for (i, count) in list(self._counts.items()):
+            frames = self._chains.frames(i)
+            own[frames[-1]] += count
+            for frame in set(frames):
+                total[frame] += count
+        rows = sorted([(frame, own[frame], n) for (frame, n) in total.items()],
+                      key=keys[sort])
+        if limit is not None:
+            rows = rows[:limit]
+        samples = sum(self._counts.values()) or 1
+        width = max([len(r[0]) for r in rows] + [8])
+        lines = [f"{'frame':{width}} {'self':>9} {'%':>6} {'total':>9} {'%':>6}"]
+        for (frame, n_self, n_total) in rows:
+            lines.append(f"{frame:{width}} {n_self:9} {100 * n_self / samples:6.1f} " +
+                         f"{n_total:9} {100 * n_total / samples:6.1f}")
+        return '\n'.join(lines)
+
+
+class ProgressReporter():
+    """
+    A hook (see Planner.add_hook) that reports how a long search is going,
+    so that one can tell a search that is slow but making progress from one
+    that is stuck in a backtracking loop. For example:
+        reporter = ProgressReporter(path='planner-status.json', interval=5)
+        p.add_hook(reporter)
+    At most once every 'interval' seconds during a search, and once at its
+    end, the reporter makes a dictionary with the following entries:
+      - 'status' is 'searching' while the search is running, and at the end
+        it is 'solved', 'failed', or 'interrupted' (by an exception such as
+        PlanningTimeout);
+      - 'time' is the time.time() of the report, and 'elapsed' is the
+        number of seconds since the search started;
+      - 'nodes' is the number of nodes visited so far, and 'nodes_per_sec'
+        is the rate during the last interval;
+      - 'depth' is the current depth, and 'min_depth' and 'max_depth' are
+        the smallest and largest depths during the last interval;
+      - 'plan_length' is the length of the current node's partial plan, and
+        'best_plan_length' is the length of the longest partial plan that
+        the search has reached (the one PlanningTimeout would give);
+      - 'backtracks' is the number of backtracks so far, 'backtracks_per_sec'
+        is the rate during the last interval, and 'backtrack_ratio' is the
+        number of backtracks per node during the last interval.
+    A search that is making progress usually has a growing best_plan_length,
+    while one that is stuck usually has a high backtrack_ratio and a narrow
+    range of depths.
+
+    The reporter calls callback(report), if there's a callback, in the
+    thread that is doing the search. If there's a path, it writes the report
+    as JSON to that file, replacing the file atomically so that readers
+    never see a partly-written one. So that a slow disk doesn't slow the
+    search down, the reports during the search are written by a background
+    thread, which stops at the end of the search; the last report is
+    written before find_plan returns.
+    reporter.latest is the latest report.
+    Each report is a new dictionary, so other threads can read
+    reporter.latest at any time. The reporter only looks at the clock every
+    few nodes, so it costs very little, but nothing is reported while the
+    search is inside one action or method. Use a separate reporter for each
+    thread that plans at the same time.
+    """
+
+    # How many nodes to visit between looks at the clock
+    check_every = 16
+
+    def __init__(self, callback=None, path=None, interval=1.0):
+        self.callback = callback
+        self.path = path
+        self.interval = interval
+        self.latest = None
+        self._lock = threading.Lock()
+        self._pending = threading.Event()
+        self._writer = None
+        self._reset()
+
+    def _reset(self):
+        """Get ready for a new search."""
+        self._started = None
+        self._nodes = 0
+        self._backtracks = 0
+        self._depth = 0
+        self._plan_length = 0
+        self._best_plan_length = 0
+        self._countdown = self.check_every
+        # Values at the time of the last report, and the range of depths since
+        self._last_time = None
+        self._last_nodes = 0
+        self._last_backtracks = 0
+        self._min_depth = None
+        self._max_depth = 0
+
+    def __call__(self, event, info):
+        """Handle a trace event."""
+        if event == 'node_enter':
+            if self._started is None:
+                self._started = self._last_time = time.perf_counter()
+            self._nodes += 1
+            depth = info['depth']
+            self._depth = depth
+            if self._min_depth is None or depth < self._min_depth:
+                self._min_depth = depth
+            if depth > self._max_depth:
+                self._max_depth = depth
+            self._plan_length = len(info['plan'])
+            if self._plan_length > self._best_plan_length:
+                self._best_plan_length = self._plan_length
+            self._countdown -= 1
+            if self._countdown == 0:
+                self._countdown = self.check_every
+                if time.perf_counter() - self._last_time >= self.interval:
+                    self._report('searching')
+        elif event == 'backtrack':
+            self._backtracks += 1
+        elif event == 'plan_start':
+            self._reset()
+        elif event == 'plan_end':
+            result = info['result']
+            if self._started is not None:
+                self._report('interrupted' if result == None else
+                             'failed' if result == False else 'solved')
+            self._reset()
+
+    def _report(self, status):
+        """Make a report, and deliver it."""
+        now = time.perf_counter()
+        span = max(now - self._last_time, 1e-9)
+        nodes = self._nodes - self._last_nodes
+        backtracks = self._backtracks - self._last_backtracks
+        report = {'status': status, 'time': time.time(),
+                  'elapsed': now - self._started, 'nodes': self._nodes,
+                  'nodes_per_sec': nodes / span, 'depth': self._depth,
+                  'min_depth': self._min_depth if self._min_depth is not None
+                               else self._depth,
+                  'max_depth': self._max_depth, 'plan_length': self._plan_length,
+                  'best_plan_length': self._best_plan_length,
+                  'backtracks': self._backtracks,
+                  'backtracks_per_sec': backtracks / span,
+                  'backtrack_ratio': backtracks / nodes if nodes else 0.0}
+        self._last_time = now
+        self._last_nodes = self._nodes
+        self._last_backtracks = self._backtracks
+        self._min_depth = None
+        self._max_depth = self._depth
+        self.latest = report
+        if self.path:
+            if status != 'searching':
+                self._stop_writer()
+                self._write(report)
+            else:
+                if self._writer is None:
+                    self._writer = threading.Thread(target=self._write_reports,
+                                                    daemon=True)
+                    self._writer.start()
+                self._pending.set()
+        if self.callback is not None:
+            self.callback(report)
+
+    def _write_reports(self):
+        """
+        In a background thread, write each new report to self.path, until
+        the search ends.
+        """
+        while True:
+            self._pending.wait()
+            self._pending.clear()
+            report = self.latest
+            if report['status'] != 'searching':
+                return
+            self._write(report)
+
+    def _stop_writer(self):
+        """
+        Wait for the background thread to finish. self.latest must already
+        be the search's last report.
+        """
+        if self._writer is not None:
+            self._pending.set()
+            self._writer.join()
+            self._writer = None
+
+    def _write(self, report):
+        """Write 'report' to self.path, unless a newer report has been made."""
+        with self._lock:
+            if report is self.latest:
+                temp = f'{self.path}.tmp'
+                with open(temp, 'w') as f:
+                    json.dump(report, f)
+                os.replace(temp, self.path)
+
+
+class ChromeTrace():
+    """
+    A hook (see Planner.add_hook) that writes what the planner and actor do
+    to a file in the Trace Event Format, which chrome://tracing, Perfetto
+    (ui.perfetto.dev), and speedscope can display as a timeline. For example:
+        with ChromeTrace('mission.json') as trace:
+            p.add_hook(trace)
+            p.run_lazy_lookahead(state, todo_list)
+        p.remove_hook(trace)
+
+    Each call to find_plan is a span. Inside it are nested spans for the
+    tasks and goals that the search refines, the methods it tries, and the
+    actions it tries; their 'args' tell which item, whether the method or
+    action was applicable, and whether the task or goal was accomplished
+    or abandoned by backtracking. Backtracks are instant events. Each
+    command that run_lazy_lookahead (or one of its relatives) executes is
+    a span whose 'args' include the outcome. Each thread gets its own row.
+
+    The events are written to the file in batches of buffer_size, so a long
+    search doesn't need to keep them in memory. close(), or the end of the
+    'with' statement, writes the rest and finishes the file. If the program
+    stops before then, the file can still be read, since the format allows
+    the closing ']' to be missing.
+    """
+
+    def __init__(self, path, buffer_size=10000):
+        self.path = path
+        self.buffer_size = buffer_size
+        self._file = open(path, 'w')
+        self._file.write('[\n')
+        self._buffer = []
+        self._first = True
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._pid = os.getpid()
+        self._epoch = time.perf_counter()
+        self._emit({'name': 'process_name', 'ph': 'M', 'pid': self._pid,
+                    'args': {'name': 'GTPyhop'}})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Write the remaining events, and finish and close the file."""
+        with self._lock:
+            if self._file is None:
+                return
+            self._flush()
+            self._file.write('\n]\n')
+            self._file.close()
+            self._file = None
+
+    def __call__(self, event, info):
+        """Handle a trace event."""
+        now = (time.perf_counter() - self._epoch) * 1e6
+        local = self._local
+        if not hasattr(local, 'items'):
+            # Per thread: the find_plan calls in progress, as pairs (start
+            # time, len(local.items)); the tasks and goals being worked on,
+            # as tuples (depth, todo_list length, start time, name, kind,
+            # item); the (depth, todo_list length) of the current node; the
+            # start time of the current method or action; and the start
+            # times of the commands being executed, keyed by id(action)
+            local.plans = []
+            local.items = []
+            local.node = (0, 0)
+            local.started = now
+            local.commands = {}
+        if event == 'node_enter':
+            self._close_items(local, info['depth'], len(info['todo_list']), now)
+            local.node = (info['depth'], len(info['todo_list']))
+        elif event == 'refine':
+            item = info['item']
+            local.items.append(local.node + (now, _item_name(item, info['kind']),
+                                             info['kind'], _item_to_string(item)))
+        elif event in {'action_try', 'method_try'}:
+            local.started = now
+        elif event in {'action_applied', 'action_fail'}:
+            action = info['action']
+            self._span(action[0], 'action', local.started, now,
+                       {'action': _item_to_string(action),
+                        'applicable': event == 'action_applied'})
+        elif event in {'method_applicable', 'method_fail'}:
+            self._span(info['method'].__name__, 'method', local.started, now,
+                       {'item': _item_to_string(info['item']),
+                        'applicable': event == 'method_applicable'})
+        elif event == 'backtrack':
+            self._emit({'name': 'backtrack', 'cat': 'backtrack', 'ph': 'i', 's': 't',
+                        'ts': round(now, 3), 'pid': self._pid,
+                        'tid': threading.get_ident(),
+                        'args': {'depth': info['depth'],
+                                 'item': _item_to_string(info['item'])}})
+        elif event == 'plan_start':
+            local.plans.append((now, len(local.items)))
+        elif event == 'plan_end' and local.plans:
+            (start, base) = local.plans.pop()
+            result = info['result']
+            done = result != None and result != False
+            while len(local.items) > base:
+                self._close_item(local.items.pop(), now,
+                                 'accomplished' if done else 'abandoned')
+            outcome = f'{len(result)} actions' if done else \
+                      'failed' if result == False else 'interrupted'
+            self._span('find_plan', 'find_plan', start, now, {'result': outcome})
+        elif event == 'command_try':
+            local.commands[id(info['action'])] = now
+        elif event == 'command_executed':
+            start = local.commands.pop(id(info['action']), now)
+            self._span(info['command'].__name__, 'command', start, now,
+                       {'action': _item_to_string(info['action']),
+                        'outcome': info['outcome']})
+
+    def _close_items(self, local, depth, length, now):
+        """
+        When the search reaches a node at 'depth' whose todo_list has
+        'length' items, close the spans of the tasks and goals that it
+        has accomplished or abandoned.
+        """
+        items = local.items
+        base = local.plans[-1][1] if local.plans else 0
+        while len(items) > base:
+            if items[-1][0] >= depth:
+                # The search has backtracked to this depth or above
+                self._close_item(items.pop(), now, 'abandoned')
+            elif length < items[-1][1]:
+                # The todo_list is shorter, so the item is done (see _Search.tree)
+                self._close_item(items.pop(), now, 'accomplished')
+            else:
+                break
+
+    def _close_item(self, entry, now, outcome):
+        """Write the span for a task or goal."""
+        (depth, _, start, name, kind, item) = entry
+        self._span(name, kind, start, now, {'item': item, 'depth': depth,
+                                            'outcome': outcome})
+
+    def _span(self, name, category, start, end, args):
+        """Write a span ('complete' event) for the current thread."""
+        self._emit({'name': name, 'cat': category, 'ph': 'X',
+                    'ts': round(start, 3), 'dur': round(end - start, 3),
+                    'pid': self._pid, 'tid': threading.get_ident(), 'args': args})
+
+    def _emit(self, record):
+        """Add an event to the buffer, and write the buffer if it's full."""
+        line = json.dumps(record, default=str)
+        with self._lock:
+            self._buffer.append(line)
+            if len(self._buffer) >= self.buffer_size:
+                self._flush()
+
+    def _flush(self):
+        """Write the buffered events to the file. The caller holds self._lock."""
+        if self._buffer and self._file is not None:
+            if not self._first:
+                self._file.write(',\n')
+            self._file.write(',\n'.join(self._buffer))
+            self._file.flush()
+            self._first = False
+        self._buffer.clear()
+
+
+class _ChainTree():
+    """
+    The chains of frames (names of tasks, goals, methods, and so forth) that
+    Profiler and SamplingProfiler attribute time to. The chains form a tree,
+    and each one has an integer id; -1 is the empty chain.
+    """
+
+    def __init__(self):
+        self._ids = {}          # (parent chain id, frame) -> chain id
+        self._frames = []       # chain id -> the chain's last frame
+        self._parents = []      # chain id -> the id of its parent
+
+    def id(self, parent, frame):
+        """Return the id of the chain that is 'parent' followed by 'frame'."""
+        key = (parent, frame)
+        i = self._ids.get(key)
+        if i is None:
+            i = len(self._frames)
+            self._ids[key] = i
+            self._frames.append(frame)
+            self._parents.append(parent)
+        return i
+
+    def frames(self, i):
+        """Return the list of frames in chain i, outermost first."""
+        frames = []
+        while i != -1:
+            frames.append(self._frames[i])
+            i = self._parents[i]
+        frames.reverse()
+        return frames
+
+
+def _item_name(item, kind):
+    """
+    Return a short name for a task, goal, or action, for profiles and
+    traces. 'kind' is what Planner._item_kind would return for it.
+    """
+    if get_type(item) == 'Multigoal':
+        return 'multigoal'
+    if kind == 'unigoal':
+        return f'goal:{item[0]}'
+    return item[0]
+
+
+################################################################################
+# A planning-and-acting context
+
+
+class Planner():
+    """
+    p = Planner(domain, verbose=v, verify_goals=vg) creates an object that
+    plans and acts in 'domain', using its own settings rather than the
+    global variables current_domain, verbose, and verify_goals. Any argument
+    that is omitted defaults to the current value of the global variable.
+
+    A Planner doesn't change anything outside itself, so several Planners
+    (e.g., for different domains, or with different verbosity levels) can
+    be used at the same time in different threads. The module-level
+    functions find_plan, find_plan_async, seek_plan, and run_lazy_lookahead
+    just create a Planner from the global variables and call its method of
+    the same name.
+
+    Example:
+        p = Planner(blocks_domain, verbose=0)
+        plan = p.find_plan(state1, [('achieve', goal1)])
+
+    If the optional 'cache' argument is a PlanCache, then find_plan and
+    find_plan_async will look up each problem in the cache before planning,
+    and store the result in the cache afterward.
+    """
+
+    def __init__(self, domain=None, verbose=None, verify_goals=None, cache=None):
+        """
+        domain is the Domain to use; verbose and verify_goals have the same
+        meanings as the global variables with those names; cache (optional)
+        is a PlanCache.
+        """
+        self.domain = domain if domain is not None else current_domain
+        if self.domain == None:
+            raise Exception(f"cannot create a Planner until a domain has been created.")
+        # The functions that add_hook has added, for each trace event
+        self._hooks = {}
+        self._printer = _TracePrinter(self)
+        self.verbose = verbose if verbose is not None else globals()['verbose']
+        self.verify_goals = verify_goals if verify_goals is not None \
+                            else globals()['verify_goals']
+        self.cache = cache
+        self._counter_lock = threading.Lock()
+        self._reset_counters()
+
+    def __str__(self):
+        return f"<Planner for {self.domain}, verbose={self.verbose}>"
+
+    def _reset_counters(self):
+        """
+        Reset the counters that describe an acting run. run_lazy_lookahead
+        and its relatives call this when they start.
+        """
+        with self._counter_lock:
+            # How many times a command's effects differed from its action's,
+            # how many times the rest of the plan still worked when something
+            # went wrong, and how many plans were repaired rather than
+            # replaced
+            self.surprises = 0
+            self.replans_avoided = 0
+            self.repairs = 0
+            # How many of run_concurrent_lookahead's plans were found in the
+            # background while it was acting
+            self.hot_swaps = 0
+            # How many observations the actor got, and how many of them
+            # affected the rest of the plan
+            self.observations = 0
+            self.relevant_observations = 0
+            # (tries, kind, seconds) for each of the actor's planning rounds
+            self.planning_rounds = []
+
+    def _count(self, counter):
+        """Add 1 to the counter named 'counter' (see _reset_counters)."""
+        with self._counter_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    @property
+    def verbose(self):
+        """How much information to print (see the global variable verbose)."""
+        return self._verbose
+
+    @verbose.setter
+    def verbose(self, value):
+        self._verbose = value
+        self._update_trace()
+
+    ############################################################
+    # Tracing
+
+    def add_hook(self, handler, events=None):
+        """
+        Call handler(event, info) whenever one of the trace events in the
+        list 'events' (default: all of TRACE_EVENTS) happens while the
+        Planner is planning or acting. 'event' is the event's name and
+        'info' is a dictionary that describes it; see TRACE_EVENTS for what
+        each event's dictionary contains. The handler must not change
+        anything in 'info'.
+
+        If a Planner has no hooks and verbose < 2, it doesn't produce any
+        trace events at all, so planning runs at full speed. (The messages
+        that find_plan prints when verbose >= 2 come from a hook of its own.)
+        """
+        for event in (TRACE_EVENTS if events is None else events):
+            if event not in TRACE_EVENTS:
+                raise Exception(f"{event} isn't one of the trace events {TRACE_EVENTS}")
+            self._hooks.setdefault(event, []).append(handler)
+        self._update_trace()
+
+    def remove_hook(self, handler):
+        """Stop calling 'handler' for any of the trace events."""
+        for handlers in self._hooks.values():
+            while handler in handlers:
+                handlers.remove(handler)
+        self._update_trace()
+
+    def _copy_with_hook(self, handler):
+        """
+        Return a copy of the Planner that also calls 'handler' for every
+        trace event, so that it can trace one call without affecting other
+        threads that are using the Planner.
+        """
+        planner = copy.copy(self)
+        planner._hooks = {event: list(hooks) for (event, hooks) in self._hooks.items()}
+        planner.add_hook(handler)
+        return planner
+
+    def _update_trace(self):
+        """
+        Set self._trace to a function that calls the hooks for a trace
+        event, or to None if there are no hooks.
+        """
+        handlers = {event: list(hooks) for (event, hooks) in self._hooks.items()}
+        if self._verbose >= 2:
+            for event in _TracePrinter.events:
+                handlers.setdefault(event, []).insert(0, self._printer)
+        self._handlers = {event: tuple(hooks) for (event, hooks) in handlers.items()
+                          if hooks}
+        self._trace = self._dispatch if self._handlers else None
+
+    def _dispatch(self, event, **info):
+        """Call the hooks for 'event'."""
+        for handler in self._handlers.get(event, ()):
+            handler(event, info)
+
+    ############################################################
+    # The planning algorithm
+
+    def find_plan(self, state, todo_list, token=None, tree=False, time_limit=None,
+                  stats=False, memory=False):
+        """
+        find_plan tries to find a plan that accomplishes the items in
+        todo_list, starting from the given state, using the actions and
+        methods in self.domain. If successful, it returns the plan.
+        Otherwise it returns False. Arguments:
+         - 'state' is a state;
+         - 'todo_list' is a list of goals, tasks, and actions;
+         - 'token' (optional) is a CancellationToken. If someone cancels it
+           while find_plan is running, find_plan will raise PlanningCancelled.
+         - If 'tree' is True, then find_plan returns a pair (plan, t), where
+           t is a DecompositionTree telling how the planner got the plan (or
+           None if there's no plan). If the Planner has a cache, the pair is
+           cached, separately from the plans that find_plan returns without
+           a tree.
+         - time_limit (optional) is a number of seconds. If find_plan hasn't
+           finished by then, it raises PlanningTimeout.
+         - If 'stats' is True, then find_plan also returns a SearchStats
+           object that tells how much work the search did, i.e., it returns
+           (plan, stats), or (plan, t, stats) if 'tree' is also True. Since
+           the stats must come from a search, this keeps find_plan from
+           looking in the cache.
+         - If 'memory' is True, then find_plan also returns a MemoryStats
+           object that tells how much memory the search used for states,
+           after the SearchStats object if 'stats' is also True. This also
+           keeps find_plan from looking in the cache.
+        """
+        collectors = []
+        if stats:
+            collectors.append(SearchStats())
+        if memory:
+            collectors.append(MemoryStats())
+        if collectors:
+            planner = self
+            for collector in collectors:
+                planner = planner._copy_with_hook(collector)
+                collector.start()
+            try:
+                result = planner._find_plan(state, todo_list, token, tree,
+                                            time_limit, False)
+            finally:
+                for collector in collectors:
+                    collector.stop()
+            return (result if tree else (result,)) + tuple(collectors)
+        return self._find_plan(state, todo_list, token, tree, time_limit, True)
+
+    def _find_plan(self, state, todo_list, token, tree, time_limit, look_up):
+        """
+        Do find_plan's work (except for 'stats'). If look_up is False, don't
+        look for the result in the cache.
+        """
+        self._print_find_plan_call(state, todo_list)
+        trace = self._trace
+        if trace is not None:
+            trace('plan_start', state=state, todo_list=todo_list)
+        result = None
+        try:
+            if look_up:
+                (key, answer) = self._look_up(state, todo_list, tree)
+            else:
+                (key, answer) = (None, None)
+            if answer is None:
+                search = self._seek(state, todo_list, [], 0, token, time_limit)
+                answer = search.result
+                if tree:
+                    answer = (answer, search.tree() if answer != False else None)
+                if self.cache is not None:
+                    if key is None:
+                        key = self._cache_key(state, todo_list, tree)
+                    self.cache.put(key, answer)
+            result = answer[0] if tree else answer
+        finally:
+            if trace is not None:
+                trace('plan_end', result=result)
+        if self.verbose >= 1: print('FP> result =',result,'\n')
+        return answer
+
+    async def find_plan_async(self, state, todo_list, yield_every=100,
+                              yield_interval=None, token=None):
+        """
+        find_plan_async is a coroutine version of find_plan, for use with
+        asyncio. It does the same search as find_plan, but it gives control
+        back to the event loop every so often, so that other coroutines can
+        run while it's planning. Arguments:
+         - 'state', 'todo_list' and 'token' are the same as for find_plan;
+         - yield_every is how many nodes to expand between yields. It must
+           be at least 1, or find_plan_async raises ValueError;
+         - yield_interval (optional) is a time in seconds. If it is given,
+           then find_plan_async will also yield whenever that much time has
+           passed since the last yield, even if yield_every nodes haven't
+           been expanded.
+
+        To stop the search, cancel the asyncio task that is running it. The
+        cancellation takes effect at the next yield.
+        """
+        if yield_every < 1:
+            raise ValueError(f"yield_every must be at least 1, not {yield_every}")
+        self._print_find_plan_call(state, todo_list)
+        trace = self._trace
+        if trace is not None:
+            trace('plan_start', state=state, todo_list=todo_list)
+        result = None
+        try:
+            (key, result) = self._look_up(state, todo_list)
+            if result is None:
+                result = await self._seek_async(state, todo_list, yield_every,
+                                                yield_interval, token)
+                if key is not None: self.cache.put(key, result)
+        finally:
+            if trace is not None:
+                trace('plan_end', result=result)
+        if self.verbose >= 1: print('FP> result =',result,'\n')
+        return result
+
+    async def _seek_async(self, state, todo_list, yield_every, yield_interval, token):
+        """Do find_plan_async's search, and return its result."""
+        search = _Search(self, state, todo_list, [], 0)
+        if yield_interval is None:
+            while not search.run(yield_every):
+                if token is not None: token.check()
+                await asyncio.sleep(0)
         else:
+            granule = min(yield_every, _CLOCK_CHECK_INTERVAL)
+            expanded = 0
+            last_yield = time.perf_counter()
+            while not search.run(granule):
+                if token is not None: token.check()
+                expanded += granule
+                if expanded >= yield_every or \
+                        time.perf_counter() - last_yield >= yield_interval:
+                    await asyncio.sleep(0)
+                    expanded = 0
+                    last_yield = time.perf_counter()
+        return search.result
+
+    def _look_up(self, state, todo_list, tree=False):
+        """
+        If the planner has a cache, return (key, result), where key is the
+        cache key for the problem and result is the cached result or None.
+        Otherwise return (None, None). If 'tree' is True, the result is a
+        (plan, DecompositionTree) pair, as find_plan returns with tree=True.
+        """
+        if self.cache is None:
+            return (None, None)
+        key = self._cache_key(state, todo_list, tree)
+        result = self.cache.get(key)
+        if result is not None and self.verbose >= 2:
+            print('FP> found the result in the plan cache')
+        return (key, result)
+
+    def _cache_key(self, state, todo_list, tree):
+        """
+        Return the cache key for find_plan's result. Results with trees are
+        kept under different keys than plans alone.
+        """
+        key = self.cache.key(self.domain, state, todo_list)
+        return key + ('<tree>',) if tree else key
+
+    def _print_find_plan_call(self, state, todo_list):
+        """Print find_plan's arguments if verbose >= 1."""
+        if self.verbose >= 1:
+            todo_string = '[' + ', '.join([_item_to_string(x) for x in todo_list]) + ']'
+            print(f'FP> find_plan, verbose={self.verbose}:')
+            print(f'    state = {state.__name__}\n    todo_list = {todo_string}')
+
+    def seek_plan(self, state, todo_list, plan, depth, token=None):
+        """
+        Workhorse for find_plan. Arguments:
+         - state is the current state
+         - todo_list is the current list of goals, tasks, and actions
+         - plan is the current partial plan
+         - depth is the recursion depth, for use in debugging
+         - token (optional) is a CancellationToken to check during the search
+        """
+        return self._seek(state, todo_list, plan, depth, token).result
+
+    def _seek(self, state, todo_list, plan, depth, token=None, time_limit=None):
+        """
+        Do seek_plan's search, and return the finished _Search. If
+        time_limit isn't None, raise PlanningTimeout if the search takes
+        more than that many seconds.
+        """
+        search = _Search(self, state, todo_list, plan, depth)
+        if time_limit is not None:
+            deadline = time.perf_counter() + time_limit
+            partial_plan = plan
+            if token is not None: token.check()
+            while not search.run(_CLOCK_CHECK_INTERVAL):
+                if token is not None: token.check()
+                if search.nodes and len(search.nodes[-1][2]) > len(partial_plan):
+                    partial_plan = search.nodes[-1][2]
+                if time.perf_counter() >= deadline:
+                    raise PlanningTimeout(
+                        f"find_plan ran out of time after {time_limit} seconds",
+                        list(partial_plan))
+        elif token is None:
+            search.run()
+        else:
+            # Check the token every _CANCEL_CHECK_INTERVAL nodes, so that the
+            # search loop itself doesn't pay anything for it.
+            token.check()
+            while not search.run(_CANCEL_CHECK_INTERVAL):
+                token.check()
+        return search
+
+    ############################################################
+    # Applying actions, commands, and methods
+    #
+    # Each of the _..._and_continue methods below is a generator. It yields
+    # (state, todo_list, plan, method_name) tuples for the nodes that the
+    # planner should continue with, in the order in which the planner should
+    # try them. method_name is the name of the method that produced the node,
+    # or None if no method was used. If the planner backtracks to the
+    # generator, the generator goes on to the next alternative.
+
+    def _expand(self, state, todo_list, plan, depth):
+        """
+        Return a generator for the alternative ways to continue from a node
+        whose first todo_list item is todo_list[0].
+        """
+        domain = self.domain
+        item1 = todo_list[0]
+        ttype = get_type(item1)
+        if ttype in {'Multigoal'}:
+            return self._refine_multigoal_and_continue(state, item1, todo_list[1:], plan, depth)
+        elif ttype in {'list','tuple'}:
+            if item1[0] in domain._action_dict:
+                return self._apply_action_and_continue(state, item1, todo_list[1:], plan, depth)
+            elif item1[0] in domain._task_method_dict:
+                return self._refine_task_and_continue(state, item1, todo_list[1:], plan, depth)
+            elif item1[0] in domain._unigoal_method_dict:
+                return self._refine_unigoal_and_continue(state, item1, todo_list[1:], plan, depth)
+        raise Exception(    \
+            f"depth {depth}: {item1} isn't an action, task, unigoal, or multigoal\n")
+
+    def _apply_action_and_continue(self, state, task1, todo_list, plan, depth):
+        """
+        _apply_action_and_continue is called only when task1's name matches
+        an action name. It applies the action by retrieving the action's
+        function definition and calling it on the arguments, then yields the
+        new state, todo_list, and plan+[task1] so that the planner can
+        continue with them.
+        """
+        trace = self._trace
+        if trace is not None:
+            trace('action_try', depth=depth, action=task1)
+        action = self.domain._action_dict[task1[0]]
+        newstate = action(state.copy(),*task1[1:])
+        if newstate:
+            if trace is not None:
+                trace('action_applied', depth=depth, action=task1, state=newstate)
+            yield (newstate, todo_list, plan+[task1], None)
+            return
+        if trace is not None:
+            trace('action_fail', depth=depth, action=task1)
+
+    def _refine_task_and_continue(self, state, task1, todo_list, plan, depth):
+        """
+        If task1 is in the task-method dictionary, then iterate through the
+        list of relevant methods to find one that's applicable, apply it to
+        get additional todo_list items, and yield
+                [the additional items] + todo_list
+        so that the planner can continue with it.
+
+        If the planner can't find a plan that way, go on to the next method
+        in the list.
+        """
+        trace = self._trace
+        relevant = self.domain._task_method_dict[task1[0]]
+        if trace is not None:
+            trace('refine', depth=depth, item=task1, kind='task', methods=relevant)
+        for method in relevant:
+            if trace is not None:
+                trace('method_try', depth=depth, item=task1, kind='task', method=method)
+            subtasks = method(state, *task1[1:])
+            # Can't just say "if subtasks:", because that's wrong if subtasks == []
+            if subtasks != False and subtasks != None:
+                if trace is not None:
+                    trace('method_applicable', depth=depth, item=task1, kind='task',
+                          method=method, todo_list=subtasks)
+                yield (state, subtasks+todo_list, plan, method.__name__)
+            else:
+                if trace is not None:
+                    trace('method_fail', depth=depth, item=task1, kind='task',
+                          method=method)
+
+    def _refine_unigoal_and_continue(self, state, goal1, todo_list, plan, depth):
+        """
+        If goal1 is in the unigoal-method dictionary, then iterate through
+        the list of relevant methods to find one that's applicable, apply it
+        to get additional todo_list items, and yield
+              [the additional items] + [verify_g] + todo_list
+        so that the planner can continue with it. [verify_g] verifies whether
+        the method actually achieved goal1.
+
+        If the planner can't find a plan that way, go on to the next method
+        in the list.
+        """
+        trace = self._trace
+        (state_var_name, arg, val) = goal1
+        if vars(state).get(state_var_name).get(arg) == val:
+            if trace is not None:
+                trace('goal_achieved', depth=depth, goal=goal1)
+            yield (state, todo_list, plan, None)
+            return
+        relevant = self.domain._unigoal_method_dict[state_var_name]
+        if trace is not None:
+            trace('refine', depth=depth, item=goal1, kind='unigoal', methods=relevant)
+        for method in relevant:
+            if trace is not None:
+                trace('method_try', depth=depth, item=goal1, kind='unigoal',
+                      method=method)
+            subgoals = method(state,arg,val)
+            # Can't just say "if subgoals:", because that's wrong if subgoals == []
+            if subgoals != False and subgoals != None:
+                if trace is not None:
+                    trace('method_applicable', depth=depth, item=goal1, kind='unigoal',
+                          method=method, todo_list=subgoals)
+                if self.verify_goals:
+                    verification = [('_verify_g', method.__name__, \
+                                     state_var_name, arg, val, depth)]
+                else:
+                    verification = []
+                todo_list = subgoals + verification + todo_list
+                yield (state, todo_list, plan, method.__name__)
+            else:
+                if trace is not None:
+                    trace('method_fail', depth=depth, item=goal1, kind='unigoal',
+                          method=method)
+
+    def _refine_multigoal_and_continue(self, state, goal1, todo_list, plan, depth):
+        """
+        If goal1 is a multigoal, then iterate through the list of multigoal
+        methods to find one that's applicable, apply it to get additional
+        todo_list items, and yield
+              [the additional items] + [verify_mg] + todo_list
+        so that the planner can continue with it. [verify_mg] verifies
+        whether the method actually achieved goal1.
+
+        If the planner can't find a plan that way, go on to the next method
+        in the list.
+        """
+        trace = self._trace
+        relevant = self.domain._multigoal_method_list
+        if trace is not None:
+            trace('refine', depth=depth, item=goal1, kind='multigoal', methods=relevant)
+        for method in relevant:
+            if trace is not None:
+                trace('method_try', depth=depth, item=goal1, kind='multigoal',
+                      method=method)
+            subgoals = method(state,goal1)
+            # Can't just say "if subgoals:", because that's wrong if subgoals == []
+            if subgoals != False and subgoals != None:
+                if trace is not None:
+                    trace('method_applicable', depth=depth, item=goal1,
+                          kind='multigoal', method=method, todo_list=subgoals)
+                if self.verify_goals:
+                    verification = [('_verify_mg', method.__name__, goal1, depth)]
+                else:
+                    verification = []
+                todo_list = subgoals + verification + todo_list
+                yield (state, todo_list, plan, method.__name__)
+            else:
+                if trace is not None:
+                    trace('method_fail', depth=depth, item=goal1, kind='multigoal',
+                          method=method)
+
+    def deorder_plan(self, state, plan):
+        """
+        Return a PartialOrderPlan that tells which actions in 'plan' must
+        stay in order, and which ones could be done in a different order or
+        at the same time. To find out, deorder_plan simulates 'plan' from
+        'state' using self.domain's action definitions, and records which
+        state variables each action reads and writes.
+        """
+        return PartialOrderPlan(plan, _plan_dependencies(self.domain, state, plan)[0])
+
+    ############################################################
+    # Actors
+
+    def run_lazy_lookahead(self, state, todo_list, max_tries=10, token=None,
+                           repair=True, checkpoint=None, checkpoint_interval=0,
+                           observations=None, time_limit=None, plan_time_limit=None,
+                           fallback=None):
+        """
+        An adaptation of the run_lazy_lookahead algorithm from Ghallab et al.
+        (2016), Automated Planning and Acting. It works roughly like this:
+            loop:
+                plan = find_plan(state, todo_list)
+                if plan = [] then return state    // the new current state
+                for each action in plan:
+                    try to execute the corresponding command
+                    if the command fails, or its effects differ from the
+                    action's, then check whether the rest of the plan still
+                    works; if not, repair the plan or continue the outer loop
+        Arguments:
+          - 'state' is a state;
+          - 'todo_list' is a list of tasks, goals, and multigoals;
+          - max_tries is a bound on how many times to execute the outer loop;
+          - 'token' (optional) is a CancellationToken. run_lazy_lookahead
+            checks it between commands and passes it to find_plan, and raises
+            PlanningCancelled if it has been cancelled.
+          - repair tells what to do when the rest of the plan doesn't work.
+            If it is False, run_lazy_lookahead calls find_plan on the whole
+            todo_list again. If it is True (the default), run_lazy_lookahead
+            first tries to repair the plan: see _repair_plan below.
+          - checkpoint (optional) is the name of a file in which to save the
+            progress of the mission (see "Checkpoints" below), and
+            checkpoint_interval is the least number of seconds between saves.
+          - observations (optional) is a source of changes to the state that
+            come from outside the commands, e.g., from sensors. See
+            "Observations" below.
+          - time_limit (optional) is the number of seconds the whole mission
+            may take, plan_time_limit (optional) is the number of seconds
+            each call to find_plan may take, and fallback (optional) is a
+            todo_list to use when find_plan runs out of time. See "Time
+            limits" below.
+
+        To check whether the rest of the plan still works, run_lazy_lookahead
+        simulates it using the action definitions, and checks that the goals
+        it was supposed to achieve still get achieved (see
+        _rest_of_plan_works). It does this when a command's effects differ
+        from its action's effects, or when an observation changes something
+        that the rest of the plan depends on (see "Observations" below). If
+        the rest of the plan still works, it keeps going with the same plan.
+        The Planner counts how often this happens in self.replans_avoided,
+        and how often commands' effects differ from their actions' effects
+        in self.surprises. If a command fails, the state hasn't changed, so
+        the action model would say the failed action still works; thus
+        run_lazy_lookahead repairs the plan or calls find_plan, rather than
+        retrying the command.
+
+        Checkpoints: if 'checkpoint' is given, then before each call to
+        find_plan and each command, run_lazy_lookahead saves the current
+        state, the todo_list, the number of tries used so far, and the plan
+        and its position in it into that file (unless it has already saved
+        them less than checkpoint_interval seconds ago). The file is
+        replaced atomically, so it's never left half-written. If the process
+        dies, resume_lazy_lookahead(checkpoint) continues the mission where
+        it left off; the command that was running when the checkpoint was
+        saved will be executed again. When the mission is over (whether or
+        not it succeeded), run_lazy_lookahead deletes the file. The file is
+        written with pickle, and resuming from it unpickles it, which can
+        run arbitrary code; so keep it where only trusted users can write.
+
+        Observations: each observation is a triple (state_var_name, arg,
+        value), meaning that state_var_name[arg] is now 'value', or a pair
+        (state_var_name, value) for a state variable that isn't a
+        dictionary. 'observations' may be a queue.Queue or asyncio.Queue of
+        observations, or an iterator that returns None when there aren't any
+        new observations yet. Before each command and each call to find_plan,
+        run_lazy_lookahead takes all the observations that are available and
+        makes the changes in its current state (which is a copy of the
+        'state' argument). Most observations don't matter to the rest of the
+        plan, so it only checks whether the rest of the plan still works
+        (and if not, repairs it or calls find_plan, as after a surprise) if
+        an observation changes a state variable that the rest of the plan
+        reads or a goal that it's supposed to achieve. The Planner counts
+        the observations in self.observations, and the ones that needed a
+        check in self.relevant_observations.
+
+        Time limits: if time_limit is given, run_lazy_lookahead stops
+        (between commands) and returns the current state when the mission
+        has taken that long. Each call to find_plan is limited to
+        plan_time_limit seconds or the time that's left, whichever is less.
+        If a call runs out of time, then run_lazy_lookahead calls find_plan
+        on the fallback todo_list (e.g., tasks that put the system into a
+        safe state) with whatever time is left, and executes the plan it
+        gets. If there's no fallback todo_list or no plan for it, it
+        executes the longest partial plan that find_plan had gotten to (see
+        PlanningTimeout). Either way, when that plan ends it calls find_plan
+        on todo_list again. If there's neither kind of plan, it gives up.
+        For each planning round (a call to find_plan, including the ones
+        that were done in the background by run_concurrent_lookahead, or an
+        attempt to repair a plan), the Planner appends (tries, kind,
+        seconds) to self.planning_rounds, where kind is 'find_plan', 'hot
+        swap', 'fallback', 'partial plan', 'timeout', or 'repair'.
+
+        The Planner's counters (self.surprises, self.replans_avoided,
+        self.repairs, self.hot_swaps, self.observations,
+        self.relevant_observations, and self.planning_rounds) describe the
+        latest acting run: run_lazy_lookahead and its relatives reset them
+        when they start. They're updated under a lock, so other threads can
+        read them during the run. If several threads act with one Planner
+        at the same time, though, the counters mix their runs, so give each
+        thread its own Planner.
+
+        Note: whenever run_lazy_lookahead encounters an action for which
+        there is no corresponding command definition, it uses the action
+        definition instead.
+        """
+        return self._run_lookahead(state, todo_list, max_tries, token, repair, False,
+                    checkpoint=checkpoint, checkpoint_interval=checkpoint_interval,
+                    observations=observations, time_limit=time_limit,
+                    plan_time_limit=plan_time_limit, fallback=fallback)
+
+    def run_concurrent_lookahead(self, state, todo_list, max_tries=10, token=None,
+                                 repair=True, checkpoint=None, checkpoint_interval=0,
+                                 observations=None, time_limit=None,
+                                 plan_time_limit=None, fallback=None):
+        """
+        A version of run_lazy_lookahead that plans and acts at the same time,
+        along the lines of the Run-Concurrent-Lookahead algorithm in Ghallab
+        et al. (2016). It's meant for domains where commands take a long time
+        (e.g., because they wait for I/O), so that the planning can overlap
+        with them. The arguments are the same as for run_lazy_lookahead.
+
+        While the commands in the current plan are executing, a background
+        thread calls find_plan (with verbose=0) from the state that the plan
+        is predicted to end in, according to the action definitions. If the
+        commands have their predicted effects, then when the plan ends, the
+        next plan is swapped in without waiting for find_plan, or with less
+        waiting. If a command's effects differ from the predicted ones, the
+        background planning is cancelled and started again from the new
+        prediction, and likewise after an observation. self.hot_swaps counts
+        the plans that came from the background thread.
+        """
+        return self._run_lookahead(state, todo_list, max_tries, token, repair, True,
+                    checkpoint=checkpoint, checkpoint_interval=checkpoint_interval,
+                    observations=observations, time_limit=time_limit,
+                    plan_time_limit=plan_time_limit, fallback=fallback)
+
+    def resume_lazy_lookahead(self, checkpoint, max_tries=None, token=None,
+                              repair=True, checkpoint_interval=0, observations=None,
+                              time_limit=None, plan_time_limit=None, fallback=None):
+        """
+        Continue the mission whose progress run_lazy_lookahead or
+        run_concurrent_lookahead saved in the file 'checkpoint', and keep
+        saving checkpoints to that file. max_tries (optional) is a new bound
+        on the total number of tries, including the ones made before the
+        checkpoint; the other arguments are the same as for
+        run_lazy_lookahead. Return the final state. time_limit, if it's
+        given, starts when resume_lazy_lookahead is called.
+
+        Since the checkpoint doesn't include the plan's DecompositionTree,
+        the first time the rest of the plan doesn't work, a resumed mission
+        calls find_plan rather than repairing the plan.
+
+        Warning: checkpoints are stored with pickle, and reading one can run
+        arbitrary code. Only resume from checkpoint files you trust.
+        """
+        data = _read_checkpoint(checkpoint)
+        if data['domain'] != self.domain.__name__:
+            raise Exception(f"{checkpoint} is a checkpoint for domain " +
+                            f"{data['domain']}, not {self.domain.__name__}")
+        if max_tries is None:
+            max_tries = data['max_tries']
+        return self._run_lookahead(data['state'], data['todo_list'], max_tries, token,
+                    repair, data['concurrent'], checkpoint=checkpoint,
+                    checkpoint_interval=checkpoint_interval, observations=observations,
+                    time_limit=time_limit, plan_time_limit=plan_time_limit,
+                    fallback=fallback,
+                    resume=(data['tries'], data['plan'], data['position'],
+                            data.get('goals', data['todo_list'])))
+
+    def _run_lookahead(self, state, todo_list, max_tries, token, repair, concurrently,
+                       **options):
+        """
+        The acting loop for run_lazy_lookahead, run_concurrent_lookahead, and
+        resume_lazy_lookahead. concurrently is True for
+        run_concurrent_lookahead. The options are the keyword arguments of
+        _act.
+        """
+        if concurrently:
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=1,
+                                           thread_name_prefix='gtpyhop-lookahead')
+            try:
+                return self._act(state, todo_list, max_tries, token, repair, executor,
+                                 **options)
+            finally:
+                executor.shutdown(wait=False)
+        return self._act(state, todo_list, max_tries, token, repair, None, **options)
+
+    def _act(self, state, todo_list, max_tries, token, repair, executor,
+             checkpoint=None, checkpoint_interval=0, observations=None,
+             time_limit=None, plan_time_limit=None, fallback=None, resume=None):
+        """
+        Do the work of _run_lookahead. executor is None for run_lazy_lookahead,
+        or a ThreadPoolExecutor in which run_concurrent_lookahead can plan
+        ahead. resume (optional) is (tries, plan, position, goals) from a
+        checkpoint.
+        The other arguments are the same as for run_lazy_lookahead.
+        """
+        self._reset_counters()
+        verbose = self.verbose
+        (prefix, name) = ('RCL', 'run_concurrent_lookahead') if executor \
+                         else ('RLL', 'run_lazy_lookahead')
+
+        if verbose >= 1:
+            print(f"{prefix}> {name}, verbose = {verbose}, max_tries = {max_tries}")
+            print(f"{prefix}> initial state: {state.__name__}")
+            print(f'{prefix}> To do:', todo_list)
+
+        # The time (according to time.monotonic) at which the mission must end
+        end = None if time_limit is None else time.monotonic() + time_limit
+        timed = time_limit is not None or plan_time_limit is not None
+        plan = None
+        tree = None
+        # The goals that the rest of the plan must achieve: todo_list, or
+        # nothing if the plan is a fallback plan or a partial plan.
+        goals = todo_list
+        # The number of calls to find_plan for todo_list, which can be
+        # fewer than the number of tries, since a try can continue a plan
+        calls = 0
+        first_try = 1
+        if resume is not None:
+            (tries_used, plan, first, goals) = resume
+            first_try = tries_used if plan is not None else tries_used + 1
+            if verbose >= 1:
+                print(f'{prefix}> Resuming after {tries_used} tries.')
+        # For run_concurrent_lookahead: (predicted state, future, token) for
+        # the find_plan call that is running in the background, or None
+        lookahead = None
+        last_save = None
+        if observations is not None:
+            observations = _observation_source(observations)
+            state = state.copy()
+        # For observations: see _plan_reads. It's computed when it's needed.
+        last_reads = None
+        out_of_time = False
+        try:
+            for tries in range(first_try,max_tries+1):
+                if end is not None and time.monotonic() >= end:
+                    out_of_time = True
+                    break
+                if plan is None:
+                    if observations is not None:
+                        self._observe(observations, state, prefix)
+                    if checkpoint:
+                        last_save = self._save_checkpoint(checkpoint, last_save,
+                            checkpoint_interval, state, todo_list, tries-1,
+                            max_tries, None, 0, goals, executor)
+                    started = time.perf_counter()
+                    try:
+                        calls += 1
+                        if lookahead and _same_state_vars(lookahead[0], state):
+                            if verbose >= 1:
+                                print(f"{prefix}> {_ordinal(calls)} call to find_plan",
+                                      "was done while acting:\n")
+                            result = _wait_for(lookahead[1], token)
+                            self._count('hot_swaps')
+                            kind = 'hot swap'
+                        else:
+                            if lookahead:
+                                lookahead[2].cancel()
+                            if verbose >= 1:
+                                print(f"{prefix}> {_ordinal(calls)} call to find_plan:\n")
+                            result = self.find_plan(state, todo_list, token, repair,
+                                                    _time_left(plan_time_limit, end))
+                            kind = 'find_plan'
+                        (plan, tree) = result if repair else (result, None)
+                        goals = todo_list
+                    except PlanningTimeout as e:
+                        if verbose >= 1:
+                            print(f'{prefix}> find_plan ran out of time.')
+                        (plan, kind) = self._stopgap_plan(state, fallback, e.partial_plan,
+                                                          token, end, prefix)
+                        (tree, goals) = (None, [])
+                    lookahead = None
+                    last_reads = None
+                    self._record_round(tries, kind, started, timed, prefix)
+                    if kind == 'timeout':
+                        if verbose >= 1:
+                            print(f'{prefix}> No fallback plan, giving up.')
+                        _remove_checkpoint(checkpoint)
+                        return state
+                    if plan == False or plan == None:
+                        if verbose >= 1:
+                            raise Exception(
+                                    f"{name}: find_plan has failed")
+                        _remove_checkpoint(checkpoint)
+                        return state
+                    if plan == []:
+                        if verbose >= 1:
+                            print(f'{prefix}> Empty plan => success',
+                                  f'after {calls} calls to find_plan.')
+                        if verbose >= 2: state.display(heading='> final state')
+                        _remove_checkpoint(checkpoint)
+                        return state
+                    first = 0
+                elif verbose >= 1:
+                    print(f"{prefix}> {_ordinal(tries)} try: continuing with the plan:\n")
+                if executor and not lookahead:
+                    lookahead = self._plan_ahead(executor, state, plan, first,
+                                                 todo_list, repair,
+                                                 _time_left(plan_time_limit, end))
+                # Execute plan[first:]. If something goes wrong, failed is the
+                # index of the first action that still needs to be done.
+                failed = None
+                for i in range(first, len(plan)):
+                    if token is not None: token.check()
+                    if end is not None and time.monotonic() >= end:
+                        out_of_time = True
+                        break
+                    observed = observations is not None and \
+                               self._observe(observations, state, prefix)
+                    if observed:
+                        if last_reads is None:
+                            last_reads = self._plan_reads(state, plan, i, tree, goals)
+                        if self._observation_matters(last_reads, observed, i):
+                            self._count('relevant_observations')
+                            if not self._rest_of_plan_works(state, plan, i, tree, goals):
+                                if verbose >= 1:
+                                    print(f'{prefix}> An observation affects the rest of the plan.')
+                                failed = i
+                                break
+                            self._count('replans_avoided')
+                            last_reads = None
+                            if verbose >= 1:
+                                print(f'{prefix}> The rest of the plan still works.')
+                        if lookahead:
+                            lookahead[2].cancel()
+                            lookahead = self._plan_ahead(executor, state, plan, i,
+                                           todo_list, repair,
+                                           _time_left(plan_time_limit, end))
+                    if checkpoint:
+                        last_save = self._save_checkpoint(checkpoint, last_save,
+                            checkpoint_interval, state, todo_list, tries,
+                            max_tries, plan, i, goals, executor)
+                    (new_state, outcome) = self._do_command(state, plan[i], prefix)
+                    if outcome == 'failed':
+                        failed = i
+                        break
+                    state = new_state
+                    if outcome == 'surprise':
+                        last_reads = None
+                        if self._rest_of_plan_works(state, plan, i+1, tree, goals):
+                            self._count('replans_avoided')
+                            if verbose >= 1:
+                                print(f'{prefix}> The rest of the plan still works.')
+                            if lookahead:
+                                lookahead[2].cancel()
+                                lookahead = self._plan_ahead(executor, state, plan,
+                                               i+1, todo_list, repair,
+                                               _time_left(plan_time_limit, end))
+                        else:
+                            failed = i+1
+                            break
+                if out_of_time:
+                    break
+                if failed is None:
+                    if verbose >= 1:
+                        print(f'{prefix}> Plan ended; will call find_plan again.')
+                    plan = None
+                # A command failed, or its effects or an observation broke the
+                # rest of the plan. A failed command leaves the state as it
+                # was, so simulating the rest of the plan (which starts with
+                # the failed action) would always succeed; thus the plan has
+                # to be repaired or replaced either way.
+                elif tree is None or failed == len(plan):
+                    if verbose >= 1:
+                        print(f'{prefix}> The plan doesn\'t work; will call find_plan.')
+                    plan = None
+                else:
+                    if verbose >= 1:
+                        print(f'{prefix}> The plan doesn\'t work; will try to repair it.')
+                    started = time.perf_counter()
+                    (plan, tree) = self._repair_plan(state, tree, failed, token, prefix,
+                                                     _time_left(plan_time_limit, end))
+                    self._record_round(tries, 'repair', started, timed, prefix)
+                    last_reads = None
+                    if plan is None:
+                        if verbose >= 1:
+                            print(f'{prefix}> Could not repair the plan; will call find_plan.')
+                    else:
+                        self._count('repairs')
+                        first = 0
+                        if lookahead:
+                            lookahead[2].cancel()
+                            lookahead = None
+        finally:
+            if lookahead:
+                lookahead[2].cancel()
+
+        if verbose >= 1:
+            if out_of_time:
+                print(f'{prefix}> Out of time, giving up.')
+            else:
+                print(f'{prefix}> Too many tries, giving up.')
+        if verbose >= 2: state.display(heading=f'{prefix}> final state')
+        _remove_checkpoint(checkpoint)
+        return state
+
+    def _stopgap_plan(self, state, fallback, partial_plan, token, end, prefix):
+        """
+        Return (plan, kind) for run_lazy_lookahead to use when find_plan has
+        run out of time: a plan for the 'fallback' todo_list if there is one
+        and find_plan can find it in the time that's left, otherwise
+        partial_plan if it isn't empty. kind is 'fallback', 'partial plan',
+        or 'timeout' (in which case plan is None) to tell which.
+        """
+        if fallback is not None:
+            if self.verbose >= 1:
+                print(f'{prefix}> Planning for the fallback todo_list:\n')
+            try:
+                plan = self.find_plan(state, fallback, token,
+                                      time_limit=_time_left(None, end))
+                if plan:
+                    return (plan, 'fallback')
+            except PlanningTimeout:
+                pass
+        if partial_plan:
+            if self.verbose >= 1:
+                print(f'{prefix}> Using a partial plan:', partial_plan)
+            return (partial_plan, 'partial plan')
+        return (None, 'timeout')
+
+    def _record_round(self, tries, kind, started, timed, prefix):
+        """
+        Add (tries, kind, seconds) to self.planning_rounds, where seconds is
+        the time since 'started' (according to time.perf_counter), and print
+        it if 'timed' is True and verbose >= 1.
+        """
+        seconds = time.perf_counter() - started
+        with self._counter_lock:
+            self.planning_rounds.append((tries, kind, seconds))
+        if timed and self.verbose >= 1:
+            print(f'{prefix}> Planning ({kind}) took {seconds:.3f} seconds.')
+
+    def _observe(self, observations, state, prefix):
+        """
+        Make the changes in 'state' that are described by all of the
+        observations that are available now. Return the set of
+        (state_var_name, arg) pairs that they changed, using ... as arg for
+        state variables that aren't dictionaries.
+        """
+        observed = set()
+        for observation in _available_observations(observations):
+            self._count('observations')
+            if self.verbose >= 2:
+                print(f'{prefix}> Observed', observation)
+            observed.add(_apply_observation(state, observation))
+        return observed
+
+    def _plan_reads(self, state, plan, first, tree, todo_list):
+        """
+        Simulate plan[first:] in 'state', and return a dictionary that maps
+        each (state_var_name, arg) pair that the simulation reads to the
+        index of the last action in 'plan' that reads it. The goals that
+        _rest_of_plan_works would check count as being read at index
+        len(plan). Return None if the plan doesn't work in 'state'.
+
+        If an observation changes something that isn't in the dictionary,
+        then the simulation would go exactly the same way after the change,
+        so there's no need to check the rest of the plan again.
+        """
+        last_reads = {}
+        for i in range(first, len(plan)):
+            action = plan[i]
+            (state, reads, _) = _apply_traced(self.domain._action_dict[action[0]],
+                                              state, action[1:])
+            if not state:
+                return None
+            for x in reads:
+                last_reads[x] = i
+        goals = todo_list if tree is None else \
+                [tree.items[k] for k in range(len(tree))
+                 if tree.end[k] >= first or tree.parent[k] == -1]
+        for x in self._goal_state_vars(goals):
+            last_reads[x] = len(plan)
+        return last_reads
+
+    def _goal_state_vars(self, items):
+        """
+        Return the set of (state_var_name, arg) pairs that the unigoals and
+        multigoals in 'items' are about.
+        """
+        result = set()
+        for item in items:
+            kind = self._item_kind(item)
+            if kind == 'unigoal':
+                result.add((item[0], item[1]))
+            elif kind == 'multigoal':
+                for (name, values) in vars(item).items():
+                    if name != '__name__':
+                        result.update((name, arg) for arg in values)
+        return result
+
+    def _observation_matters(self, last_reads, observed, first):
+        """
+        Return True if something in 'observed' (a set of (state_var_name,
+        arg) pairs) is read by plan[first:] or its goals, according to the
+        dictionary last_reads returned by _plan_reads.
+        """
+        if last_reads is None:
+            return True
+        for (name, arg) in observed:
+            if arg is ...:
+                if any(i >= first for ((n, _), i) in last_reads.items() if n == name):
+                    return True
+            elif last_reads.get((name, arg), -1) >= first or \
+                    last_reads.get((name, ...), -1) >= first:
+                return True
+        return False
+
+    def _save_checkpoint(self, path, last_save, interval, state, todo_list, tries,
+                         max_tries, plan, position, goals, executor):
+        """
+        Save a checkpoint in 'path', unless the last one (saved at time
+        last_save) was less than 'interval' seconds ago. Return the time of
+        the last save. 'goals' are the goals that the rest of the plan must
+        achieve (see _act).
+        """
+        now = time.monotonic()
+        if last_save is not None and now - last_save < interval:
+            return last_save
+        _write_checkpoint(path, {'domain': self.domain.__name__, 'state': state,
+            'todo_list': todo_list, 'tries': tries, 'max_tries': max_tries,
+            'plan': plan, 'position': position, 'goals': goals,
+            'concurrent': executor is not None})
+        return now
+
+    def _do_command(self, state, action, prefix):
+        """
+        Execute the command for 'action' in 'state' (or, if there's no such
+        command, use the action definition instead). Return a pair
+        (new_state, outcome), where outcome is 'failed' if the command failed
+        (in which case new_state is False), 'surprise' if new_state isn't
+        what the action definition predicts, and 'ok' otherwise.
+        """
+        verbose = self.verbose
+        domain = self.domain
+        command_name = 'c_' + action[0]
+        action_func = domain._action_dict.get(action[0])
+        command_func = domain._command_dict.get(command_name)
+        if command_func == None:
+            if verbose >= 1:
+                print(f'{prefix}> {command_name} not defined, using {action[0]} instead\n')
+            command_func = action_func
+
+        if verbose >= 1:
+            print(f'{prefix}> Command:', [command_name] + list(action[1:]))
+        if self._trace is not None:
+            self._trace('command_try', action=action, command=command_func)
+        new_state = self._apply_command_and_continue(state, command_func, action[1:])
+        outcome = self._check_command(state, action, command_func, new_state, prefix)
+        if self._trace is not None:
+            self._trace('command_executed', action=action, command=command_func,
+                        state=new_state, outcome=outcome)
+        return (new_state, outcome)
+
+    def _check_command(self, state, action, command_func, new_state, prefix):
+        """
+        Return 'failed' if new_state (the result of calling command_func
+        for 'action' in 'state') is False, 'surprise' if it isn't what the
+        action definition predicts, and 'ok' otherwise.
+        """
+        verbose = self.verbose
+        command_name = 'c_' + action[0]
+        action_func = self.domain._action_dict.get(action[0])
+        if not new_state:
+            if verbose >= 1:
+                print(f'{prefix}> WARNING: command {command_name} failed.')
+            return 'failed'
+        if verbose >= 2:
+            new_state.display()
+        if command_func is not action_func:
+            predicted = action_func(state.copy(), *action[1:])
+            if not predicted or not _same_state_vars(predicted, new_state):
+                self._count('surprises')
+                if verbose >= 1:
+                    print(f'{prefix}> WARNING: the effects of {command_name}',
+                          f'differ from those of {action[0]}.')
+                return 'surprise'
+        return 'ok'
+
+    def _plan_ahead(self, executor, state, plan, first, todo_list, repair,
+                    time_limit=None):
+        """
+        Start a find_plan call in 'executor', from the state that plan[first:]
+        is predicted to produce in 'state', with the given time_limit. Return
+        (predicted state, future, CancellationToken), or None if the action
+        definitions say that plan[first:] won't work.
+        """
+        predicted = state.copy()
+        for action in plan[first:]:
+            predicted = self.domain._action_dict[action[0]](predicted, *action[1:])
+            if not predicted:
+                return None
+        background = Planner(self.domain, verbose=0, verify_goals=self.verify_goals,
+                             cache=self.cache)
+        job_token = CancellationToken()
+        future = executor.submit(background.find_plan, predicted.copy(), todo_list,
+                                 job_token, repair, time_limit)
+        return (predicted, future, job_token)
+
+    def _repair_plan(self, state, tree, failed, token=None, prefix='RLL',
+                     time_limit=None):
+        """
+        Try to repair tree.plan after the command for tree.plan[failed] has
+        failed, leaving the world in 'state'. Rather than replanning for the
+        whole todo_list, look for the lowest task or goal in the
+        DecompositionTree 'tree' whose part of the plan includes the failed
+        action, and call find_plan on just that item. If that succeeds, then
+        the new plan is the new subplan followed by the part of the old plan
+        that came after the item's part. That plan is only accepted if its
+        actions are applicable and every goal whose part of the plan ends
+        after the subplan is still achieved where its part ends; otherwise
+        try again with the next higher task or goal.
+
+        Return (new_plan, new_tree), where new_plan is the rest of the plan
+        to execute, starting from 'state', and new_tree is its decomposition;
+        or (None, None) if none of the replanning attempts worked, or if
+        they took more than time_limit seconds altogether.
+        """
+        verbose = self.verbose
+        plan = tree.plan
+        # The tasks and goals whose parts of the plan include the failed
+        # action, from the top of the tree down
+        chain = []
+        nodes = tree.roots()
+        while nodes:
+            k = next(k for k in nodes if tree.start[k] <= failed < tree.end[k])
+            if self._item_kind(tree.items[k]) != 'action':
+                chain.append(k)
+            nodes = tree.children(k)
+        end = None if time_limit is None else time.monotonic() + time_limit
+        for n in reversed(range(len(chain))):
+            k = chain[n]
+            item = tree.items[k]
+            if verbose >= 1:
+                print(f'{prefix}> Replanning for {_item_to_string(item)}:\n')
+            try:
+                (subplan, subtree) = self.find_plan(state, [item], token, True,
+                                                    _time_left(None, end))
+            except PlanningTimeout:
+                if verbose >= 1:
+                    print(f'{prefix}> Ran out of time for repairing the plan.')
+                return (None, None)
+            if subplan == False or subplan == None:
+                continue
+            suffix_states = self._simulate(subtree.states[-1], plan[tree.end[k]:])
+            if suffix_states:
+                new_tree = tree._replace(chain[:n], k, subtree, suffix_states)
+                if self._goals_still_achieved(new_tree, len(subplan)):
+                    if verbose >= 1:
+                        print(f'{prefix}> Repaired the plan by replanning for {_item_to_string(item)}.')
+                    return (new_tree.plan, new_tree)
+            if verbose >= 1:
+                print(f'{prefix}> The rest of the old plan no longer works.')
+        return (None, None)
+
+    def _simulate(self, state, plan):
+        """
+        Apply the actions in 'plan' to 'state' using the domain's action
+        models. Return the list of states it goes through (starting with
+        'state'), or None if one of the actions isn't applicable.
+        """
+        states = [state]
+        for action in plan:
+            state = self.domain._action_dict[action[0]](state.copy(), *action[1:])
+            if not state:
+                return None
+            states.append(state)
+        return states
+
+    def _goals_still_achieved(self, tree, first):
+        """
+        Return True if each goal in 'tree' whose part of the plan ends at or
+        after tree.plan[first] is achieved in the state where its part ends.
+        """
+        for k in range(len(tree)):
+            if tree.end[k] >= first and \
+                    not self._goal_holds(tree.states[tree.end[k]], tree.items[k]):
+                return False
+        return True
+
+    def _rest_of_plan_works(self, state, plan, first, tree, todo_list):
+        """
+        Return True if plan[first:] is still a good plan to execute in
+        'state'. To find out, simulate it using the domain's actions, and
+        check the goals it is supposed to achieve:
+          - if 'tree' is plan's DecompositionTree, then each goal in the tree
+            whose part of the plan ends at or after plan[first] must be true
+            where its part ends, and each goal in the original todo_list
+            must be true there or (if its part has already been done) now;
+          - otherwise, each goal in todo_list must be true at the end.
+        Tasks can't be checked this way, so they're assumed to be OK if the
+        actions are applicable.
+
+        The simulation makes one copy of 'state' at the start, and lets the
+        actions modify it in place, rather than copying it for every action.
+        """
+        checks = {}     # checks[i] = goals to check before plan[i]
+        if tree is not None:
+            for k in range(len(tree)):
+                if tree.end[k] >= first:
+                    checks.setdefault(tree.end[k], []).append(tree.items[k])
+                elif tree.parent[k] == -1:
+                    checks.setdefault(first, []).append(tree.items[k])
+        else:
+            checks[len(plan)] = todo_list
+        state = state.copy()
+        for i in range(first, len(plan)+1):
+            for goal in checks.get(i, []):
+                if not self._goal_holds(state, goal):
+                    return False
+            if i < len(plan):
+                state = self.domain._action_dict[plan[i][0]](state, *plan[i][1:])
+                if not state:
+                    return False
+        return True
+
+    def _goal_holds(self, state, item):
+        """
+        Return False if 'item' is a unigoal or multigoal that isn't true in
+        'state', otherwise True.
+        """
+        kind = self._item_kind(item)
+        if kind == 'multigoal':
+            return not _goals_not_achieved(state, item)
+        if kind == 'unigoal':
+            return vars(state).get(item[0], {}).get(item[1]) == item[2]
+        return True
+
+    def _item_kind(self, item):
+        """
+        Return 'action', 'task', 'unigoal', or 'multigoal' to tell how the
+        planner treats 'item'.
+        """
+        if get_type(item) == 'Multigoal':
+            return 'multigoal'
+        if item[0] in self.domain._action_dict:
+            return 'action'
+        if item[0] in self.domain._task_method_dict:
+            return 'task'
+        return 'unigoal'
+
+    async def run_lazy_lookahead_async(self, state, todo_list, max_tries=10,
+                                       token=None, max_concurrent=None,
+                                       observations=None):
+        """
+        A coroutine version of run_lazy_lookahead, for use with asyncio, that
+        can execute several commands at the same time. Commands may be
+        ordinary functions or coroutine functions (async def c_foo(state,
+        ...)); only the latter can actually run at the same time as other
+        commands. Arguments:
+          - 'state', 'todo_list', max_tries, and 'token' are the same as for
+            run_lazy_lookahead;
+          - max_concurrent (optional) is the largest number of commands to
+            run at once;
+          - observations (optional) is the same as for run_lazy_lookahead,
+            or an async iterator of observations.
+
+        It uses find_plan_async to get each plan, so other coroutines can run
+        while it plans. Then, rather than executing the plan's commands one
+        after another, it works out which of the plan's actions must stay in
+        order because one of them writes a state variable that the other one
+        reads or writes (see deorder_plan). It starts each command as
+        soon as the commands for the actions that it must come after have
+        finished. Thus, e.g., commands to drive two trucks in different
+        cities can run at the same time.
+
+        Each command is called on a copy of the current state. When it
+        finishes, the state variables that it changed are copied into the
+        current state. Since commands that run at the same time don't
+        write the same state variables (according to the action definitions),
+        the result is the same as if they had run one after another.
+
+        If a command fails, run_lazy_lookahead_async starts no more commands,
+        waits for the ones that are running, and calls find_plan again. If an
+        observation changes something that a command that hasn't started yet
+        reads (according to its action definition), or a goal in todo_list,
+        it does the same, except that if the commands that haven't started
+        yet still work in the new state, it keeps going with them rather
+        than calling find_plan.
+        """
+        self._reset_counters()
+        verbose = self.verbose
+        domain = self.domain
+
+        if verbose >= 1:
+            print(f"RLL> run_lazy_lookahead_async, verbose = {verbose}, max_tries = {max_tries}")
+            print(f"RLL> initial state: {state.__name__}")
+            print('RLL> To do:', todo_list)
+
+        # If observations come from an asyncio.Queue or an async iterator, a
+        # separate task moves them into 'inbox' as they arrive, and sets
+        # 'arrived' to wake up the loop below.
+        (pump, inbox, arrived) = (None, None, None)
+        if observations is not None:
+            if isinstance(observations, asyncio.Queue) or \
+                    hasattr(observations, '__anext__'):
+                (inbox, arrived) = (collections.deque(), asyncio.Event())
+                pump = asyncio.ensure_future(
+                           _pump_observations(observations, inbox, arrived))
+            else:
+                observations = _observation_source(observations)
+        state = state.copy()
+        plan = None
+        calls = 0
+        try:
+            for tries in range(1,max_tries+1):
+                if observations is not None:
+                    self._observe_async(observations, inbox, arrived, state)
+                if plan is None:
+                    calls += 1
+                    if verbose >= 1:
+                        print(f"RLL> {_ordinal(calls)} call to find_plan:\n")
+                    plan = await self.find_plan_async(state, todo_list, token=token)
+                    if plan == False or plan == None:
+                        if verbose >= 1:
+                            raise Exception(
+                                    f"run_lazy_lookahead_async: find_plan has failed")
+                        return state
+                    if plan == []:
+                        if verbose >= 1:
+                            print(f'RLL> Empty plan => success',
+                                  f'after {calls} calls to find_plan.')
+                        if verbose >= 2: state.display(heading='> final state')
+                        return state
+                elif verbose >= 1:
+                    print(f"RLL> {_ordinal(tries)} try: continuing with the plan:\n")
+                (preds, reads, _) = _plan_dependencies(domain, state, plan)
+                order = PartialOrderPlan(plan, preds)
+                # unfinished[i] = how many of plan[i]'s predecessors haven't finished
+                unfinished = [order.pred_offsets[i+1] - order.pred_offsets[i]
+                              for i in range(len(plan))]
+                ready = collections.deque(i for i in range(len(plan)) if not unfinished[i])
+                started = [False] * len(plan)
+                running = {}        # asyncio task -> (index in plan, state it started in)
+                failed = False
+                affected = False
+                try:
+                    while ready or running:
+                        while ready and not failed and not affected and \
+                                (max_concurrent is None or len(running) < max_concurrent):
+                            if token is not None: token.check()
+                            i = ready.popleft()
+                            started[i] = True
+                            snapshot = state.copy()
+                            task = asyncio.ensure_future(self._do_command_async(snapshot, plan[i]))
+                            running[task] = (i, snapshot)
+                        if not running:
+                            break
+                        waiting = set(running)
+                        if arrived is not None:
+                            wakeup = asyncio.ensure_future(arrived.wait())
+                            waiting.add(wakeup)
+                        (done, _) = await asyncio.wait(waiting,
+                                                       return_when=asyncio.FIRST_COMPLETED)
+                        if arrived is not None and wakeup not in done:
+                            wakeup.cancel()
+                        for (i, snapshot, task) in sorted((running[t][0], running[t][1], t)
+                                                          for t in done if t in running):
+                            del running[task]
+                            new_state = task.result()
+                            if new_state == False:
+                                failed = True
+                                continue
+                            _merge_changes(state, snapshot, new_state)
+                            for j in order.successors_of(i):
+                                unfinished[j] -= 1
+                                if unfinished[j] == 0:
+                                    ready.append(j)
+                        if observations is not None and not affected:
+                            observed = self._observe_async(observations, inbox,
+                                                           arrived, state)
+                            if observed and self._observation_affects(observed,
+                                    [reads[j] for j in range(len(plan)) if not started[j]],
+                                    todo_list):
+                                self._count('relevant_observations')
+                                affected = True
+                finally:
+                    for task in running:
+                        task.cancel()
+                rest = [plan[j] for j in range(len(plan)) if not started[j]]
+                if failed:
+                    if verbose >= 1:
+                        print(f'RLL> A command failed; will call find_plan.')
+                    plan = None
+                elif affected and rest and \
+                        self._rest_of_plan_works(state, rest, 0, None, todo_list):
+                    self._count('replans_avoided')
+                    if verbose >= 1:
+                        print(f'RLL> The rest of the plan still works.')
+                    plan = rest
+                elif affected:
+                    if verbose >= 1:
+                        print(f'RLL> An observation affects the rest of the plan; will call find_plan.')
+                    plan = None
+                else:
+                    if verbose >= 1:
+                        print(f'RLL> Plan ended; will call find_plan again.')
+                    plan = None
+        finally:
+            if pump is not None:
+                pump.cancel()
+
+        if verbose >= 1: print('RLL> Too many tries, giving up.')
+        if verbose >= 2: state.display(heading='RLL> final state')
+        return state
+
+    def _observe_async(self, observations, inbox, arrived, state):
+        """
+        Like _observe, for run_lazy_lookahead_async: if 'inbox' isn't None,
+        take the observations from it rather than from 'observations'.
+        """
+        if inbox is None:
+            return self._observe(observations, state, 'RLL')
+        arrived.clear()
+        observed = set()
+        while inbox:
+            observation = inbox.popleft()
+            self._count('observations')
+            if self.verbose >= 2:
+                print('RLL> Observed', observation)
+            observed.add(_apply_observation(state, observation))
+        return observed
+
+    def _observation_affects(self, observed, read_sets, todo_list):
+        """
+        Return True if something in 'observed' (a set of (state_var_name,
+        arg) pairs) is in one of the read sets in read_sets, or is a goal in
+        todo_list.
+        """
+        last_reads = dict.fromkeys(itertools.chain(*read_sets), 0)
+        last_reads.update(dict.fromkeys(self._goal_state_vars(todo_list), 0))
+        return self._observation_matters(last_reads, observed, 0)
+
+    async def _do_command_async(self, state, action):
+        """
+        Execute the command for 'action' in 'state', awaiting it if it's a
+        coroutine function, and return the new state or False.
+        """
+        verbose = self.verbose
+        domain = self.domain
+        command_name = 'c_' + action[0]
+        action_func = domain._action_dict.get(action[0])
+        command_func = domain._command_dict.get(command_name)
+        if command_func == None:
+            if verbose >= 1:
+                print(f'RLL> {command_name} not defined, using {action[0]} instead\n')
+            command_func = action_func
+        if verbose >= 1:
+            print('RLL> Command:', [command_name] + list(action[1:]))
+        if self._trace is not None:
+            self._trace('command_try', action=action, command=command_func)
+        new_state = command_func(state.copy(), *action[1:])
+        if inspect.isawaitable(new_state):
+            new_state = await new_state
+        if not new_state:
+            new_state = False
+        outcome = self._check_command(state, action, command_func, new_state, 'RLL')
+        if self._trace is not None:
+            self._trace('command_executed', action=action, command=command_func,
+                        state=new_state, outcome=outcome)
+        return new_state
+
+    def _apply_command_and_continue(self, state, command, args):
+        """
+        _apply_command_and_continue applies 'command' by retrieving its
+        function definition and calling it on the arguments. If 'command' is
+        a coroutine function, it runs the coroutine with asyncio.run (so it
+        can't be used from inside a running event loop; use
+        run_lazy_lookahead_async there instead).
+        """
+        verbose = self.verbose
+        if verbose >= 3:
+            print(f"_apply_command_and_continue {command.__name__}, args = {args}")
+        next_state = command(state.copy(),*args)
+        if inspect.iscoroutine(next_state):
+            next_state = asyncio.run(next_state)
+        if next_state:
             if verbose >= 3:
-                print(f'not applicable')        
-    if verbose >= 3:
-        print(f'depth {depth} could not achieve goal {goal1}')        
-    return False
-
-
-def _refine_multigoal_and_continue(state, goal1, todo_list, plan, depth):
-    """
-    If goal1 is a multigoal, then iterate through the list of multigoal
-    methods to find one that's applicable, apply it to get additional
-    todo_list items, and call seek_plan recursively on
-          [the additional items] + [verify_mg] + todo_list,
-
-    where [verify_mg] verifies whether the method actually achieved goal1.
-    If the call to seek_plan fails, go on to the next method in the list.
-    """
-    if verbose >= 3:
-        print(f'depth {depth} multigoal {goal1}: ', end='')
-    relevant = current_domain._multigoal_method_list
-    if verbose >= 3:
-        print(f'methods {[m.__name__ for m in relevant]}')
-    for method in relevant:
-        if verbose >= 3: 
-            print(f'depth {depth} trying method {method.__name__}: ', end='')
-        subgoals = method(state,goal1)
-        # Can't just say "if subgoals:", because that's wrong if subgoals == []
-        if subgoals != False and subgoals != None:
+                print('applied')
+                next_state.display()
+            return next_state
+        else:
             if verbose >= 3:
-                print('applicable')
-                print(f'depth {depth} subgoals: {subgoals}')
-            if verify_goals:
-                verification = [('_verify_mg', method.__name__, goal1, depth)]
+                print('not applicable')
+            return False
+
+
+class _Search():
+    """
+    The state of an ongoing search by Planner.seek_plan. GTPyhop's search is
+    a depth-first backtracking search, but instead of calling itself
+    recursively, seek_plan keeps an explicit stack that contains one
+    generator (see Planner._expand) for each node on the current path. Thus
+    the depth of the search isn't limited by Python's recursion limit, and
+    the search can be suspended after any number of node expansions and
+    resumed later (see find_plan_async).
+    """
+
+    def __init__(self, planner, state, todo_list, plan, depth):
+        self.planner = planner
+        self.stack = [iter([(state, todo_list, plan, None)])]
+        # self.nodes[i] is the node whose generator is self.stack[i+1]
+        self.nodes = []
+        self.depth = depth
+        self.result = None
+        self.final = None       # the node at which the search succeeded
+
+    def run(self, max_expansions=None):
+        """
+        Continue the search until it finishes or has expanded max_expansions
+        more nodes (no limit if max_expansions is None). Return True if the
+        search has finished, in which case self.result is the plan or False.
+        """
+        planner = self.planner
+        trace = planner._trace
+        expand = planner._expand
+        stack = self.stack
+        nodes = self.nodes
+        expansions = 0
+        context = _active_planner.set(planner)
+        sampled = _samplers > 0
+        if sampled:
+            _sampled_searches[id(self)] = self
+        try:
+            while stack:
+                node = next(stack[-1], None)
+                if node is None:
+                    if trace is not None and nodes:
+                        trace('backtrack', depth=self.depth + len(nodes) - 1,
+                              item=nodes[-1][1][0])
+                    stack.pop()
+                    if nodes: nodes.pop()
+                    continue
+                (state, todo_list, plan, _) = node
+                depth = self.depth + len(stack) - 1
+                if trace is not None:
+                    trace('node_enter', depth=depth, todo_list=todo_list, plan=plan,
+                          state=state)
+                if todo_list == []:
+                    if trace is not None:
+                        trace('solution', depth=depth, plan=plan)
+                    self.result = plan
+                    self.final = node
+                    return True
+                stack.append(expand(state, todo_list, plan, depth))
+                nodes.append(node)
+                expansions += 1
+                if expansions == max_expansions:
+                    return False
+            self.result = False
+            return True
+        finally:
+            _active_planner.reset(context)
+            if sampled:
+                _sampled_searches.pop(id(self), None)
+
+    def tree(self):
+        """
+        After a successful search, return a DecompositionTree that tells how
+        the search got its plan.
+        """
+        path = self.nodes + [self.final]
+        # Each node's method is recorded in the next node on the path
+        return _make_tree(self.result, [node[1][0] for node in self.nodes],
+                          [node[3] for node in path[1:]],
+                          [len(node[1]) for node in path],
+                          [len(node[2]) for node in path],
+                          [node[0] for node in path])
+
+
+def _make_tree(plan, items, methods, todo_lengths, plan_lengths, states):
+    """
+    Return the DecompositionTree for a successful search path. The path's
+    last node is the one with the empty todo_list; items[j] and methods[j]
+    are the first item of node j's todo_list and the method used for it,
+    and todo_lengths[j], plan_lengths[j], and states[j] are the length of
+    node j's todo_list, the length of its plan, and its state.
+    """
+    n = len(items)
+    parent = array.array('l', [-1]) * n
+    start = array.array('l', [0]) * n
+    end = array.array('l', [0]) * n
+    stop = array.array('l', [0]) * n
+    tree_states = []
+    unfinished = []
+    for j in range(n + 1):
+        if plan_lengths[j] == len(tree_states):
+            tree_states.append(states[j])
+        # A node's item is finished at the first later node whose
+        # todo_list is shorter than the node's todo_list.
+        while unfinished and todo_lengths[j] < todo_lengths[unfinished[-1]]:
+            k = unfinished.pop()
+            end[k] = plan_lengths[j]
+            stop[k] = j
+        if j < n:
+            parent[j] = unfinished[-1] if unfinished else -1
+            start[j] = plan_lengths[j]
+            unfinished.append(j)
+    return DecompositionTree(plan, items, methods, parent, start, end, stop,
+                             tree_states)
+
+
+# How many nodes find_plan_async expands between looks at the clock
+_CLOCK_CHECK_INTERVAL = 32
+
+# How many nodes seek_plan expands between checks of a CancellationToken
+_CANCEL_CHECK_INTERVAL = 64
+
+# The Planner whose search is running in the current thread or asyncio task,
+# for use by _m_verify_g and _m_verify_mg.
+_active_planner = contextvars.ContextVar('_active_planner', default=None)
+
+# The number of SamplingProfilers that are running, and the searches that
+# they sample (id(search) -> search)
+_samplers = 0
+_sampled_searches = {}
+_sampling_lock = threading.Lock()
+
+
+def _active_trace():
+    """
+    Return the _trace function of the Planner that is currently running, or
+    None if it doesn't have one.
+    """
+    planner = _active_planner.get()
+    return planner._trace if planner is not None else None
+
+
+# How often (in seconds) run_concurrent_lookahead checks its CancellationToken
+# while it waits for a plan from the background thread
+_TOKEN_POLL_INTERVAL = 0.05
+
+
+def _time_left(limit, end):
+    """
+    Return the smaller of 'limit' (a number of seconds, or None for no limit)
+    and the time until 'end' (a time.monotonic time, or None for no end).
+    """
+    if end is None:
+        return limit
+    left = max(0.0, end - time.monotonic())
+    return left if limit is None else min(limit, left)
+
+
+def _wait_for(future, token):
+    """
+    Return future.result(). If token isn't None, check it every so often
+    while waiting.
+    """
+    if token is None:
+        return future.result()
+    while True:
+        try:
+            return future.result(timeout=_TOKEN_POLL_INTERVAL)
+        except concurrent.futures.TimeoutError:
+            token.check()
+
+
+################################################################################
+# Decomposition trees
+
+
+class DecompositionTree():
+    """
+    A DecompositionTree tells how find_plan decomposed a todo_list into a
+    plan. To get one, call find_plan(state, todo_list, tree=True).
+
+    The tree has a node for each task, goal, and action that the planner
+    planned for, numbered 0, 1, 2, ... in the order in which the planner
+    expanded them (so each node comes before its descendants). Rather than
+    being a separate object, each node is an index into the following
+    parallel lists and arrays, which keeps the tree small even for plans
+    with tens of thousands of actions:
+      - items[k] is node k's task, goal, multigoal, or action;
+      - methods[k] is the name of the method used for items[k], or None if
+        items[k] is an action or a goal that was already achieved;
+      - parent[k] is the index of node k's parent, or -1 if items[k] was in
+        the todo_list that was given to find_plan;
+      - node k's descendants are nodes k+1 through stop[k]-1;
+      - plan[start[k]:end[k]] is the part of the plan that accomplishes
+        items[k];
+      - states[i] is the state after the first i actions of the plan, so
+        states[start[k]] is the state in which the planner began working on
+        items[k].
+    """
+
+    def __init__(self, plan, items, methods, parent, start, end, stop, states):
+        self.plan = plan
+        self.items = items
+        self.methods = methods
+        self.parent = parent
+        self.start = start
+        self.end = end
+        self.stop = stop
+        self.states = states
+
+    def __str__(self):
+        return f"<DecompositionTree with {len(self)} nodes, {len(self.plan)} actions>"
+
+    def __len__(self):
+        return len(self.items)
+
+    def children(self, k):
+        """Return a list of the indices of node k's children."""
+        result = []
+        j = k + 1
+        while j < self.stop[k]:
+            result.append(j)
+            j = self.stop[j]
+        return result
+
+    def roots(self):
+        """Return a list of the nodes for the items in the original todo_list."""
+        result = []
+        j = 0
+        while j < len(self):
+            result.append(j)
+            j = self.stop[j]
+        return result
+
+    def ancestors(self, k):
+        """Return a list of node k's ancestors, starting with its parent."""
+        result = []
+        k = self.parent[k]
+        while k >= 0:
+            result.append(k)
+            k = self.parent[k]
+        return result
+
+    def display(self):
+        """Print the tree, one node per line, indented to show the hierarchy."""
+        depth = array.array('l', [0]) * len(self)
+        for k in range(len(self)):
+            if self.parent[k] >= 0:
+                depth[k] = depth[self.parent[k]] + 1
+            method = f' by {self.methods[k]}' if self.methods[k] else ''
+            print(f"{'   '*depth[k]}{_item_to_string(self.items[k])}{method}",
+                  f"plan[{self.start[k]}:{self.end[k]}]")
+
+    def _replace(self, above, k, subtree, suffix_states):
+        """
+        Return a DecompositionTree for the rest of the plan, after node k's
+        part of the plan has been replaced by subtree.plan. above is the list
+        of node k's ancestors (starting at the top), and suffix_states is the
+        list of states that the old plan goes through after node k's part,
+        starting at the end of subtree.plan. The nodes before node k that
+        aren't in 'above' are omitted, since they are finished.
+        """
+        (stop_k, end_k) = (self.stop[k], self.end[k])
+        shift = len(subtree.plan) - end_k
+        n = len(above)
+        later = range(stop_k, len(self))
+        # the index that each of the old nodes will have in the new tree
+        renumber = {a:i for (i, a) in enumerate(above)}
+        renumber[-1] = -1
+        offset = n + len(subtree) - stop_k
+        for j in later:
+            renumber[j] = j + offset
+        items = [self.items[a] for a in above] + subtree.items \
+              + [self.items[j] for j in later]
+        methods = [self.methods[a] for a in above] + subtree.methods \
+                + [self.methods[j] for j in later]
+        parent = array.array('l', [renumber[self.parent[a]] for a in above]
+            + [p + n if p >= 0 else n - 1 for p in subtree.parent]
+            + [renumber[self.parent[j]] for j in later])
+        start = array.array('l', [0]*n + list(subtree.start)
+            + [self.start[j] + shift for j in later])
+        end = array.array('l', [self.end[a] + shift for a in above]
+            + list(subtree.end) + [self.end[j] + shift for j in later])
+        stop = array.array('l', [self.stop[a] + offset for a in above]
+            + [s + n for s in subtree.stop] + [self.stop[j] + offset for j in later])
+        return DecompositionTree(subtree.plan + self.plan[end_k:], items, methods,
+                                 parent, start, end, stop,
+                                 subtree.states + suffix_states[1:])
+
+
+################################################################################
+# Search logs
+#
+# A search log is a file that starts with _SEARCH_LOG_MAGIC, followed by a
+# sequence of records. Each record is an opcode byte followed by unsigned
+# varints (7 bits per byte, low-order bits first). Except for _LOG_DEFINE
+# and _LOG_THREAD, the first varint is the number of microseconds since the
+# previous record, and the second is the search depth (0 for _LOG_PLAN_START
+# and _LOG_PLAN_END):
+#   _LOG_DEFINE id size data   - object number 'id' is pickle.loads(data),
+#                                where data is 'size' bytes long
+#   _LOG_THREAD n              - the following records come from thread n
+#   _LOG_PLAN_START dt state todo_list
+#   _LOG_PLAN_END dt outcome [n action ...]
+#                              - outcome is 0 for a plan of n actions, 1 for
+#                                False, and 2 for an exception
+#   _LOG_NODE dt depth todo_length plan_length item
+#                              - item is 0 if the todo_list is empty, and
+#                                otherwise the id of its first item plus 1
+#   _LOG_ACTION_TRY dt depth action
+#   _LOG_METHOD_TRY dt depth method_name
+#   _LOG_GOAL_VERIFIED dt depth method_name
+#   the other opcodes       dt depth
+# Objects are interned: each one is defined the first time it's used, and
+# afterward only its id is written.
+
+_SEARCH_LOG_MAGIC = b'GTPyhop search log 1\n'
+
+(_LOG_DEFINE, _LOG_THREAD, _LOG_PLAN_START, _LOG_PLAN_END, _LOG_NODE,
+ _LOG_SOLUTION, _LOG_BACKTRACK, _LOG_ACTION_TRY, _LOG_ACTION_APPLIED,
+ _LOG_ACTION_FAIL, _LOG_METHOD_TRY, _LOG_METHOD_APPLICABLE, _LOG_METHOD_FAIL,
+ _LOG_GOAL_ACHIEVED, _LOG_GOAL_VERIFIED) = range(15)
+
+# The trace events that only need a depth, and their opcodes
+_LOG_DEPTH_EVENTS = {'solution': _LOG_SOLUTION, 'backtrack': _LOG_BACKTRACK,
+                     'action_applied': _LOG_ACTION_APPLIED,
+                     'action_fail': _LOG_ACTION_FAIL,
+                     'method_applicable': _LOG_METHOD_APPLICABLE,
+                     'method_fail': _LOG_METHOD_FAIL,
+                     'goal_achieved': _LOG_GOAL_ACHIEVED}
+
+# The trace events that a SearchLog records
+_LOG_EVENTS = {'node_enter', 'action_try', 'method_try', 'goal_verified',
+               'plan_start', 'plan_end'} | set(_LOG_DEPTH_EVENTS)
+
+
+class SearchLog():
+    """
+    A hook (see Planner.add_hook) that records every step of find_plan's
+    searches in a compact binary file, for finding out afterward why a
+    search was slow or failed. For example:
+        with SearchLog('search.log') as log:
+            p.add_hook(log)
+            p.find_plan(state, todo_list)
+        p.remove_hook(log)
+        for search in replay_search_log('search.log'):
+            search.display()
+
+    The log only grows at the end, and it's written in blocks of about
+    buffer_size bytes, so the records up to the last block are readable
+    even if the program crashes. Tasks, goals, actions, and method names
+    are pickled only the first time they appear; after that, a record
+    refers to them by number. Thus each node adds a few bytes to the log,
+    and takes a small constant amount of time to record. The only states
+    in the log are the ones given to find_plan, not the ones that actions
+    produce.
+    """
+
+    def __init__(self, path, buffer_size=1 << 16):
+        self.path = path
+        self.buffer_size = buffer_size
+        self._file = open(path, 'wb')
+        self._file.write(_SEARCH_LOG_MAGIC)
+        self._buffer = bytearray()
+        self._lock = threading.Lock()
+        # The ids of interned objects (see _intern)
+        self._ids = {}
+        self._kept = []
+        self._count = 0
+        self._threads = {}
+        self._thread = None
+        self._epoch = time.perf_counter()
+        self._last = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Write the rest of the log, and close the file."""
+        with self._lock:
+            if self._file is not None:
+                self._file.write(self._buffer)
+                self._buffer.clear()
+                self._file.close()
+                self._file = None
+
+    def __call__(self, event, info):
+        """Record a trace event."""
+        if event not in _LOG_EVENTS:
+            return
+        with self._lock:
+            if self._file is None:
+                return
+            buf = self._buffer
+            thread = threading.get_ident()
+            if thread != self._thread:
+                self._thread = thread
+                buf.append(_LOG_THREAD)
+                self._varint(self._threads.setdefault(thread, len(self._threads)))
+            now = int((time.perf_counter() - self._epoch) * 1e6)
+            dt = now - self._last
+            self._last = now
+            if event == 'node_enter':
+                todo_list = info['todo_list']
+                item = self._intern(todo_list[0]) + 1 if todo_list else 0
+                buf.append(_LOG_NODE)
+                self._varints(dt, info['depth'], len(todo_list), len(info['plan']),
+                              item)
+            elif event in _LOG_DEPTH_EVENTS:
+                buf.append(_LOG_DEPTH_EVENTS[event])
+                self._varints(dt, info['depth'])
+            elif event == 'action_try':
+                action = self._intern(info['action'])
+                buf.append(_LOG_ACTION_TRY)
+                self._varints(dt, info['depth'], action)
+            elif event in {'method_try', 'goal_verified'}:
+                method = info['method']
+                if not isinstance(method, str):
+                    method = method.__name__
+                method = self._intern(method)
+                buf.append(_LOG_METHOD_TRY if event == 'method_try' else
+                           _LOG_GOAL_VERIFIED)
+                self._varints(dt, info['depth'], method)
+            elif event == 'plan_start':
+                state = self._intern(info['state'])
+                todo_list = self._intern(info['todo_list'])
+                buf.append(_LOG_PLAN_START)
+                self._varints(dt, 0, state, todo_list)
+            else:   # plan_end
+                result = info['result']
+                if result == None or result == False:
+                    buf.append(_LOG_PLAN_END)
+                    self._varints(dt, 0, 2 if result == None else 1)
+                else:
+                    actions = [self._intern(a) for a in result]
+                    buf.append(_LOG_PLAN_END)
+                    self._varints(dt, 0, 0, len(actions), *actions)
+            if len(buf) >= self.buffer_size:
+                self._file.write(buf)
+                buf.clear()
+
+    def _intern(self, x):
+        """
+        Return the id of the object x, first writing a definition of it if
+        it doesn't have one yet.
+        """
+        if type(x) in {State, list}:
+            # States and lists may change, so they're written each time
+            key = None
+        else:
+            # Objects that can't be dictionary keys are interned by identity
+            key = x
+            try:
+                i = self._ids.get(key)
+            except TypeError:
+                key = (self, id(x))
+                i = self._ids.get(key)
+            if i is not None:
+                return i
+        i = self._count
+        self._count += 1
+        if key is not None:
+            self._ids[key] = i
+            if key is not x:
+                # Keep x, so that its id won't be reused
+                self._kept.append(x)
+        try:
+            data = pickle.dumps(x, pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            data = pickle.dumps(repr(x), pickle.HIGHEST_PROTOCOL)
+        self._buffer.append(_LOG_DEFINE)
+        self._varints(i, len(data))
+        self._buffer += data
+        return i
+
+    def _varint(self, n):
+        """Append n to the buffer as a varint."""
+        buf = self._buffer
+        while n >= 0x80:
+            buf.append((n & 0x7f) | 0x80)
+            n >>= 7
+        buf.append(n)
+
+    def _varints(self, *numbers):
+        """Append each of 'numbers' to the buffer as a varint."""
+        buf = self._buffer
+        for n in numbers:
+            if n < 0x80:
+                buf.append(n)
             else:
-                verification = []
-            todo_list = subgoals + verification + todo_list
-            result = seek_plan(state, todo_list, plan, depth+1)
-            if result != False and result != None:
-                return result
+                self._varint(n)
+
+
+class LoggedSearch():
+    """
+    What replay_search_log found out about one call to find_plan:
+      - thread is the number (0, 1, ...) of the thread that did the search;
+      - state and todo_list are find_plan's arguments (or None, for a
+        search started by seek_plan);
+      - result is the plan, or False if there was none, or None if the
+        search was stopped by an exception or the log ended first (or if
+        it was started by seek_plan with a nonempty plan);
+      - tree is the DecompositionTree for the plan, or None. Only
+        tree.states[0] (the initial state) is known; the other states are
+        None.
+      - nodes is the number of search nodes, and max_depth is the largest
+        depth that the search reached;
+      - seconds is how long the search took;
+      - failures is a list of tuples (time, event, depth, item, method)
+        for each action that wasn't applicable ('action_fail'), method that
+        wasn't applicable ('method_fail'), and item that couldn't be
+        accomplished ('backtrack'). The time is in seconds since the start
+        of the search, and method is the method's name or None.
+      - functions maps (kind, name) to [calls, seconds], where kind is
+        'action' or 'method', as in Profiler.functions.
+    """
+
+    def __init__(self, thread, state, todo_list, started):
+        self.thread = thread
+        self.state = state
+        self.todo_list = todo_list
+        self.result = None
+        self.tree = None
+        self.nodes = 0
+        self.max_depth = 0
+        self.seconds = 0.0
+        self.failures = []
+        self.functions = {}
+        self._started = started
+        # self._path[j] = [item, todo_length, plan_length, method] for
+        # the node at depth base+j on the current path, where 'method' is
+        # the method that produced the node
+        self._path = []
+        self._base = None
+        self._child_method = None
+        self._trying = None
+
+    def __str__(self):
+        outcome = 'interrupted' if self.result == None else \
+                  'failed' if self.result == False else f'{len(self.result)} actions'
+        return f"<LoggedSearch {self.nodes} nodes, {self.seconds:.3f} seconds, {outcome}>"
+
+    def display(self):
+        """Print what happened in the search."""
+        print(self)
+        for (when, event, depth, item, method) in self.failures:
+            method = f' {method}' if method else ''
+            print(f'  {when:10.6f} depth {depth} {event}{method}',
+                  _item_to_string(item))
+        if self.tree is not None:
+            self.tree.display()
+
+    def _node(self, depth, todo_length, plan_length, item):
+        """Update the current path for a node_enter event."""
+        if self._base is None:
+            self._base = depth
+        j = depth - self._base
+        method = self._child_method if j > 0 else None
+        del self._path[j:]
+        self._path.append([item, todo_length, plan_length, method])
+        self._child_method = None
+        self.nodes += 1
+        self.max_depth = max(self.max_depth, depth)
+
+    def _finish(self, result, now):
+        """Record the end of the search, and rebuild its tree."""
+        self.result = result
+        self.seconds = now - self._started
+        path = self._path
+        if result and path and path[-1][1] == 0:
+            self.tree = _make_tree(result, [node[0] for node in path[:-1]],
+                                   [node[3] for node in path[1:]],
+                                   [node[1] for node in path],
+                                   [node[2] for node in path],
+                                   [self.state] + [None] * (len(path) - 1))
+
+
+def replay_search_log(path):
+    """
+    Read the search log 'path' written by a SearchLog, and return a list of
+    LoggedSearch objects, one for each search in it, in the order in which
+    they started. This doesn't need the domain's code, except for any
+    classes that are used in its states, tasks, or goals.
+
+    Warning: the objects in a log are stored with pickle, and reading a
+    log unpickles them, which can run arbitrary code. Only read logs that
+    come from a source you trust.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if not data.startswith(_SEARCH_LOG_MAGIC):
+        raise Exception(f"{path} isn't a GTPyhop search log")
+    objects = {}
+    searches = []
+    # For each thread, the searches that are in progress (innermost last)
+    active = {}
+    thread = 0
+    now = 0.0
+    pos = len(_SEARCH_LOG_MAGIC)
+    size = len(data)
+
+    def varint():
+        nonlocal pos
+        n = shift = 0
+        while True:
+            byte = data[pos]
+            pos += 1
+            n |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return n
+            shift += 7
+
+    def current():
+        stack = active.setdefault(thread, [])
+        if not stack:
+            # A search started by seek_plan, with no plan_start record
+            stack.append(LoggedSearch(thread, None, None, now))
+            searches.append(stack[-1])
+        return stack[-1]
+
+    try:
+        while pos < size:
+            opcode = data[pos]
+            pos += 1
+            if opcode == _LOG_DEFINE:
+                (i, n) = (varint(), varint())
+                if pos + n > size:
+                    break
+                objects[i] = pickle.loads(data[pos:pos+n])
+                pos += n
+                continue
+            if opcode == _LOG_THREAD:
+                thread = varint()
+                continue
+            now += varint() / 1e6
+            depth = varint()
+            if opcode == _LOG_PLAN_START:
+                (state, todo_list) = (objects[varint()], objects[varint()])
+                search = LoggedSearch(thread, state, todo_list, now)
+                active.setdefault(thread, []).append(search)
+                searches.append(search)
+            elif opcode == _LOG_PLAN_END:
+                outcome = varint()
+                if outcome == 0:
+                    result = [objects[varint()] for _ in range(varint())]
+                else:
+                    result = False if outcome == 1 else None
+                current()._finish(result, now)
+                active[thread].pop()
+            elif opcode == _LOG_NODE:
+                (todo_length, plan_length, item) = (varint(), varint(), varint())
+                current()._node(depth, todo_length, plan_length,
+                                objects[item - 1] if item else None)
+            elif opcode in {_LOG_ACTION_TRY, _LOG_METHOD_TRY}:
+                name = objects[varint()]
+                search = current()
+                if opcode == _LOG_ACTION_TRY:
+                    search._trying = ('action', name[0], now, name)
+                else:
+                    search._trying = ('method', name, now, name)
+            elif opcode in {_LOG_ACTION_APPLIED, _LOG_ACTION_FAIL,
+                            _LOG_METHOD_APPLICABLE, _LOG_METHOD_FAIL}:
+                search = current()
+                if search._trying is not None:
+                    (kind, name, started, what) = search._trying
+                    search._trying = None
+                    entry = search.functions.setdefault((kind, name), [0, 0.0])
+                    entry[0] += 1
+                    entry[1] += now - started
+                    if opcode == _LOG_METHOD_APPLICABLE:
+                        search._child_method = name
+                    elif opcode == _LOG_ACTION_FAIL:
+                        search.failures.append((now - search._started,
+                            'action_fail', depth, what, None))
+                    elif opcode == _LOG_METHOD_FAIL:
+                        j = depth - (search._base or 0)
+                        item = search._path[j][0] if 0 <= j < len(search._path) else None
+                        search.failures.append((now - search._started,
+                            'method_fail', depth, item, name))
+            elif opcode == _LOG_BACKTRACK:
+                search = current()
+                j = depth - (search._base or 0)
+                item = search._path[j][0] if 0 <= j < len(search._path) else None
+                search.failures.append((now - search._started, 'backtrack',
+                                        depth, item, None))
+                if j == 0 and search.todo_list == None:
+                    # A search started by seek_plan has failed
+                    search._finish(False, now)
+                    active[thread].pop()
+            elif opcode == _LOG_SOLUTION:
+                search = current()
+                if search.todo_list == None:
+                    # A search started by seek_plan has succeeded. Its plan is
+                    # the actions at the nodes after which the plan got longer.
+                    path = search._path
+                    plan = [path[j][0] for j in range(len(path) - 1)
+                            if path[j+1][2] > path[j][2]]
+                    search._finish(plan if path[0][2] == 0 else None, now)
+                    active[thread].pop()
+            elif opcode == _LOG_GOAL_VERIFIED:
+                varint()
+            elif opcode != _LOG_GOAL_ACHIEVED:
+                raise Exception(f"{path} has an unknown record type {opcode}")
+    except IndexError:
+        # The last record was cut off, e.g., because the program crashed
+        pass
+    for stack in active.values():
+        for search in stack:
+            if search.result == None:
+                search.seconds = now - search._started
+    return searches
+
+
+################################################################################
+# Finding out which state variables an action reads and writes
+#
+# A read set or write set is a set of (state_var_name, arg) pairs, meaning
+# that the action reads or writes state_var_name[arg]. The pair
+# (state_var_name, ...) means all of state_var_name, e.g., because the
+# action iterated over it or replaced it.
+
+
+class _TracedDict(dict):
+    """
+    A dictionary that adds (self.name, key) to the set self.reads whenever
+    the value of a key is looked at, and (self.name, ...) whenever the
+    dictionary as a whole is looked at.
+    """
+
+    def _read(self, key):
+        self.reads.add((self.name, key))
+
+    def __getitem__(self, key):
+        self._read(key)
+        return dict.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        self._read(key)
+        return dict.get(self, key, default)
+
+    def __contains__(self, key):
+        self._read(key)
+        return dict.__contains__(self, key)
+
+    def setdefault(self, key, default=None):
+        self._read(key)
+        return dict.setdefault(self, key, default)
+
+    def pop(self, key, *default):
+        self._read(key)
+        return dict.pop(self, key, *default)
+
+    def _read_all(method):
+        """Make a version of dict.method that reads the whole dictionary."""
+        def traced(self, *args):
+            self._read(...)
+            return method(self, *args)
+        traced.__name__ = method.__name__
+        return traced
+
+    __iter__ = _read_all(dict.__iter__)
+    __len__ = _read_all(dict.__len__)
+    __eq__ = _read_all(dict.__eq__)
+    __ne__ = _read_all(dict.__ne__)
+    __repr__ = _read_all(dict.__repr__)
+    keys = _read_all(dict.keys)
+    values = _read_all(dict.values)
+    items = _read_all(dict.items)
+    copy = _read_all(dict.copy)
+    __hash__ = None
+
+
+class _TracedState(State):
+    """
+    A state whose dictionary-valued state variables are _TracedDicts, and
+    that adds (name, ...) to self._reads whenever a state variable whose
+    value isn't a dictionary is looked at.
+    """
+    __slots__ = ('_reads',)
+
+    def __getattribute__(self, name):
+        value = object.__getattribute__(self, name)
+        if name != '__name__' and type(value) is not _TracedDict and \
+                name in object.__getattribute__(self, '__dict__'):
+            object.__getattribute__(self, '_reads').add((name, ...))
+        return value
+
+
+def _apply_traced(action, state, args):
+    """
+    Apply 'action' to a copy of 'state' and 'args', keeping track of what
+    it reads and writes. Return (new_state, reads, writes), where new_state
+    is an ordinary State (or False if the action wasn't applicable), and
+    reads and writes are its read and write sets.
+
+    The write set is found by comparing new_state with 'state', so it is
+    exact. The read set includes everything the action looks at through the
+    state's attributes; it can miss things that the action looks at some
+    other way, e.g., via vars(state).
+    """
+    reads = set()
+    traced = _TracedState(state.__name__)
+    traced._reads = reads
+    for (name, value) in vars(state).items():
+        if name != '__name__':
+            value = copy.deepcopy(value)
+            if type(value) is dict:
+                value = _TracedDict(value)
+                value.name = name
+                value.reads = reads
+            vars(traced)[name] = value
+    new_state = action(traced, *args)
+    reads = set(reads)
+    if not new_state:
+        return (False, reads, set())
+    result = State(new_state.__name__)
+    for (name, value) in vars(new_state).items():
+        if name != '__name__':
+            vars(result)[name] = dict(value) if type(value) is _TracedDict else value
+    return (result, reads, _changed_state_vars(state, result))
+
+
+def _merge_changes(state, old_state, new_state):
+    """
+    Change 'state' in place by copying into it each state-variable value
+    that differs between old_state and new_state.
+    """
+    for (name, arg) in _changed_state_vars(old_state, new_state):
+        new_vars = vars(new_state)
+        if arg is ...:
+            if name in new_vars:
+                vars(state)[name] = copy.deepcopy(new_vars[name])
+            else:
+                vars(state).pop(name, None)
+        elif arg in new_vars[name]:
+            vars(state)[name][arg] = copy.deepcopy(new_vars[name][arg])
         else:
-            if verbose >= 3:
-                print(f'not applicable')
-    if verbose >= 3:
-        print(f'depth {depth} could not achieve multigoal {goal1}')        
-    return False
+            vars(state)[name].pop(arg, None)
+
+
+def _changed_state_vars(old_state, new_state):
+    """
+    Return the set of (state_var_name, arg) pairs whose values differ
+    between old_state and new_state, using (state_var_name, ...) for state
+    variables that aren't dictionaries.
+    """
+    changed = set()
+    old_vars = vars(old_state)
+    new_vars = vars(new_state)
+    for name in old_vars.keys() | new_vars.keys():
+        if name == '__name__':
+            continue
+        old = old_vars.get(name)
+        new = new_vars.get(name)
+        if type(old) is dict and type(new) is dict:
+            for arg in old.keys() | new.keys():
+                if arg not in old or arg not in new or old[arg] != new[arg]:
+                    changed.add((name, arg))
+        elif old != new or name not in old_vars or name not in new_vars:
+            changed.add((name, ...))
+    return changed
+
+
+def _plan_dependencies(domain, state, plan):
+    """
+    Simulate 'plan' from 'state' with the action definitions in 'domain',
+    and find out which actions must stay in order. Return (preds, reads,
+    writes), where reads[i] and writes[i] are the read and write sets of
+    plan[i], and preds[i] is a sorted list of indices j < i such that
+    plan[i] reads or writes something that plan[j] writes, or writes
+    something that plan[j] reads, since the last write before plan[j].
+    Every other action that plan[i] must come after can be reached from
+    preds[i] by following preds. Raise an exception if the plan doesn't
+    work in 'state'.
+    """
+    # writer[name][arg] = the last action that wrote name[arg], and
+    # readers[name][arg] = the actions that have read it since then
+    writer = {}
+    readers = {}
+    (preds, reads, writes) = ([], [], [])
+    for (i, action) in enumerate(plan):
+        (state, r, w) = _apply_traced(domain._action_dict[action[0]], state, action[1:])
+        if not state:
+            raise Exception(f"action {action} isn't applicable at step {i} of the plan")
+        p = set()
+        for (name, arg) in r:
+            written = writer.get(name, {})
+            if arg is ...:
+                p.update(written.values())
+            else:
+                p.update(written.get(x) for x in (arg, ...) if x in written)
+        for (name, arg) in w:
+            written = writer.get(name, {})
+            read = readers.get(name, {})
+            if arg is ...:
+                p.update(written.values())
+                for indices in read.values():
+                    p.update(indices)
+            else:
+                for x in (arg, ...):
+                    if x in written:
+                        p.add(written[x])
+                    p.update(read.get(x, []))
+        for (name, arg) in w:
+            if arg is ...:
+                writer[name] = {...: i}
+                readers[name] = {}
+            else:
+                writer.setdefault(name, {})[arg] = i
+                readers.setdefault(name, {})[arg] = []
+        for (name, arg) in r:
+            readers.setdefault(name, {}).setdefault(arg, []).append(i)
+        p.discard(i)
+        preds.append(sorted(p))
+        reads.append(r)
+        writes.append(w)
+    return (preds, reads, writes)
+
+
+################################################################################
+# Partial-order plans
+
+
+class PartialOrderPlan():
+    """
+    A PartialOrderPlan says which of a plan's actions must stay in order and
+    which ones can be done in either order or at the same time. To get one,
+    call deorder_plan(state, plan).
+
+    Action i must come after action j (j < i) if one of them writes a state
+    variable that the other one reads or writes, or if it must come after
+    some action that must come after j, and so forth. Only the edges that
+    aren't implied by other edges are kept (i.e., the graph is transitively
+    reduced). The edges are stored in compressed-sparse-row form, as arrays
+    of integers:
+      - the actions that action i must come after are
+            predecessors[pred_offsets[i]:pred_offsets[i+1]]
+      - the actions that must come after action i are
+            successors[succ_offsets[i]:succ_offsets[i+1]]
+    Other attributes:
+      - plan is the list of actions;
+      - level[i] is the earliest step at which action i can be done if
+        every action takes one step and steps start at 0;
+      - critical_path_length is the number of steps needed to do all of
+        the actions, i.e., the length of the longest chain of actions that
+        must stay in order;
+      - width is the largest number of actions that are done at the same
+        step, if each action is done as early as possible.
+    """
+
+    def __init__(self, plan, preds):
+        """
+        plan is a list of actions, and preds[i] is a list of actions that
+        plan[i] must come after (not necessarily transitively reduced).
+        """
+        n = len(plan)
+        self.plan = plan
+        # reach[i] has bit j set if action i must come after action j
+        reach = [0] * n
+        reduced = []
+        for i in range(n):
+            implied = 0
+            for j in preds[i]:
+                implied |= reach[j]
+            kept = [j for j in preds[i] if not (implied >> j) & 1]
+            for j in kept:
+                implied |= reach[j] | (1 << j)
+            reach[i] = implied
+            reduced.append(kept)
+        self.pred_offsets = array.array('l', [0]) * (n + 1)
+        self.predecessors = array.array('l')
+        for i in range(n):
+            self.predecessors.extend(reduced[i])
+            self.pred_offsets[i+1] = len(self.predecessors)
+        counts = [0] * n
+        for j in self.predecessors:
+            counts[j] += 1
+        self.succ_offsets = array.array('l', [0]) * (n + 1)
+        for i in range(n):
+            self.succ_offsets[i+1] = self.succ_offsets[i] + counts[i]
+        self.successors = array.array('l', [0]) * len(self.predecessors)
+        filled = list(self.succ_offsets[:n])
+        for i in range(n):
+            for j in reduced[i]:
+                self.successors[filled[j]] = i
+                filled[j] += 1
+        self.level = array.array('l', [0]) * n
+        for i in range(n):
+            if reduced[i]:
+                self.level[i] = 1 + max(self.level[j] for j in reduced[i])
+        sizes = collections.Counter(self.level)
+        self.critical_path_length = 1 + max(self.level) if n else 0
+        self.width = max(sizes.values()) if n else 0
+
+    def __str__(self):
+        return f"<PartialOrderPlan with {len(self.plan)} actions, " + \
+            f"{len(self.predecessors)} edges, critical path " + \
+            f"{self.critical_path_length}, width {self.width}>"
+
+    def __len__(self):
+        return len(self.plan)
+
+    def predecessors_of(self, i):
+        """Return the actions that action i must come right after."""
+        return self.predecessors[self.pred_offsets[i]:self.pred_offsets[i+1]].tolist()
+
+    def successors_of(self, i):
+        """Return the actions that must come right after action i."""
+        return self.successors[self.succ_offsets[i]:self.succ_offsets[i+1]].tolist()
+
+    def layers(self):
+        """
+        Return a list of lists of actions: each action is in the list for
+        its level, i.e., the earliest step at which it can be done.
+        """
+        result = [[] for _ in range(self.critical_path_length)]
+        for i in range(len(self.plan)):
+            result[self.level[i]].append(i)
+        return result
+
+    def critical_path(self):
+        """Return a longest chain of actions that must be done in order."""
+        if not self.plan:
+            return []
+        i = max(range(len(self.plan)), key=lambda i: self.level[i])
+        path = [i]
+        while self.level[i] > 0:
+            i = next(j for j in self.predecessors_of(i) if self.level[j] == self.level[i] - 1)
+            path.append(i)
+        return path[::-1]
+
+    def display(self):
+        """Print the actions, step by step."""
+        for (step, actions) in enumerate(self.layers()):
+            print(f'step {step}:', ', '.join([_item_to_string(self.plan[i]) for i in actions]))
 
 
 ############################################################
 # The planning algorithm
 
 
-def find_plan(state, todo_list):
+def find_plan(state, todo_list, token=None, tree=False, time_limit=None, stats=False,
+              memory=False):
     """
     find_plan tries to find a plan that accomplishes the items in todo_list,
     starting from the given state, using whatever methods and actions you
     declared previously. If successful, it returns the plan. Otherwise it
     returns False. Arguments:
      - 'state' is a state;
-     - 'todo_list' is a list of goals, tasks, and actions.
-    """
-    if verbose >= 1: 
-        todo_string = '[' + ', '.join([_item_to_string(x) for x in todo_list]) + ']'
-        print(f'FP> find_plan, verbose={verbose}:')
-        print(f'    state = {state.__name__}\n    todo_list = {todo_string}')
-    result = seek_plan(state, todo_list, [], 0)
-    if verbose >= 1: print('FP> result =',result,'\n')
-    return result
+     - 'todo_list' is a list of goals, tasks, and actions;
+     - 'token' (optional) is a CancellationToken. If someone cancels it while
+       find_plan is running, find_plan will raise PlanningCancelled.
+     - If 'tree' is True, then find_plan returns a pair (plan, t), where t
+       is a DecompositionTree telling how the planner got the plan (or None
+       if there's no plan).
+     - time_limit (optional) is a number of seconds. If find_plan hasn't
+       finished by then, it raises PlanningTimeout.
+     - If 'stats' is True, find_plan also returns a SearchStats object,
+       and if 'memory' is True, it also returns a MemoryStats object (see
+       Planner.find_plan).
+
+    find_plan uses the global variables current_domain, verbose, and
+    verify_goals. To plan with other settings, use Planner.find_plan.
+    """
+    return Planner().find_plan(state, todo_list, token, tree, time_limit, stats,
+                               memory)
+
+
+async def find_plan_async(state, todo_list, yield_every=100, yield_interval=None,
+                          token=None):
+    """
+    find_plan_async is a coroutine version of find_plan, for use with asyncio.
+    See Planner.find_plan_async for details.
+    """
+    return await Planner().find_plan_async(state, todo_list, yield_every,
+                                           yield_interval, token)
 
 
 def pyhop(state, todo_list):
@@ -820,35 +4480,68 @@ def pyhop(state, todo_list):
     return find_plan(state, todo_list)
 
 
-def seek_plan(state, todo_list, plan, depth):
+def seek_plan(state, todo_list, plan, depth, token=None):
     """
     Workhorse for find_plan. Arguments:
      - state is the current state
      - todo_list is the current list of goals, tasks, and actions
      - plan is the current partial plan
      - depth is the recursion depth, for use in debugging
+     - token (optional) is a CancellationToken to check during the search
     """
-    if verbose >= 2: 
-        todo_string = '[' + ', '.join([_item_to_string(x) for x in todo_list]) + ']'
-        print(f'depth {depth} todo_list ' + todo_string)
-    if todo_list == []:
-        if verbose >= 3:
-            print(f'depth {depth} no more tasks or goals, return plan')
-        return plan
-    item1 = todo_list[0]
-    ttype = get_type(item1)
-    if ttype in {'Multigoal'}:
-        return _refine_multigoal_and_continue(state, item1, todo_list[1:], plan, depth)
-    elif ttype in {'list','tuple'}:
-        if item1[0] in current_domain._action_dict:
-            return _apply_action_and_continue(state, item1, todo_list[1:], plan, depth)
-        elif item1[0] in current_domain._task_method_dict:
-            return _refine_task_and_continue(state, item1, todo_list[1:], plan, depth)
-        elif item1[0] in current_domain._unigoal_method_dict:
-            return _refine_unigoal_and_continue(state, item1, todo_list[1:], plan, depth)
-    raise Exception(    \
-        f"depth {depth}: {item1} isn't an action, task, unigoal, or multigoal\n")
-    return False
+    return Planner().seek_plan(state, todo_list, plan, depth, token)
+
+
+def find_plans(problems, domain=None, max_workers=None, verbose=0,
+               verify_goals=None, token=None, cache=None, stats=False):
+    """
+    find_plans solves a batch of planning problems in a pool of threads,
+    and returns a list of the results (plans, or False for failures) in the
+    same order as the problems. Arguments:
+     - 'problems' is a list of (state, todo_list) pairs;
+     - 'domain' is the domain to plan in (default: current_domain). To make
+       it safe to share among the threads, find_plans freezes it (see
+       Domain.freeze) until it returns. If several find_plans calls are
+       using the domain at once, it stays frozen until they have all
+       returned, and if freeze was called, it stays frozen after that;
+     - max_workers is the number of threads (default: the default for
+       concurrent.futures.ThreadPoolExecutor);
+     - verbose and verify_goals are the Planner settings to use. verbose
+       defaults to 0, since output from several threads would be jumbled;
+     - 'token' (optional) is a CancellationToken that stops every problem
+       that hasn't been solved yet;
+     - 'cache' (optional) is a PlanCache for the threads to share;
+     - if 'stats' is True, then each result is a pair (plan, s), where s is
+       a SearchStats object for that problem, as find_plan(..., stats=True)
+       returns. Its cpu_time is for the thread that solved the problem.
+
+    The threads share the domain and the problems' states, but only read
+    them; each call to find_plan makes its own copies of the states that it
+    modifies. In a CPython build that has a global interpreter lock, only
+    one thread at a time can run Python code, so find_plans mostly helps on
+    free-threaded ("no-GIL") builds of CPython, where it avoids the cost of
+    sending the states and plans to other processes.
+    """
+    planner = Planner(domain, verbose, verify_goals, cache)
+    planner.domain._start_batch()
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers) as pool:
+            futures = [pool.submit(planner.find_plan, state, todo_list, token,
+                                   stats=stats)
+                       for (state, todo_list) in problems]
+            try:
+                return [f.result() for f in futures]
+            except BaseException:
+                for f in futures:
+                    f.cancel()
+                raise
+    finally:
+        planner.domain._end_batch()
+
+
+def _ordinal(n):
+    """Return '1st', '2nd', '3rd', '4th', '5th', etc."""
+    return f"{n}{ {1:'st', 2:'nd', 3:'rd'}.get(n, 'th') }"
 
 
 def _item_to_string(item):
@@ -862,98 +4555,408 @@ def _item_to_string(item):
         return str(item)
 
 
+def deorder_plan(state, plan):
+    """
+    Return a PartialOrderPlan that tells which actions in 'plan' must stay in
+    order, and which ones could be done in a different order or at the same
+    time. See Planner.deorder_plan for details. deorder_plan uses the global
+    variable current_domain.
+    """
+    return Planner().deorder_plan(state, plan)
+
+
 ################################################################################
-# An actor
+# Caching the results of find_plan
+
+
+class PlanCache():
+    """
+    c = PlanCache(maxsize=1024, ttl=None, path=None) creates a size-bounded
+    cache for the results of find_plan. To use it, give it to a Planner:
+        p = Planner(domain, cache=c)
+    Then p.find_plan(state, todo_list) will return the cached result if it
+    has already solved the same problem. Arguments:
+      - maxsize is the maximum number of results to keep. When the cache is
+        full, the least recently used result is discarded.
+      - ttl (optional) is a time in seconds. Results that are older than
+        this are discarded.
+      - path (optional) is the name of an SQLite database file in which to
+        keep a copy of the cache, so that it survives restarts. Several
+        processes may share the same file. It also holds at most maxsize
+        results; when it's full, the oldest ones are discarded. The plans
+        in the file are stored with pickle, and unpickling them can run
+        arbitrary code, so don't use a file that anyone you don't trust
+        can write to.
+
+    The cache key for a problem consists of a fingerprint of the domain's
+    actions and methods (which changes whenever the domain's code or its
+    declarations change), the values of the state's state variables (but
+    not the state's name), and the items in the todo_list. Thus the cache
+    assumes that find_plan's result depends only on those things, i.e.,
+    that actions and methods don't depend on anything outside of their
+    arguments. find_plan(..., tree=True), which run_lazy_lookahead and its
+    relatives use when they can repair plans, caches each plan together
+    with its DecompositionTree, under a different key than the plan alone.
+
+    c.hits and c.misses are the numbers of successful and unsuccessful
+    lookups.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, path=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()   # key -> (time, result)
+        self._lock = threading.Lock()
+        self._fingerprints = {}     # id(domain) -> (domain, version, fingerprint)
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, timeout=30, isolation_level=None,
+                                       check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.execute('CREATE TABLE IF NOT EXISTS plans ' +
+                             '(key TEXT PRIMARY KEY, time REAL, result BLOB)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS plans_time ON plans (time)')
+
+    def __str__(self):
+        return f"<PlanCache {len(self)}/{self.maxsize} entries, " + \
+               f"{self.hits} hits, {self.misses} misses>"
+
+    def __len__(self):
+        return len(self._entries)
+
+    def key(self, domain, state, todo_list):
+        """Return the cache key for planning for todo_list from state in domain."""
+        state_vars = frozenset((name, _canonical(val))
+                               for (name, val) in vars(state).items()
+                               if name != '__name__')
+        return (self._fingerprint(domain), state_vars, _canonical(todo_list))
+
+    def get(self, key):
+        """
+        Return the cached result (a plan, or False) for 'key', or None if
+        there isn't one.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if self.ttl is None or now - entry[0] <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return _copy_result(entry[1])
+                del self._entries[key]
+            if self._db is not None:
+                row = self._db.execute('SELECT time, result FROM plans WHERE key = ?',
+                                       (_stable_digest(key),)).fetchone()
+                if row is not None and (self.ttl is None or now - row[0] <= self.ttl):
+                    result = pickle.loads(row[1])
+                    self._remember(key, row[0], result)
+                    self.hits += 1
+                    return _copy_result(result)
+            self.misses += 1
+            return None
+
+    def put(self, key, result):
+        """Store 'result' (a plan, or False) as the cached result for 'key'."""
+        now = time.time()
+        result = _copy_result(result)
+        with self._lock:
+            self._remember(key, now, result)
+            if self._db is not None:
+                self._db.execute('INSERT OR REPLACE INTO plans VALUES (?, ?, ?)',
+                    (_stable_digest(key), now, pickle.dumps(result, pickle.HIGHEST_PROTOCOL)))
+                self._db.execute('DELETE FROM plans WHERE key IN (SELECT key ' +
+                    'FROM plans ORDER BY time DESC LIMIT -1 OFFSET ?)', (self.maxsize,))
+
+    def clear(self):
+        """Discard everything in the cache, including the on-disk copy."""
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute('DELETE FROM plans')
+
+    def close(self):
+        """
+        Close the on-disk copy of the cache, if there is one. After that,
+        the cache only keeps results in memory.
+        """
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def _remember(self, key, when, result):
+        """Put an entry into the in-memory part of the cache."""
+        self._entries[key] = (when, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def _fingerprint(self, domain):
+        """Return domain's fingerprint, recomputing it if the domain has changed."""
+        entry = self._fingerprints.get(id(domain))
+        if entry is None or entry[0] is not domain or entry[1] != domain._version:
+            entry = (domain, domain._version, _domain_fingerprint(domain))
+            self._fingerprints[id(domain)] = entry
+        return entry[2]
+
+
+def _copy_result(result):
+    """
+    Copy a plan so the caller can't change the cached one; False stays
+    False. In a (plan, DecompositionTree) pair, only the plan is copied,
+    since nothing changes a DecompositionTree.
+    """
+    if type(result) is tuple:
+        return (_copy_result(result[0]), result[1])
+    return list(result) if result else result
+
+
+def _domain_fingerprint(domain):
+    """
+    Return a string that identifies the code of all of domain's actions,
+    commands, and methods, and the names they're declared under.
+    """
+    digest = hashlib.sha1(domain.__name__.encode())
+    declarations = [('action', name, [f]) for (name, f) in domain._action_dict.items()] \
+        + [('command', name, [f]) for (name, f) in domain._command_dict.items()] \
+        + [('task', name, fs) for (name, fs) in domain._task_method_dict.items()] \
+        + [('unigoal', name, fs) for (name, fs) in domain._unigoal_method_dict.items()] \
+        + [('multigoal', '', domain._multigoal_method_list)]
+    for (kind, name, functions) in declarations:
+        digest.update(f'{kind} {name}:'.encode())
+        for f in functions:
+            digest.update(f'{f.__module__}.{f.__qualname__};'.encode())
+            code = getattr(f, '__code__', None)
+            if code is not None:
+                _update_with_code(digest, code)
+    return digest.hexdigest()
+
+
+def _update_with_code(digest, code):
+    """
+    Add a code object to a hashlib digest. This doesn't use marshal, because
+    marshal's output depends on reference counts, which differ from one
+    process to another.
+    """
+    digest.update(code.co_code)
+    digest.update(repr((code.co_names, code.co_varnames, code.co_freevars)).encode())
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            _update_with_code(digest, const)
+        else:
+            digest.update(_stable_repr(_canonical(const)).encode())
+
 
+# Types whose values can be used in a cache key as they are
+_atomic_types = {str, int, float, bool, type(None)}
 
-def run_lazy_lookahead(state, todo_list, max_tries=10):
+
+def _canonical(x):
+    """
+    Return a hashable value that is equal for equal values of x, for use in
+    a cache key. Lists, tuples, sets, and dicts are tagged so that, e.g., a
+    list and a tuple with the same elements get different keys.
+    """
+    t = type(x)
+    if t in _atomic_types:
+        return x
+    if t is tuple:
+        return tuple([_canonical(y) for y in x])
+    if t is list:
+        return ('<list>',) + tuple([_canonical(y) for y in x])
+    if t is dict:
+        return ('<dict>', frozenset([(_canonical(k), _canonical(v)) for (k,v) in x.items()]))
+    if t is set or t is frozenset:
+        return ('<set>', frozenset([_canonical(y) for y in x]))
+    if isinstance(x, (State, Multigoal)):
+        return (f'<{t.__name__}>', frozenset((name, _canonical(val))
+                for (name, val) in vars(x).items() if name != '__name__'))
+    try:
+        hash(x)
+        return x
+    except TypeError:
+        return repr(x)
+
+
+def _stable_digest(key):
+    """
+    Return a digest of a cache key that is the same in every Python process
+    (unlike hash(key), which depends on PYTHONHASHSEED).
+    """
+    return hashlib.sha1(_stable_repr(key).encode()).hexdigest()
+
+
+def _stable_repr(x):
+    """Like repr(x), but the elements of frozensets are sorted."""
+    if type(x) is frozenset:
+        return '{' + ', '.join(sorted([_stable_repr(y) for y in x])) + '}'
+    if type(x) is tuple:
+        return '(' + ', '.join([_stable_repr(y) for y in x]) + ')'
+    return repr(x)
+
+
+################################################################################
+# Actors
+
+
+def run_lazy_lookahead(state, todo_list, max_tries=10, token=None, repair=True,
+                       checkpoint=None, checkpoint_interval=0, observations=None,
+                       time_limit=None, plan_time_limit=None, fallback=None):
     """
     An adaptation of the run_lazy_lookahead algorithm from Ghallab et al.
-    (2016), Automated Planning and Acting. It works roughly like this:
-        loop:
-            plan = find_plan(state, todo_list)
-            if plan = [] then return state    // the new current state 
-            for each action in plan:
-                try to execute the corresponding command
-                if the command fails, continue the outer loop
-    Arguments: 
-      - 'state' is a state;
-      - 'todo_list' is a list of tasks, goals, and multigoals;
-      - max_tries is a bound on how many times to execute the outer loop.
-      
-    Note: whenever run_lazy_lookahead encounters an action for which there is
-    no corresponding command definition, it uses the action definition instead.
+    (2016), Automated Planning and Acting. See Planner.run_lazy_lookahead
+    for details. run_lazy_lookahead uses the global variables current_domain,
+    verbose, and verify_goals.
     """
-    
-    if verbose >= 1: 
-        print(f"RLL> run_lazy_lookahead, verbose = {verbose}, max_tries = {max_tries}")
-        print(f"RLL> initial state: {state.__name__}")
-        print('RLL> To do:', todo_list)
-
-    for tries in range(1,max_tries+1):
-        if verbose >= 1: 
-            ordinals = {1:'st',2:'nd',3:'rd'}
-            if ordinals.get(tries):
-                print(f"RLL> {tries}{ordinals.get(tries)} call to find_plan:\n")
-            else:
-                print(f"RLL> {tries}th call to find_plan:\n")
-        plan = find_plan(state, todo_list)
-        if plan == False or plan == None:
-            if verbose >= 1:
-                raise Exception(
-                        f"run_lazy_lookahead: find_plan has failed")
-            return state
-        if plan == []:
-            if verbose >= 1: 
-                print(f'RLL> Empty plan => success',
-                      f'after {tries} calls to find_plan.')
-            if verbose >= 2: state.display(heading='> final state')
-            return state
-        for action in plan:
-            command_name = 'c_' + action[0]
-            command_func = current_domain._command_dict.get(command_name)
-            if command_func == None:
-                if verbose >= 1: 
-                    print(f'RLL> {command_name} not defined, using {action[0]} instead\n')
-                command_func = current_domain._action_dict.get(action[0])
-                
-            if verbose >= 1:
-                print('RLL> Command:', [command_name] + list(action[1:]))
-            new_state = _apply_command_and_continue(state, command_func, action[1:])
-            if new_state == False:
-                if verbose >= 1: 
-                    print(f'RLL> WARNING: command {command_name} failed; will call find_plan.')
-                    break
-            else:
-                if verbose >= 2: 
-                    new_state.display()
-                state = new_state
-        # if state != False then we're here because the plan ended
-        if verbose >= 1 and state:
-            print(f'RLL> Plan ended; will call find_plan again.')
-        
-    if verbose >= 1: print('RLL> Too many tries, giving up.')
-    if verbose >= 2: state.display(heading='RLL> final state')
-    return state
+    return Planner().run_lazy_lookahead(state, todo_list, max_tries, token, repair,
+                                        checkpoint, checkpoint_interval, observations,
+                                        time_limit, plan_time_limit, fallback)
 
 
-def _apply_command_and_continue(state, command, args):
+async def run_lazy_lookahead_async(state, todo_list, max_tries=10, token=None,
+                                   max_concurrent=None, observations=None):
     """
-    _apply_command_and_continue applies 'command' by retrieving its
-    function definition and calling it on the arguments.
+    A coroutine version of run_lazy_lookahead that can execute independent
+    commands at the same time. See Planner.run_lazy_lookahead_async for
+    details. run_lazy_lookahead_async uses the global variables
+    current_domain, verbose, and verify_goals.
     """
-    if verbose >= 3:
-        print(f"_apply_command_and_continue {command.__name__}, args = {args}")
-    next_state = command(state.copy(),*args)
-    if next_state:
-        if verbose >= 3:
-            print('applied')
-            next_state.display()
-        return next_state
-    else:
-        if verbose >= 3:
-            print('not applicable')
-        return False
+    return await Planner().run_lazy_lookahead_async(state, todo_list, max_tries,
+                                                    token, max_concurrent,
+                                                    observations)
+
+
+def run_concurrent_lookahead(state, todo_list, max_tries=10, token=None, repair=True,
+                             checkpoint=None, checkpoint_interval=0, observations=None,
+                             time_limit=None, plan_time_limit=None, fallback=None):
+    """
+    A version of run_lazy_lookahead that plans in a background thread while
+    it executes commands. See Planner.run_concurrent_lookahead for details.
+    run_concurrent_lookahead uses the global variables current_domain,
+    verbose, and verify_goals.
+    """
+    return Planner().run_concurrent_lookahead(state, todo_list, max_tries, token,
+                                              repair, checkpoint, checkpoint_interval,
+                                              observations, time_limit,
+                                              plan_time_limit, fallback)
+
+
+def resume_lazy_lookahead(checkpoint, max_tries=None, token=None, repair=True,
+                          checkpoint_interval=0, observations=None, time_limit=None,
+                          plan_time_limit=None, fallback=None):
+    """
+    Continue a run_lazy_lookahead or run_concurrent_lookahead mission from
+    the checkpoint file 'checkpoint'. See Planner.resume_lazy_lookahead for
+    details, including its warning about untrusted checkpoint files.
+    resume_lazy_lookahead uses the global variables current_domain,
+    verbose, and verify_goals.
+    """
+    return Planner().resume_lazy_lookahead(checkpoint, max_tries, token, repair,
+                                           checkpoint_interval, observations,
+                                           time_limit, plan_time_limit, fallback)
+
+
+def _observation_source(observations):
+    """
+    Return something that _available_observations can take observations
+    from: 'observations' itself if it's a queue, otherwise an iterator for it.
+    """
+    if hasattr(observations, 'get_nowait'):
+        return observations
+    if hasattr(observations, '__anext__'):
+        raise Exception("an async iterator of observations can only be used " +
+                        "with run_lazy_lookahead_async")
+    return iter(observations)
+
+
+def _available_observations(observations):
+    """
+    Return a list of the observations that are available now from a queue
+    or an iterator that returns None when it has nothing new.
+    """
+    result = []
+    if hasattr(observations, 'get_nowait'):
+        while True:
+            try:
+                result.append(observations.get_nowait())
+            except (queue.Empty, asyncio.QueueEmpty):
+                return result
+    for observation in observations:
+        if observation is None:
+            break
+        result.append(observation)
+    return result
+
+
+async def _pump_observations(observations, inbox, arrived):
+    """
+    Move observations from an asyncio.Queue or an async iterator into the
+    deque 'inbox' as they arrive, and set the asyncio.Event 'arrived'.
+    """
+    if isinstance(observations, asyncio.Queue):
+        while True:
+            inbox.append(await observations.get())
+            arrived.set()
+    async for observation in observations:
+        inbox.append(observation)
+        arrived.set()
+
+
+def _apply_observation(state, observation):
+    """
+    Change 'state' in place as described by 'observation', which is either
+    (state_var_name, arg, value) or (state_var_name, value). Return the
+    (state_var_name, arg) pair that it changed, with ... as arg in the
+    second case.
+    """
+    if len(observation) == 3:
+        (name, arg, value) = observation
+        values = vars(state).get(name)
+        if values is None:
+            values = {}
+            setattr(state, name, values)
+        values[arg] = value
+        return (name, arg)
+    (name, value) = observation
+    setattr(state, name, value)
+    return (name, ...)
+
+
+# The first bytes of every checkpoint file, followed by a pickled dictionary
+_CHECKPOINT_MAGIC = b'GTPyhop checkpoint 1\n'
+
+
+def _write_checkpoint(path, data):
+    """
+    Write 'data' to the checkpoint file 'path'. To make sure the file is
+    never half-written, write a temporary file first, then rename it.
+    """
+    temp = f'{path}.tmp'
+    with open(temp, 'wb') as f:
+        f.write(_CHECKPOINT_MAGIC)
+        pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp, path)
+
+
+def _read_checkpoint(path):
+    """Return the dictionary in the checkpoint file 'path'."""
+    with open(path, 'rb') as f:
+        if f.read(len(_CHECKPOINT_MAGIC)) != _CHECKPOINT_MAGIC:
+            raise Exception(f"{path} isn't a GTPyhop checkpoint file")
+        return pickle.load(f)
+
+
+def _remove_checkpoint(path):
+    """Delete the checkpoint file 'path', if there is one."""
+    if path and os.path.exists(path):
+        os.remove(path)
 
 
 ###############################################################################
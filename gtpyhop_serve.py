@@ -0,0 +1,322 @@
+# SPDX-FileCopyrightText: 2021 University of Maryland
+# SPDX-License-Identifier: BSD-3-Clause-Clear
+
+"""
+A local planning server for GTPyhop. It imports one or more planning domains
+once, in each process of a pool of worker processes, and then answers
+planning requests over a Unix-domain socket or a localhost TCP port. This
+avoids re-importing gtpyhop and the domain modules (and printing their
+banners) every time a tool wants a plan.
+
+Usage, from the directory that contains gtpyhop.py:
+
+    python -m gtpyhop_serve --path Examples --socket /tmp/gtpyhop.sock blocks_htn
+    python -m gtpyhop_serve --path Examples --port 8765 --workers 4 blocks_htn simple_htn
+
+Protocol: each request is one line of JSON, and each response is one line of
+JSON. A client may send many requests without waiting for the responses
+(pipelining). The responses are sent as soon as they are ready, so they may
+arrive in a different order than the requests; use the 'id' field to match
+them up. A request looks like this:
+
+    {"id": 1, "domain": "blocks_htn",
+     "state": {"__state__": "s1", "pos": {"a": "b", "b": "table"}, ...},
+     "todo_list": [["take", "a"], ["put", "a", "table"]],
+     "budget": 2.0}
+
+  - 'domain' is optional if the server has only one domain.
+  - 'budget' is optional. It is a limit, in seconds, on the planning time,
+    and must be a positive number. The planner checks it between search
+    nodes (see find_plan's time_limit), so it doesn't interrupt an action
+    or method that is running.
+
+The response contains the plan (or false), plus some statistics, including
+the search statistics from find_plan(..., stats=True) (see SearchStats):
+
+    {"id": 1, "plan": [["unstack", "a", "b"], ["putdown", "a"]],
+     "stats": {"time": 0.0002, "cpu_time": 0.0002, "plan_length": 2,
+               "worker": 12345, "search": {"nodes": 5, "max_depth": 4, ...}}}
+
+If the server was started with --cache-size or --cache-file, each worker
+keeps a gtpyhop.PlanCache of the results it has computed, and 'cache_hit'
+in the response's statistics tells whether the plan came from the cache.
+A plan from the cache has no search statistics.
+
+If something goes wrong (e.g., the budget runs out, or isn't a positive
+number), the response has an 'error' field instead of a 'plan' field.
+
+JSON has no tuples, sets, or non-string dictionary keys, so the server uses
+the following conventions for states, multigoals, and to-do lists:
+  - A JSON array in a to-do list or plan is a tuple.
+  - {"__state__": name, var1: val1, ...} is a State, and
+    {"__multigoal__": name, var1: val1, ...} is a Multigoal.
+  - A state variable's value may be a JSON object, or a JSON array of
+    [arg, value] pairs for state variables whose args aren't strings.
+  - {"__set__": [x1, ..., xn]} is a set.
+"""
+
+import argparse, asyncio, concurrent.futures, contextlib, importlib, io
+import json, os, sys, time
+
+import gtpyhop
+
+
+################################################################################
+# Converting states, multigoals, and to-do lists to and from JSON
+
+
+def _from_json(x):
+    """Convert a decoded JSON to-do list item (or plan) to GTPyhop objects."""
+    if isinstance(x, list):
+        return tuple(_from_json(y) for y in x)
+    if isinstance(x, dict):
+        if '__state__' in x:
+            return _object_from_json(gtpyhop.State, x['__state__'], x)
+        if '__multigoal__' in x:
+            return _object_from_json(gtpyhop.Multigoal, x['__multigoal__'], x)
+        if '__set__' in x:
+            return {_from_json(y) for y in x['__set__']}
+        return {k:_from_json(v) for (k,v) in x.items()}
+    return x
+
+
+def _object_from_json(cls, name, x):
+    """Create a State or Multigoal named 'name' from the JSON object x."""
+    obj = cls(name)
+    for (varname, val) in x.items():
+        if varname.startswith('__'):
+            continue
+        if isinstance(val, list):
+            # a list of [arg, value] pairs
+            val = {_from_json(arg):_from_json(v) for (arg,v) in val}
+        else:
+            val = _from_json(val)
+        setattr(obj, varname, val)
+    return obj
+
+
+def _to_json(x):
+    """Convert a plan, to-do list, state or multigoal to JSON-compatible data."""
+    if isinstance(x, (list, tuple)):
+        return [_to_json(y) for y in x]
+    if isinstance(x, (set, frozenset)):
+        return {'__set__': [_to_json(y) for y in x]}
+    if isinstance(x, (gtpyhop.State, gtpyhop.Multigoal)):
+        key = '__state__' if isinstance(x, gtpyhop.State) else '__multigoal__'
+        result = {key: x.__name__}
+        for varname in x.state_vars():
+            val = vars(x)[varname]
+            if isinstance(val, dict) and \
+                    not all(isinstance(arg, str) for arg in val):
+                val = [[_to_json(arg), _to_json(v)] for (arg,v) in val.items()]
+            else:
+                val = _to_json(val)
+            result[varname] = val
+        return result
+    if isinstance(x, dict):
+        return {k:_to_json(v) for (k,v) in x.items()}
+    return x
+
+
+################################################################################
+# Code that runs in the worker processes
+
+
+# Maps each domain name and domain-module name to the corresponding Domain.
+# Each worker process fills this in once, when it starts.
+_worker_domains = {}
+
+# The worker process's PlanCache, if the server was told to use one
+_worker_cache = None
+
+
+def _init_worker(modules, paths, cache_size=None, cache_file=None):
+    """
+    Import and freeze the domain modules in a worker process. Anything the
+    modules print while they're being imported is discarded.
+    """
+    sys.path[:0] = paths
+    with contextlib.redirect_stdout(io.StringIO()):
+        for module_name in modules:
+            old_domains = list(gtpyhop._domains)
+            importlib.import_module(module_name)
+            new_domains = [d for d in gtpyhop._domains if d not in old_domains]
+            for domain in new_domains:
+                _worker_domains[domain.__name__] = domain.freeze()
+            if new_domains:
+                _worker_domains[module_name] = new_domains[-1]
+    if cache_size or cache_file:
+        global _worker_cache
+        _worker_cache = gtpyhop.PlanCache(maxsize=cache_size or 1024,
+                                          path=cache_file)
+
+
+def _handle_request(line):
+    """
+    Decode one request line, run find_plan on it, and return the encoded
+    response line. This runs in a worker process.
+    """
+    request_id = None
+    try:
+        request = json.loads(line)
+        request_id = request.get('id')
+        domain_name = request.get('domain')
+        if domain_name is None and len(set(_worker_domains.values())) == 1:
+            domain = next(iter(_worker_domains.values()))
+        elif domain_name in _worker_domains:
+            domain = _worker_domains[domain_name]
+        else:
+            raise Exception(f"unknown domain {domain_name!r}")
+        state = _from_json(request['state'])
+        todo_list = list(_from_json(request['todo_list']))
+        budget = request.get('budget')
+        if budget is not None and \
+                (type(budget) not in (int, float) or not budget > 0):
+            raise Exception(f"budget must be a positive number, not {budget!r}")
+        planner = gtpyhop.Planner(domain, verbose=0, cache=_worker_cache)
+        start_time, start_cpu = time.perf_counter(), time.process_time()
+        # find_plan(..., stats=True) doesn't look in the cache, so look first
+        plan = None
+        if _worker_cache:
+            plan = _worker_cache.get(_worker_cache.key(domain, state, todo_list))
+        search_stats = None
+        if plan is None:
+            # find_plan checks the clock between nodes, so the budget never
+            # interrupts an action or method, or the worker's cache
+            (plan, search_stats) = planner.find_plan(state, todo_list,
+                                                     time_limit=budget, stats=True)
+        stats = {'time': time.perf_counter() - start_time,
+                 'cpu_time': time.process_time() - start_cpu,
+                 'plan_length': len(plan) if plan else 0,
+                 'worker': os.getpid()}
+        if _worker_cache:
+            stats['cache_hit'] = search_stats is None
+        if search_stats is not None:
+            stats['search'] = search_stats.as_dict()
+        response = {'id': request_id, 'plan': _to_json(plan) if plan != False
+                    else False, 'stats': stats}
+    except gtpyhop.PlanningTimeout:
+        response = {'id': request_id,
+                    'error': f"budget of {budget} seconds exceeded"}
+    except Exception as e:
+        response = {'id': request_id, 'error': f'{type(e).__name__}: {e}'}
+    return json.dumps(response)
+
+
+################################################################################
+# Code that runs in the server process
+
+
+def _request_id(line):
+    """
+    Return the 'id' of a request line, or None if the line doesn't have one
+    (or isn't a JSON object), for the responses that the server itself has
+    to make when a worker fails.
+    """
+    try:
+        request = json.loads(line)
+    except ValueError:
+        return None
+    return request.get('id') if isinstance(request, dict) else None
+
+
+async def _serve_connection(reader, writer, pool):
+    """
+    Read requests from one client connection, hand each of them to the
+    worker pool as soon as it arrives, and write each response as soon as
+    it's ready.
+    """
+    loop = asyncio.get_running_loop()
+    lock = asyncio.Lock()
+    pending = set()
+
+    async def answer(line):
+        try:
+            response = await loop.run_in_executor(pool, _handle_request, line)
+        except Exception as e:     # e.g., a worker process died
+            response = json.dumps({'id': _request_id(line),
+                                   'error': f'{type(e).__name__}: {e}'})
+        async with lock:
+            writer.write(response.encode() + b'\n')
+            await writer.drain()
+
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            if line.strip():
+                task = asyncio.ensure_future(answer(line))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+        if pending:
+            await asyncio.gather(*pending)
+    finally:
+        writer.close()
+
+
+async def serve(modules, socket_path=None, port=None, workers=None, paths=(),
+                cache_size=None, cache_file=None):
+    """
+    Start a worker pool that has imported the domain modules named in
+    'modules', and serve planning requests forever. Arguments:
+      - 'socket_path' is the name of a Unix-domain socket to listen on;
+      - otherwise 'port' is a TCP port to listen on at 127.0.0.1;
+      - 'workers' is the number of worker processes (default os.cpu_count());
+      - 'paths' are directories to add to sys.path in each worker;
+      - cache_size and cache_file (optional) tell each worker to use a
+        gtpyhop.PlanCache with that maxsize and on-disk file.
+    """
+    pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+        initializer=_init_worker,
+        initargs=(list(modules), list(paths), cache_size, cache_file))
+    # Make every worker import the domains now, rather than on first use.
+    n = workers or os.cpu_count() or 1
+    loop = asyncio.get_running_loop()
+    await asyncio.gather(*[loop.run_in_executor(pool, os.getpid)
+                           for _ in range(n)])
+    handler = lambda r, w: _serve_connection(r, w, pool)
+    if socket_path:
+        server = await asyncio.start_unix_server(handler, path=socket_path)
+        where = socket_path
+    else:
+        server = await asyncio.start_server(handler, host='127.0.0.1', port=port)
+        where = f'127.0.0.1:{port}'
+    print(f'gtpyhop_serve> serving {", ".join(modules)} on {where}',
+          f'with {n} workers', file=sys.stderr)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m gtpyhop_serve',
+        description='Serve GTPyhop planning requests from warm worker processes.')
+    parser.add_argument('modules', nargs='+',
+        help='names of the domain modules to import, e.g. blocks_htn')
+    where = parser.add_mutually_exclusive_group()
+    where.add_argument('--socket', help='path of a Unix-domain socket')
+    where.add_argument('--port', type=int, default=8765,
+        help='TCP port on 127.0.0.1 (default 8765)')
+    parser.add_argument('--workers', type=int, default=None,
+        help='number of worker processes (default: one per CPU)')
+    parser.add_argument('--path', action='append', default=[],
+        help='directory to search for domain modules (may be repeated)')
+    parser.add_argument('--cache-size', type=int, default=None,
+        help='cache up to this many results in each worker')
+    parser.add_argument('--cache-file',
+        help='SQLite file for a plan cache that the workers share')
+    args = parser.parse_args(argv)
+    paths = [os.path.abspath(p) for p in args.path] + [os.getcwd()]
+    try:
+        asyncio.run(serve(args.modules, socket_path=args.socket,
+                          port=args.port, workers=args.workers, paths=paths,
+                          cache_size=args.cache_size, cache_file=args.cache_file))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()